@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+
+'''
+Copyright (c) 2013, OmegaPhil - OmegaPhil+memcard-analyser@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# Synthetic memory card image generator and benchmarks of memcardanalyser's
+# parse, list and extract operations
+
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from optparse import OptionParser
+
+import memcardanalyser
+from memcardanalyser import (BLOCK_0_MAGIC, BLOCK_0_XOR, BLOCK_NORMAL_MAGIC,
+                             BLOCK_SIZE, DELETED_STATUS, FRAME_SIZE,
+                             GME_HEADER_SIZE, GME_MAGIC, LINK_NONE)
+
+
+# Initialising variables
+DEFAULT_SIZES = '1,10,100,1000'
+DEFAULT_SEED = 2013
+POOL_SIZE = 64  # Distinct cards generated - larger corpora link to these
+ALLOCATION_SAMPLE = 100  # Cards measured with tracemalloc per operation
+OPERATIONS = ('parse', 'list', 'extract')
+
+# Corruptions that can be applied to a generated card
+CORRUPTIONS = ('xor',  # A directory frame with the wrong checksum
+               'control',  # Invalid control block magic
+               'status',  # Unknown block status
+               'size',  # Truncated image
+               'unusable')  # A block flagged as unusable (0xFF)
+
+# Title material - full-width and half-width Shift-JIS, followed by junk
+# that titles sometimes have after their terminator
+TITLE_WORDS = ('ＦＦ８', 'ＧＴ２', 'ｇａｍｅ', 'ｄａｔａ', 'セーブ', 'ファイル',
+               'ＳＡＶＥ', 'Save', 'GAME', '［０１］', '／', '：', '　')
+TITLE_JUNK = (b'', b'\x00', b'\x00\xff\x13\x88', b'\x00\x82\xa0\x00garbage',
+              b'\x81')  # The last is a lone lead byte
+COUNTRY_CODES = ('BI', 'BA', 'BE', 'bi')
+PRODUCT_PREFIXES = ('SLES-', 'SCES-', 'SLUS-', 'SCUS-', 'SLPS-', 'SLESP')
+
+
+def xor_frame(frame):
+    '''Sets the last byte of the passed frame (a bytearray) to the XOR of the
+    rest'''
+
+    accumulator = 0
+    for byte in frame[:FRAME_SIZE - 1]:
+        accumulator ^= byte
+    frame[FRAME_SIZE - 1] = accumulator
+
+
+def generate_title(rng):
+    '''Returns 64 bytes of (possibly messy) Shift-JIS encoded title'''
+
+    title = ''.join(rng.choice(TITLE_WORDS)
+                    for i in range(rng.randint(1, 6))).encode('shift-jis')
+    title = (title[:60] + rng.choice(TITLE_JUNK))[:64]
+    return title.ljust(64, b'\x00')
+
+
+def generate_card(rng, cardFormat='mcd', corruptions=(), deletedRatio=0.2,
+                  interleave=True):
+    '''Returns the bytes of a synthetic memory card image with a random set
+    of single and multiblock saves, some of them deleted. Multiblock saves
+    are chained through next block links and, when interleave is set, may
+    use non-contiguous blocks. The passed corruptions are applied'''
+
+    controlBlock = bytearray(BLOCK_SIZE)
+    dataBlocks = [bytearray(BLOCK_SIZE) for i in range(15)]
+
+    # Header frame
+    controlBlock[:len(BLOCK_0_MAGIC)] = BLOCK_0_MAGIC
+    controlBlock[FRAME_SIZE - 1] = BLOCK_0_XOR
+
+    # Allocating blocks to saves - free blocks are shuffled when
+    # interleaving so that chains jump about
+    freeBlocks = list(range(1, 16))
+    if interleave:
+        rng.shuffle(freeBlocks)
+    statuses = {blockNumber: 0xA0 for blockNumber in range(1, 16)}
+    links = {blockNumber: LINK_NONE for blockNumber in range(1, 16)}
+    firstBlocks = {}
+    while freeBlocks and rng.random() < 0.9:
+
+        # Deleted saves keep their links, with the deleted statuses of
+        # their blocks
+        deleted = rng.random() < deletedRatio
+        length = min(rng.choice((1, 1, 1, 2, 3, 5)), len(freeBlocks))
+        chain = freeBlocks[:length]
+        del freeBlocks[:length]
+
+        # Recording the chain
+        for position, blockNumber in enumerate(chain):
+            if position == 0:
+                statuses[blockNumber] = 0x51
+            elif position == length - 1:
+                statuses[blockNumber] = 0x53
+            else:
+                statuses[blockNumber] = 0x52
+            if deleted:
+                statuses[blockNumber] = DELETED_STATUS[statuses[blockNumber]]
+            if position < length - 1:
+                links[blockNumber] = chain[position + 1] - 1
+        firstBlocks[chain[0]] = length
+
+    # Directory frames
+    for blockNumber in range(1, 16):
+        frame = bytearray(FRAME_SIZE)
+        frame[0] = statuses[blockNumber]
+        frame[8:10] = links[blockNumber].to_bytes(2, 'little')
+        if blockNumber in firstBlocks:
+            frame[4:7] = (firstBlocks[blockNumber] * BLOCK_SIZE).to_bytes(
+                3, 'little')
+            code = (rng.choice(COUNTRY_CODES) + rng.choice(PRODUCT_PREFIXES) +
+                    '%05d' % rng.randint(0, 99999) + 'S%07d' %
+                    rng.randint(0, 9999999)).encode('ascii')
+            frame[10:10 + len(code)] = code[:20]
+        elif statuses[blockNumber] in (0x52, 0x53, 0xA2, 0xA3):
+            frame[4:7] = BLOCK_SIZE.to_bytes(3, 'little')
+        xor_frame(frame)
+        controlBlock[blockNumber * FRAME_SIZE:
+                     (blockNumber + 1) * FRAME_SIZE] = frame
+
+    # Broken sector list frames - no broken sectors
+    for frameNumber in range(16, 36):
+        frame = bytearray(FRAME_SIZE)
+        frame[0:4] = b'\xff\xff\xff\xff'
+        frame[8:10] = b'\xff\xff'
+        xor_frame(frame)
+        controlBlock[frameNumber * FRAME_SIZE:
+                     (frameNumber + 1) * FRAME_SIZE] = frame
+
+    # Data blocks - the first block of a save has its header and title,
+    # the rest is noise
+    for blockNumber in range(1, 16):
+        block = dataBlocks[blockNumber - 1]
+        if statuses[blockNumber] != 0xA0:
+            block[:] = rng.randbytes(BLOCK_SIZE)
+        if blockNumber in firstBlocks:
+            block[:2] = BLOCK_NORMAL_MAGIC
+            block[2] = rng.choice((0x11, 0x12, 0x13))  # Icon display flag
+            block[3] = firstBlocks[blockNumber]
+            block[4:68] = generate_title(rng)
+
+    # Applying corruptions
+    if 'xor' in corruptions:
+        frameNumber = rng.randint(1, 15)
+        controlBlock[frameNumber * FRAME_SIZE + FRAME_SIZE - 1] ^= 0x07
+    if 'control' in corruptions:
+        controlBlock[0:2] = b'XX'
+    if 'status' in corruptions:
+        frameNumber = rng.randint(1, 15)
+        controlBlock[frameNumber * FRAME_SIZE] = 0x42
+        xor_frame(memoryview(controlBlock)[frameNumber * FRAME_SIZE:
+                                           (frameNumber + 1) * FRAME_SIZE])
+    if 'unusable' in corruptions:
+        frameNumber = rng.randint(1, 15)
+        controlBlock[frameNumber * FRAME_SIZE] = 0xFF
+
+    # Assembling the image
+    image = bytes(controlBlock) + b''.join(dataBlocks)
+    if cardFormat == 'gme':
+        image = GME_MAGIC.ljust(GME_HEADER_SIZE, b'\x00') + image
+    if 'size' in corruptions:
+        image = image[:rng.randint(0, len(image) - 1)]
+    return image
+
+
+def generate_corpus(directory, size, seed=DEFAULT_SEED, corruptRatio=0.0):
+    '''Writes a corpus of synthetic memory card images to the directory and
+    returns their paths. Only POOL_SIZE distinct cards are generated - the
+    rest of the corpus is hard links to them (or copies, where links aren't
+    supported)'''
+
+    rng = random.Random(seed)
+    paths = []
+    for cardNumber in range(size):
+        cardFormat = ('mcd', 'gme')[cardNumber % 2]
+        path = os.path.join(directory, 'card_%06d.%s' % (cardNumber,
+                                                         cardFormat))
+
+        if cardNumber < POOL_SIZE:
+
+            # Generating a new card, corrupting some of them
+            corruptions = ()
+            if rng.random() < corruptRatio:
+                corruptions = (rng.choice(CORRUPTIONS),)
+            with io.open(path, 'wb') as cardFile:
+                cardFile.write(generate_card(rng, cardFormat, corruptions))
+
+        else:
+
+            # Reusing a pool card of the same format
+            source = paths[cardNumber % POOL_SIZE]
+            try:
+                os.link(source, path)
+            except OSError:
+                shutil.copyfile(source, path)
+
+        paths.append(path)
+    return paths
+
+
+def run_operation(operation, cardPath, outputDirectory, memoryMap, lazy):
+    '''Runs one benchmarked operation on the card'''
+
+    with memcardanalyser.PS1Card(cardPath, memoryMap=memoryMap,
+                                 lazy=lazy) as memoryCard:
+        if operation == 'list':
+
+            # Listing as --list does, into a null sink rather than a terminal
+            with io.open(os.devnull, 'w') as nullFile, \
+                    contextlib.redirect_stdout(nullFile):
+                memoryCard.list()
+        elif operation == 'extract':
+            memoryCard.extract_all(outputDirectory, includeDeleted=True)
+
+
+def benchmark(operation, paths, outputDirectory, memoryMap=False, lazy=False):
+    '''Returns (seconds, failures, average peak bytes allocated per card)
+    for the operation across the passed cards'''
+
+    # Timing all cards without tracing, as tracemalloc is slow
+    failures = 0
+    start = time.perf_counter()
+    for cardPath in paths:
+        try:
+            run_operation(operation, cardPath, outputDirectory, memoryMap,
+                          lazy)
+        except Exception:
+            failures += 1
+    seconds = time.perf_counter() - start
+
+    # Measuring allocations on a sample of the cards
+    sample = paths[:ALLOCATION_SAMPLE]
+    peakTotal = 0
+    tracemalloc.start()
+    for cardPath in sample:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        try:
+            run_operation(operation, cardPath, outputDirectory, memoryMap,
+                          lazy)
+        except Exception:
+            pass
+        peakTotal += tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    return seconds, failures, peakTotal // max(len(sample), 1)
+
+
+def main(argv=None):
+    '''Command line entry point - argv defaults to the program's arguments'''
+
+    # Configuring and parsing passed options
+    parser = OptionParser(usage='%prog [options]\n       %prog --generate '
+                          '<directory> [options]')
+    parser.add_option('-c', '--corrupt', dest='corrupt', type='float',
+        help='ratio of generated cards that are deliberately corrupt '
+        '(default: 0)', metavar='ratio', default=0.0)
+    parser.add_option('-g', '--generate', dest='generate', help='only '
+        'generate a corpus of the largest size in the given directory',
+        metavar='directory', default=None)
+    parser.add_option('-l', '--lazy', dest='lazy', help='parse cards lazily',
+        action='store_true', default=False)
+    parser.add_option('-m', '--mmap', dest='mmap', help='memory map cards',
+        action='store_true', default=False)
+    parser.add_option('-o', '--operations', dest='operations', help='comma '
+        'separated operations to benchmark (default: %s)' %
+        ','.join(OPERATIONS), metavar='operations',
+        default=','.join(OPERATIONS))
+    parser.add_option('-s', '--sizes', dest='sizes', help='comma separated '
+        'corpus sizes to benchmark (default: %s)' % DEFAULT_SIZES,
+        metavar='sizes', default=DEFAULT_SIZES)
+    parser.add_option('-S', '--seed', dest='seed', type='int', help='random '
+        'seed for the generated cards (default: %d)' % DEFAULT_SEED,
+        metavar='seed', default=DEFAULT_SEED)
+    (options, args) = parser.parse_args(argv)
+
+    # Validating options
+    try:
+        sizes = [int(size) for size in options.sizes.split(',')]
+    except ValueError:
+        parser.error('Invalid corpus sizes \'%s\'' % options.sizes)
+    operations = options.operations.split(',')
+    for operation in operations:
+        if operation not in OPERATIONS:
+            parser.error('Unknown operation \'%s\'' % operation)
+
+    # Only generating a corpus
+    if options.generate:
+        if not os.path.isdir(options.generate):
+            os.makedirs(options.generate)
+        paths = generate_corpus(options.generate, max(sizes), options.seed,
+                                options.corrupt)
+        print('%d cards generated in \'%s\'' % (len(paths), options.generate))
+        return
+
+    # Warnings about corrupt cards would drown out the results
+    stderr = sys.stderr
+    sys.stderr = io.StringIO()
+
+    try:
+        print('%-8s %8s %10s %12s %10s %16s' % ('Op', 'Cards', 'Seconds',
+                                               'Cards/s', 'Failures',
+                                               'Peak B/card'))
+        for size in sizes:
+            corpusDirectory = tempfile.mkdtemp(prefix='memcard-benchmark-')
+            try:
+                paths = generate_corpus(corpusDirectory, size, options.seed,
+                                        options.corrupt)
+                outputDirectory = os.path.join(corpusDirectory, 'saves')
+                for operation in operations:
+                    seconds, failures, peak = benchmark(operation, paths,
+                        outputDirectory, options.mmap, options.lazy)
+                    print('%-8s %8d %10.3f %12.1f %10d %16d' %
+                          (operation, size, seconds,
+                           size / seconds if seconds else 0, failures, peak))
+                    sys.stderr.seek(0)
+                    sys.stderr.truncate()
+            finally:
+                shutil.rmtree(corpusDirectory)
+
+    finally:
+        sys.stderr = stderr
+
+
+if __name__ == '__main__':
+    main()
@@ -25,11 +25,15 @@ This is free software: you are free to change and redistribute it.
 There is NO WARRANTY, to the extent permitted by law.
 '''
 
+import atexit
+import contextlib
+import errno
+import functools
 import io
+import mmap
 import os.path
-import string
 import sys
-import unicodedata
+import time
 
 from optparse import OptionParser
 
@@ -45,8 +49,19 @@ VERSION = '0.10'  # Remember version in copyright notice
 IMAGE_SIZE = 131072
 GME_MAGIC = b'123-456-STD'
 GME_HEADER_SIZE = 3904
+GME_STATUS_OFFSET = 22  # Status byte of each slot (block 1-15)
+GME_LINK_OFFSET = 38    # Low byte of the next block link of each slot
+GME_COMMENT_OFFSET = 64  # DexDrive comment table - a comment per save slot
+GME_COMMENT_SIZE = 256   # (block 1-15)
 MCD_MAGIC = b'MC'
 MCD_HEADER_SIZE = 0
+VGS_MAGIC = b'VgsM'  # Connectix Virtual Game Station
+VGS_HEADER_SIZE = 64
+VMP_MAGIC = b'\x00PMV'  # PSP/PS3 virtual memory card
+VMP_HEADER_SIZE = 128
+PSV_MAGIC = b'\x00VSP'  # PS3 exported single save
+FORMAT_PROBE_SIZE = 512  # Bytes read from the start of a file to determine
+                         # its format
 
 # Memory card data structure
 BLOCK_0_MAGIC_START = b'MC'
@@ -56,18 +71,29 @@ BLOCK_NORMAL_MAGIC = b'SC'
 FRAME_SIZE = 128
 FRAMES_IN_BLOCK = 64
 BLOCK_SIZE = FRAME_SIZE * FRAMES_IN_BLOCK
+SAVE_HEADER_SIZE = 4 * FRAME_SIZE  # Title, icon etc frames skipped when
+                                   # extracting
+CHECKSUMMED_FRAMES = 36  # Control block frames ending in an XOR checksum -
+                         # header, directory and broken sector list frames
 BLOCK_STATUS = {0x51: 'First block',   # Integers need to be used as a single
                 0x52: 'Middle block',  # byte indexed is an integer
                 0x53: 'Last block',
                 0xA0: 'Unused block',
                 0xA1: 'Deleted block',
+                0xA2: 'Deleted middle block',
+                0xA3: 'Deleted last block',
                 0xFF: 'Unusable block'}
 BLOCK_VALID_INFORMATION = {0xA0: False,  # Used to determine whether a
                 0xA1: True,  # particular block's data should be reported on
                 0x51: True,
                 0x52: False,
                 0x53: False,
+                0xA2: False,
+                0xA3: False,
                 0xFF: False}
+DELETED_STATUS = {0x51: 0xA1,  # Status of a block once its save is deleted
+                  0x52: 0xA2,
+                  0x53: 0xA3}
 SAVE_LENGTH = {b'\x00\x20\x00': '1 block',
                b'\x00\x40\x00': '2 blocks',
                b'\x00\x60\x00': '3 blocks',
@@ -90,59 +116,1276 @@ COUNTRY_CODE = {'BI': 'Japan',  # Road Rash has saves which use the lower
                  'BE': 'Europe',
                  'be': 'Europe'}
 
-# Creating a translation table to map non-printables to full stop
-# (periods for Americans). Specifically ignoring whitespace here
-# The 'in string.printable' is used as a test to then index the first
-# list resulting in the appropriate replacement characters
-# Credit: http://stackoverflow.com/a/1800889
-# I have moved from Python 2 to 3 finally due to bullshit with this
-# translationTable and how it is used. With the unicode_literals
-# future import, the string literals used here result in this variable
-# being unicode - this should be irrelevant as the whole point is to
-# replace out all but the boring normal ASCII characters with '.'.
-# However, as soon as translationTable is used in the translate
-# method, you get a UnicodeDecodeError complaining about trying to
-# interpret the data as ASCII. Fail!
-# In Python 3, this table is used with bytes data and therefore due to
-# stubbornness it must be encoded via ASCII to bytes...
-translationTable = bytes(''.join([['.', chr(x)][chr(x) in string.printable]
-                            for x in range(256)]), 'ascii')
+# Batch mode - file extensions picked up when walking directories (explicitly
+# passed files are always analysed), and how many cards are allowed to be
+# queued per worker process so that huge corpora aren't held in memory
+CARD_EXTENSIONS = ('.gme', '.mcd', '.mcr')  # Extended by register_format
+BATCH_QUEUE_PER_WORKER = 4
+
+# Archives - cards inside them are referred to as '<archive>::<member>', e.g.
+# 'bundle.zip::cards/ff8.mcd'. Archives found when walking directories have
+# their card members analysed, and a few are kept open per process so that
+# their member lists are only read once
+ARCHIVE_SEPARATOR = '::'
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2',
+                      '.tar.xz', '.txz')
+ARCHIVE_CACHE_SIZE = 4
+
+# Format conversion - formats memory card images can be converted to, and
+# the extension of converted images. mcd and mcr are both raw card data
+CONVERT_FORMATS = {'gme': '.gme', 'mcd': '.mcd', 'mcr': '.mcr'}
+
+# Card index database schema - bump the version when changing it
+INDEX_SCHEMA_VERSION = 2
+INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cards (
+    cardId INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    hash TEXT,
+    format TEXT,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    cardId INTEGER NOT NULL REFERENCES cards (cardId),
+    blockNumber INTEGER NOT NULL,
+    statusByte INTEGER NOT NULL,
+    saveLength INTEGER,
+    nextBlock INTEGER,
+    chain TEXT,
+    countryCode TEXT,
+    productCode TEXT,
+    gamePlayThroughIdentifier TEXT,
+    title TEXT,
+    normalisedTitle TEXT,
+    PRIMARY KEY (cardId, blockNumber)
+);
+CREATE INDEX IF NOT EXISTS blocksProductCode ON blocks (productCode);
+CREATE INDEX IF NOT EXISTS blocksCountryCode ON blocks (countryCode);
+CREATE INDEX IF NOT EXISTS blocksStatusByte ON blocks (statusByte);
+CREATE INDEX IF NOT EXISTS blocksSaveLength ON blocks (saveLength);
+'''
+INDEX_COMMIT_INTERVAL = 1000  # Cards indexed between commits
+
+# In place writes are made crash-safe with a redo journal next to the image
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_MAGIC = b'MCAJ'
+
+# Analysis daemon
+DEFAULT_CACHE_SIZE = 64  # MiB of parsed card images kept in memory
+
+# Watch mode - changes to a card are only processed once it has been left
+# alone for the debounce period, and directories are rescanned at the poll
+# interval when inotify isn't available
+WATCH_DEBOUNCE = 0.5
+WATCH_POLL_INTERVAL = 2.0
+INOTIFY_MASK = (0x00000002 |  # IN_MODIFY
+                0x00000008 |  # IN_CLOSE_WRITE
+                0x00000040 |  # IN_MOVED_FROM
+                0x00000080 |  # IN_MOVED_TO
+                0x00000100 |  # IN_CREATE
+                0x00000200)   # IN_DELETE
+INOTIFY_ISDIR = 0x40000000
+INOTIFY_OVERFLOW = 0x00004000
+LINK_NONE = 0xFFFF  # Next block link of the last block in a save
+
+# Format used when listing a block
+BLOCK_LISTING = ('\nBlock %(blockNumber)d:\nStatus: %(status)s\nTitle: \''
+                 '%(title)s\'\nSave length: %(saveLength)s\n'
+                 'Country code: %(countryCode)s\nProduct code: %(productCode)s\n'
+                 'Game playthrough identifier: %(gamePlayThroughIdentifier)s\n'
+                 '\'File name\': %(filename)s')
+
+# Machine readable listing formats, and the fields of each record in order
+LISTING_FORMATS = ('text', 'jsonl', 'csv', 'tsv')
+LISTING_FIELDS = ('path', 'blockNumber', 'statusByte', 'status', 'saveLength',
+                  'chain', 'region', 'countryCode', 'productCode',
+                  'gamePlayThroughIdentifier', 'title')
+
+# Save titles - decoded titles are cached per process as they repeat heavily
+# across cards. Titles end at the first control character, and as Shift-JIS
+# second bytes are never control characters, this can be found before
+# decoding by translating them all to nulls
+TITLE_CACHE_SIZE = 4096
+TITLE_TERMINATORS = bytes(0 if byte < 0x20 or byte == 0x7F else byte
+                          for byte in range(256))
+
+# Phases timed by --stats, in the order they are reported
+STATS_PHASES = ('load', 'detect', 'directory', 'checksum', 'title',
+                'extract')
+
+# Save recovery - save headers follow the magic with the icon display flag
+# (static icon, 2 or 3 frame animation) and the save length in blocks.
+# Recovered chains are trusted according to how they were rebuilt
+SAVE_ICON_FLAGS = (0x11, 0x12, 0x13)
+
+# Save icons - 16x16 pixels, 4 bits per pixel, indexed into a 16 colour
+# 15-bit BGR palette in the header frame. The console advances animated
+# icons every few vertical blanks (at 60Hz)
+ICON_PALETTE_OFFSET = 0x60
+ICON_SIZE = 16
+ICON_FRAME_VBLANKS = {2: 16, 3: 11}
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+CHAIN_CONFIDENCE = {'directory': 1.0,   # Directory links agree with the header
+                    'contiguous': 0.8,  # Blocks following the header
+                    'unclaimed': 0.5,   # Next blocks no other save uses
+                    None: 0.25}         # Only the header is recoverable
+
+# fsck - problem classes in the order they are reported, those that --repair
+# can safely fix, and exit codes, which follow fsck(8) and are combined
+FSCK_PROBLEMS = ('wrong-size',         # File size doesn't match its format
+                 'bad-magic',          # Not a memory card or bad block 0
+                 'invalid-status',     # Unknown directory status byte
+                 'checksum-mismatch',  # Control block frame XOR is wrong
+                 'broken-chain',       # Save's links dangle or loop
+                 'length-mismatch',    # Save length disagrees with its chain
+                 'orphan-block',       # Save header or linked block that no
+                                       # save uses
+                 'invalid-region')     # Unknown country code
+FSCK_REPAIRABLE = ('checksum-mismatch', 'length-mismatch')
+FSCK_EXIT_REPAIRED = 1
+FSCK_EXIT_UNREPAIRED = 4
+FSCK_EXIT_ERROR = 8
+FSCK_EXIT_USAGE = 16
+
+
+def translation_table():
+    '''Returns a translation table mapping non-printable bytes to '.' -
+    only used when debugging, so built on demand'''
+
+    import string
+
+    # Creating a translation table to map non-printables to full stop
+    # (periods for Americans). Specifically ignoring whitespace here
+    # The 'in string.printable' is used as a test to then index the first
+    # list resulting in the appropriate replacement characters
+    # Credit: http://stackoverflow.com/a/1800889
+    # I have moved from Python 2 to 3 finally due to bullshit with this
+    # translationTable and how it is used. With the unicode_literals
+    # future import, the string literals used here result in this variable
+    # being unicode - this should be irrelevant as the whole point is to
+    # replace out all but the boring normal ASCII characters with '.'.
+    # However, as soon as translationTable is used in the translate
+    # method, you get a UnicodeDecodeError complaining about trying to
+    # interpret the data as ASCII. Fail!
+    # In Python 3, this table is used with bytes data and therefore due to
+    # stubbornness it must be encoded via ASCII to bytes...
+    return bytes(''.join([['.', chr(x)][chr(x) in string.printable]
+                          for x in range(256)]), 'ascii')
+
+
+# Image formats by name, in the order they are probed - see register_format
+CARD_FORMATS = {}
+
+
+class PhaseTimer(object):
+    '''Context manager adding the wall time of its block and the bytes it
+    processes to a phase's counters in PhaseTimer.stats (phase name: [calls,
+    seconds, bytes]). Nothing is recorded unless stats is set to a
+    dictionary'''
+
+    __slots__ = ('phase', 'byteCount', 'start')
+    stats = None
+
+    def __init__(self, phase, byteCount=0):
+        self.phase = phase
+        self.byteCount = byteCount
+
+    def __enter__(self):
+        if PhaseTimer.stats is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if PhaseTimer.stats is not None:
+            counters = PhaseTimer.stats.setdefault(self.phase, [0, 0.0, 0])
+            counters[0] += 1
+            counters[1] += time.perf_counter() - self.start
+            counters[2] += self.byteCount
+
+
+def merge_stats(stats):
+    '''Adds the passed phase counters (e.g. from a worker process) to
+    PhaseTimer.stats'''
+
+    for phase, (calls, seconds, byteCount) in stats.items():
+        counters = PhaseTimer.stats.setdefault(phase, [0, 0.0, 0])
+        counters[0] += calls
+        counters[1] += seconds
+        counters[2] += byteCount
+
+
+def run_with_stats(worker, cardPath):
+    '''Runs the worker with phase timing enabled, returning its result and
+    the phase counters it recorded - used in worker processes'''
+
+    PhaseTimer.stats = {}
+    return worker(cardPath), PhaseTimer.stats
+
+
+def format_stats(stats, outputFormat='table'):
+    '''Returns the passed phase counters as a table, or as a JSON object
+    ('json') of phases with their calls, seconds and bytes'''
+
+    import json
+
+    phases = ([phase for phase in STATS_PHASES if phase in stats] +
+              sorted(phase for phase in stats if phase not in STATS_PHASES))
+    if outputFormat == 'json':
+        return json.dumps(dict((phase, {'calls': stats[phase][0],
+                                        'seconds': stats[phase][1],
+                                        'bytes': stats[phase][2]})
+                               for phase in phases))
+
+    lines = ['%-10s %10s %12s %14s %10s' % ('Phase', 'Calls', 'Seconds',
+                                            'Bytes', 'MiB/s')]
+    for phase in phases:
+        calls, seconds, byteCount = stats[phase]
+        lines.append('%-10s %10d %12.6f %14d %10.1f' %
+                     (phase, calls, seconds, byteCount,
+                      byteCount / seconds / 1048576 if seconds else 0))
+    return '\n'.join(lines)
+
+
+def decode_title(titleBytes, normalise=False):
+    '''Decodes the passed Shift-JIS save title, ending it at the first
+    control character - invalid characters are replaced. With normalise,
+    full-width characters are converted to ASCII (NFKC normalisation) for
+    searching'''
+
+    return _decode_title(bytes(titleBytes), normalise)
+
+
+@functools.lru_cache(maxsize=TITLE_CACHE_SIZE)
+def _decode_title(titleBytes, normalise):
+    '''Cached implementation of decode_title - titleBytes must be bytes so
+    that it can be hashed'''
+
+    # Ending the title at the first control character
+    end = titleBytes.translate(TITLE_TERMINATORS).find(b'\x00')
+    if end != -1:
+        titleBytes = titleBytes[:end]
+
+    title = titleBytes.decode('shift-jis', 'replace')
+    if normalise:
+        import unicodedata
+        title = unicodedata.normalize('NFKC', title)
+    return title
+
+
+def register_format(name, probe, dataOffset=0, imageSize=None,
+                    extensions=(), singleSave=False):
+    '''Registers an image format. probe is called with the first
+    FORMAT_PROBE_SIZE bytes and the size of a file, returning True if the file
+    is in this format - it should not rely on the size alone, so that
+    truncated images are reported as such. dataOffset is the offset of the
+    memory card data in the file, or a function of the header returning it.
+    imageSize is the correct size of the file, if fixed. Single save formats
+    are recognised but can't be loaded as a memory card'''
+
+    global CARD_EXTENSIONS
+
+    CARD_FORMATS[name] = {'name': name,
+                          'probe': probe,
+                          'dataOffset': dataOffset,
+                          'imageSize': imageSize,
+                          'singleSave': singleSave}
+
+    # Extensions of memory card formats are picked up when walking
+    # directories in batch mode
+    if not singleSave:
+        CARD_EXTENSIONS += tuple(extension for extension in extensions
+                                 if extension not in CARD_EXTENSIONS)
+
+
+def detect_format(header, fileSize):
+    '''Returns the registered format matching the passed start of a file and
+    its size, or None if the format is unknown'''
+
+    for cardFormat in CARD_FORMATS.values():
+        if cardFormat['probe'](header, fileSize):
+            return cardFormat
+    return None
+
+
+def magic_probe(magic):
+    '''Returns a format probe that matches files starting with magic'''
+
+    return lambda header, fileSize: header[:len(magic)] == magic
+
+
+def _mcs_probe(header, fileSize):
+    '''Format probe for single saves - a control block frame followed by the
+    save's blocks'''
+
+    return (header[:1] in (b'\x51', b'\xa1') and
+            header[10:11] in (b'B', b'b') and
+            fileSize > FRAME_SIZE and (fileSize - FRAME_SIZE) % BLOCK_SIZE == 0)
+
+
+# Registering the supported formats
+register_format('gme', magic_probe(GME_MAGIC), GME_HEADER_SIZE,
+                IMAGE_SIZE + GME_HEADER_SIZE, ('.gme',))
+register_format('mcd', magic_probe(MCD_MAGIC), MCD_HEADER_SIZE, IMAGE_SIZE,
+                ('.mcd', '.mcr', '.ddf', '.mc'))
+register_format('vgs', magic_probe(VGS_MAGIC), VGS_HEADER_SIZE,
+                IMAGE_SIZE + VGS_HEADER_SIZE, ('.vgs', '.mem'))
+register_format('vmp', magic_probe(VMP_MAGIC), VMP_HEADER_SIZE,
+                IMAGE_SIZE + VMP_HEADER_SIZE, ('.vmp',))
+register_format('psv', magic_probe(PSV_MAGIC), extensions=('.psv',),
+                singleSave=True)
+register_format('mcs', _mcs_probe, extensions=('.mcs',), singleSave=True)
+
+
+def gme_slot_bytes(controlBlock):
+    '''Returns the status bytes and (low) link bytes of the directory frames
+    in the passed control block, in slot order, as DexDrive (GME) headers
+    repeat them'''
+
+    return (bytes(controlBlock[FRAME_SIZE:16 * FRAME_SIZE:FRAME_SIZE]),
+            bytes(controlBlock[FRAME_SIZE + 8:16 * FRAME_SIZE:FRAME_SIZE]))
+
+
+def gme_header(controlBlock, comments=b''):
+    '''Returns a DexDrive (GME) header for a memory card with the passed
+    control block - the header repeats the status and link bytes of each
+    directory frame. comments is the per-slot comment table (GME_COMMENT_SIZE
+    bytes per slot), empty by default'''
+
+    header = bytearray(GME_HEADER_SIZE)
+    header[:len(GME_MAGIC)] = GME_MAGIC
+
+    # Bytes always set by DexDrive
+    header[18] = 0x01
+    header[20] = 0x01
+    header[21] = ord('M')
+
+    # Status and (low) link bytes of the slots
+    statuses, links = gme_slot_bytes(controlBlock)
+    header[GME_STATUS_OFFSET:GME_STATUS_OFFSET + 15] = statuses
+    header[GME_LINK_OFFSET:GME_LINK_OFFSET + 15] = links
+
+    header[GME_COMMENT_OFFSET:GME_COMMENT_OFFSET + len(comments)] = comments
+    return bytes(header)
+
+
+def probe_card_file(cardPath):
+    '''Returns the registered format of the passed file (or archive member)
+    from its first few bytes and size, or None if it isn't a known format'''
+
+    if split_archive_path(cardPath)[1] is not None:
+        memberFile, memberSize = open_archive_member(cardPath)
+        with memberFile:
+            return detect_format(memberFile.read(FORMAT_PROBE_SIZE),
+                                 memberSize)
+
+    with io.open(cardPath, 'rb') as cardFile:
+        return detect_format(cardFile.read(FORMAT_PROBE_SIZE),
+                             os.fstat(cardFile.fileno()).st_size)
+
+
+def split_archive_path(cardPath):
+    '''Returns the (archive path, member name) of a path to a card inside an
+    archive, or (cardPath, None) for a normal file'''
+
+    archivePath, separator, memberName = cardPath.partition(ARCHIVE_SEPARATOR)
+    if not separator or not memberName:
+        return (cardPath, None)
+    return (archivePath, memberName)
+
+
+def card_exists(cardPath):
+    '''Returns whether the passed card file (or archive member) exists'''
+
+    if split_archive_path(cardPath)[1] is None:
+        return os.path.exists(cardPath)
+    try:
+        open_archive_member(cardPath)[0].close()
+    except Exception:
+        return False
+    return True
+
+
+def card_file_stat(cardPath):
+    '''Returns the stat of the file holding the card - the archive itself for
+    archive members'''
+
+    return os.stat(split_archive_path(cardPath)[0])
+
+
+def read_archive(archivePath):
+    '''Opens the passed zip or tar archive for reading'''
+
+    import tarfile
+    import zipfile
+
+    if not os.path.isfile(archivePath):
+        raise Exception('The passed archive \'%s\' does not exist' %
+                        archivePath)
+    if zipfile.is_zipfile(archivePath):
+        return zipfile.ZipFile(archivePath)
+    if tarfile.is_tarfile(archivePath):
+        return tarfile.open(archivePath, 'r:*')
+    raise Exception('The passed archive \'%s\' is not a zip or tar archive'
+                    % archivePath)
+
+
+# Archives opened by this process, most recently used last. Entries are
+# (archive, members found so far), keyed on the archive's path, mtime and
+# size so that a changed archive is reopened
+_openArchives = {}
+
+
+def open_archive(archivePath):
+    '''Returns the (archive, members) entry for the passed archive, opening it
+    if it isn't already open. Tar member headers are read lazily as members
+    are looked for, so that compressed archives are only decompressed as far
+    as needed'''
+
+    try:
+        archiveStat = os.stat(archivePath)
+    except OSError:
+        raise Exception('The passed archive \'%s\' does not exist' %
+                        archivePath)
+    key = (archivePath, archiveStat.st_mtime_ns, archiveStat.st_size)
+
+    # Already open - marking as most recently used
+    entry = _openArchives.pop(key, None)
+    if entry is not None:
+        _openArchives[key] = entry
+        return entry
+
+    # Opening the archive, closing the least recently used ones to make room
+    archive = read_archive(archivePath)
+    while len(_openArchives) >= ARCHIVE_CACHE_SIZE:
+        oldestKey = next(iter(_openArchives))
+        _openArchives.pop(oldestKey)[0].close()
+
+    entry = _openArchives[key] = (archive, {})
+    return entry
+
+
+def archive_card_paths(archivePath):
+    '''Generator of the paths of card image members of the passed archive, in
+    archive order. The archive is opened separately from those members are
+    read from, so that worker processes forked while listing don't share its
+    file position'''
+
+    import zipfile
+
+    with read_archive(archivePath) as archive:
+        if isinstance(archive, zipfile.ZipFile):
+            memberNames = (memberInfo.filename for memberInfo
+                           in archive.infolist() if not memberInfo.is_dir())
+        else:
+            memberNames = (memberInfo.name for memberInfo in archive
+                           if memberInfo.isfile())
+        for memberName in memberNames:
+            if memberName.lower().endswith(CARD_EXTENSIONS):
+                yield archivePath + ARCHIVE_SEPARATOR + memberName
+
+
+def open_archive_member(cardPath):
+    '''Returns a (file object, size) tuple for streaming the passed archive
+    member - the member is decompressed as it is read'''
+
+    import zipfile
+
+    archivePath, memberName = split_archive_path(cardPath)
+    archive, members = open_archive(archivePath)
+
+    # Zip archives have a central directory to look members up in
+    if isinstance(archive, zipfile.ZipFile):
+        try:
+            memberInfo = archive.getinfo(memberName)
+        except KeyError:
+            memberInfo = None
+        if memberInfo is not None and not memberInfo.is_dir():
+            return (archive.open(memberInfo), memberInfo.file_size)
+
+    # Tar member headers are read until the member is found
+    else:
+        memberInfo = members.get(memberName)
+        while memberInfo is None:
+            nextInfo = archive.next()
+            if nextInfo is None:
+                break
+            members.setdefault(nextInfo.name, nextInfo)
+            if nextInfo.name == memberName:
+                memberInfo = nextInfo
+        if memberInfo is not None and memberInfo.isfile():
+            return (archive.extractfile(memberInfo), memberInfo.size)
+
+    raise Exception('The passed memory card \'%s\' does not exist' %
+                    cardPath)
+
+
+@contextlib.contextmanager
+def open_card_image(cardPath):
+    '''Context manager giving the whole of the passed card file (or archive
+    member) as a buffer, memory mapped where possible - for files that might
+    not be valid memory card images'''
+
+    # Archive members can't be mapped, so are read in whole
+    if split_archive_path(cardPath)[1] is not None:
+        memberFile, memberSize = open_archive_member(cardPath)
+        with memberFile:
+            image = bytearray(memberSize)
+            del image[read_archive_member(memberFile, image):]
+        yield image
+        return
+
+    if not os.path.isfile(cardPath):
+        raise Exception('The passed memory card \'%s\' does not exist' %
+                        cardPath)
+    with io.open(cardPath, 'rb') as cardFile:
+
+        # Empty files can't be mapped
+        if not os.fstat(cardFile.fileno()).st_size:
+            yield b''
+            return
+
+        with mmap.mmap(cardFile.fileno(), 0, access=mmap.ACCESS_READ) as image:
+            yield image
+
+
+# Buffers that archive members have been read into, kept for reuse once the
+# card using them is closed
+_archiveBuffers = []
+
+
+def read_archive_member(memberFile, view):
+    '''Fills the passed view from the archive member as it is decompressed,
+    returning the number of bytes read'''
+
+    view = memoryview(view)
+    filled = 0
+    while filled < len(view):
+        count = memberFile.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    return filled
+
+
+@functools.lru_cache(maxsize=None)
+def import_numpy():
+    '''Returns the NumPy module, or None when it isn't installed. NumPy is
+    optional, and slow enough to import that it is only imported when work
+    in bulk needs it, rather than when starting up'''
+
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+# Masks used to fold a frame-sized integer down to its byte-wide XOR
+_FOLD_MASKS = []
+_width = FRAME_SIZE * 8
+while _width > 8:
+    _width //= 2
+    _FOLD_MASKS.append((_width, (1 << _width) - 1))
+del _width
+
+
+def calculate_frame_checksums(data, frames=CHECKSUMMED_FRAMES,
+                              useNumpy=False):
+    '''Returns the calculated XOR checksums (XOR of all but the last byte) of
+    the first 'frames' frames of the passed data - normally the control block -
+    as bytes. Compare with the recorded checksums (the last byte of each
+    frame) to validate. NumPy is only used when useNumpy is set and it is
+    installed - a control block's worth of checksums saves far less time than
+    importing NumPy costs'''
+
+    # Making sure enough data has been passed
+    if len(data) < frames * FRAME_SIZE:
+        raise Exception('Unable to calculate checksums for %d frames from %dB '
+                        'of data' % (frames, len(data)))
+
+    numpy = import_numpy() if useNumpy else None
+    if numpy is not None:
+
+        # Treating the data as a table of frames and XORing across each row
+        # in one go
+        table = numpy.frombuffer(data, dtype=numpy.uint8,
+                                 count=frames * FRAME_SIZE).reshape(
+                                     frames, FRAME_SIZE)
+        return numpy.bitwise_xor.reduce(table[:, :-1], axis=1).tobytes()
+
+    # Pure Python fallback - XORing the whole frame as one integer by folding
+    # it in half until a byte is left. This includes the recorded checksum,
+    # which is then XORed back out
+    data = memoryview(data)
+    checksums = bytearray(frames)
+    for frameNumber in range(frames):
+        offset = frameNumber * FRAME_SIZE
+        value = int.from_bytes(data[offset:offset + FRAME_SIZE], 'little')
+        for shift, mask in _FOLD_MASKS:
+            value = (value >> shift) ^ (value & mask)
+        checksums[frameNumber] = value ^ data[offset + FRAME_SIZE - 1]
+    return bytes(checksums)
+
+
+def copy_file_ranges(sourceFd, outputFd, ranges):
+    '''Copies the passed (offset, length) ranges of the source file to the
+    current position of the output file inside the kernel. Returns False
+    without writing anything if the platform or filesystems don't support
+    this'''
+
+    firstCopy = True
+    for offset, length in ranges:
+        end = offset + length
+        while offset < end:
+
+            # copy_file_range is tried first, then sendfile (which Linux
+            # supports between files)
+            try:
+                if hasattr(os, 'copy_file_range'):
+                    copied = os.copy_file_range(sourceFd, outputFd,
+                                                end - offset, offset)
+                elif hasattr(os, 'sendfile'):
+                    copied = os.sendfile(outputFd, sourceFd, offset,
+                                         end - offset)
+                else:
+                    return False
+            except OSError as e:
+                if firstCopy and e.errno in (errno.EXDEV, errno.ENOSYS,
+                                             errno.EINVAL, errno.EOPNOTSUPP,
+                                             errno.ENOTSOCK, errno.EBADF):
+                    return False
+                raise
+
+            # Nothing copied means the source is shorter than expected
+            if not copied:
+                raise Exception('Unable to copy bytes %d to %d of the memory '
+                                'card image - it is truncated' % (offset,
+                                                                  end - 1))
+            offset += copied
+            firstCopy = False
+    return True
+
+
+def write_views(outputFd, views):
+    '''Writes the passed views to the output file with as few (vectored)
+    writes as possible'''
+
+    views = [view for view in views if len(view)]
+    while views:
+        written = os.writev(outputFd, views)
+
+        # Dropping what has been written - partial writes are possible
+        while views and written >= len(views[0]):
+            written -= len(views[0])
+            views.pop(0)
+        if written:
+            views[0] = views[0][written:]
+
+
+def write_journaled(path, writes):
+    '''Writes the passed (offset, data) pairs to the file in place with
+    positioned writes. The writes are first recorded in a journal so that
+    they can be completed by replay_journal if interrupted'''
+
+    import hashlib
+
+    # Writing and syncing the journal - its hash detects a journal that was
+    # itself interrupted, in which case the file hasn't been touched
+    journalPath = path + JOURNAL_SUFFIX
+    payload = b''.join(offset.to_bytes(8, 'little') +
+                       len(data).to_bytes(4, 'little') + data
+                       for offset, data in writes)
+    with io.open(journalPath, 'wb') as journalFile:
+        journalFile.write(JOURNAL_MAGIC + hashlib.sha1(payload).digest() +
+                          payload)
+        journalFile.flush()
+        os.fsync(journalFile.fileno())
+    sync_directory(os.path.dirname(os.path.abspath(path)))
+
+    # Writing to the file
+    apply_writes(path, writes)
+
+    # Writes are safely on disk - the journal is no longer needed
+    os.unlink(journalPath)
+
+
+def apply_writes(path, writes):
+    '''Makes the passed (offset, data) positioned writes to the file and
+    syncs it'''
+
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        for offset, data in writes:
+            data = memoryview(data)
+            while data:
+                written = os.pwrite(fd, data, offset)
+                data = data[written:]
+                offset += written
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def replay_journal(path):
+    '''Completes the writes of an interrupted write_journaled call on the
+    file, if any. Returns True if writes were replayed'''
+
+    import hashlib
+
+    journalPath = path + JOURNAL_SUFFIX
+    if not os.path.exists(journalPath):
+        return False
+    with io.open(journalPath, 'rb') as journalFile:
+        journal = journalFile.read()
+
+    # An incomplete journal means the file was never written to
+    payload = journal[len(JOURNAL_MAGIC) + 20:]
+    if (journal[:len(JOURNAL_MAGIC)] != JOURNAL_MAGIC or
+            hashlib.sha1(payload).digest() !=
+            journal[len(JOURNAL_MAGIC):len(JOURNAL_MAGIC) + 20]):
+        os.unlink(journalPath)
+        return False
+
+    # Decoding and redoing the writes
+    writes = []
+    position = 0
+    while position < len(payload):
+        offset = int.from_bytes(payload[position:position + 8], 'little')
+        length = int.from_bytes(payload[position + 8:position + 12], 'little')
+        position += 12
+        writes.append((offset, payload[position:position + length]))
+        position += length
+    apply_writes(path, writes)
+    os.unlink(journalPath)
+    return True
+
+
+def sync_directory(directory):
+    '''Syncs the directory so that files created in it persist - not
+    possible on all platforms'''
+
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def frame_hashes(data):
+    '''Returns the hashes (8 byte digests) of all frames of the passed memory
+    card data (or a part of it)'''
+
+    import hashlib
+
+    data = memoryview(data)
+    return [hashlib.blake2b(data[offset:offset + FRAME_SIZE],
+                            digest_size=8).digest()
+            for offset in range(0, len(data), FRAME_SIZE)]
+
+
+def diff_cards(cardA, cardB):
+    '''Compares two parsed memory cards (of any formats) frame by frame.
+    Returns a dictionary of the changed 'blocks' - each with its
+    'blockNumber', changed 'frames' (numbered within the block), whether its
+    control block frame changed ('directoryChanged') and its summaries
+    'before' and 'after' - and the changed 'saves' as (card, first block)
+    pairs. Block 0 is only reported for changes outside of the directory
+    frames'''
+
+    dataA = cardA.card_data()
+    dataB = cardB.card_data()
+
+    # Identical cards don't need hashing
+    if dataA == dataB:
+        return {'blocks': [], 'saves': []}
+
+    # Comparing the frame hash vectors of the blocks that differ at all
+    changedFrames = {}
+    for blockNumber in range(len(dataA) // BLOCK_SIZE):
+        blockA = dataA[blockNumber * BLOCK_SIZE:(blockNumber + 1) * BLOCK_SIZE]
+        blockB = dataB[blockNumber * BLOCK_SIZE:(blockNumber + 1) * BLOCK_SIZE]
+        if blockA == blockB:
+            continue
+        changedFrames[blockNumber] = [
+            frameNumber for frameNumber, (hashA, hashB) in
+            enumerate(zip(frame_hashes(blockA), frame_hashes(blockB)))
+            if hashA != hashB]
+
+    # Directory frames describe the other blocks
+    controlFrames = changedFrames.pop(0, [])
+    changedDirectories = [frameNumber for frameNumber in controlFrames
+                          if 1 <= frameNumber <= 15]
+    controlFrames = [frameNumber for frameNumber in controlFrames
+                     if not 1 <= frameNumber <= 15]
+
+    blocks = []
+    if controlFrames:
+        blocks.append({'blockNumber': 0, 'frames': controlFrames,
+                       'directoryChanged': False, 'before': None,
+                       'after': None})
+    for blockNumber in sorted(set(changedFrames) | set(changedDirectories)):
+        blocks.append({'blockNumber': blockNumber,
+                       'frames': changedFrames.get(blockNumber, []),
+                       'directoryChanged': blockNumber in changedDirectories,
+                       'before': cardA[blockNumber].summary(),
+                       'after': cardB[blockNumber].summary()})
+
+    # Saves on either card touching a changed block have changed
+    changedBlocks = set(block['blockNumber'] for block in blocks)
+    saves = []
+    for memoryCard in (cardA, cardB):
+        for block in memoryCard._blocks[1:]:
+            if (BLOCK_VALID_INFORMATION[block._blockStatus] and
+                    changedBlocks.intersection(memoryCard.save_chain(
+                        block.blockNumber))):
+                saves.append((memoryCard, block.blockNumber))
+
+    return {'blocks': blocks, 'saves': saves}
+
+
+def format_numbers(numbers):
+    '''Formats the sorted numbers compactly, e.g. '0-3, 7' '''
+
+    ranges = []
+    for number in numbers:
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ', '.join(('%d' % start) if start == end else ('%d-%d' %
+                                                          (start, end))
+                     for start, end in ranges)
+
+
+def diff(paths, verbose=False):
+    '''Compares the passed memory card images pairwise, reporting changed
+    blocks and saves. Returns the number of pairs that differ'''
+
+    differences = 0
+    for pathA, pathB in zip(paths[::2], paths[1::2]):
+        with PS1Card(pathA, memoryMap=True, verbose=verbose) as cardA, \
+                PS1Card(pathB, memoryMap=True, verbose=verbose) as cardB:
+            changes = diff_cards(cardA, cardB)
+
+            print('\nComparing \'%s\' (%s format) with \'%s\' (%s format): %s'
+                  % (pathA, cardA.format, pathB, cardB.format,
+                     'differ' if changes['blocks'] else 'identical'))
+            if not changes['blocks']:
+                continue
+            differences += 1
+
+            # Changed blocks
+            for block in changes['blocks']:
+                if block['blockNumber'] == 0:
+                    print('Control block: frames %s changed' %
+                          format_numbers(block['frames']))
+                    continue
+                details = []
+                if block['frames']:
+                    details.append('frames %s changed' %
+                                   format_numbers(block['frames']))
+                if block['directoryChanged']:
+                    details.append('directory frame changed')
+                print('Block %d: %s\n  Before: %s \'%s\' %s\n  After: %s '
+                      '\'%s\' %s' % (block['blockNumber'], ', '.join(details),
+                                     block['before']['status'],
+                                     block['before']['title'],
+                                     block['before']['filename'],
+                                     block['after']['status'],
+                                     block['after']['title'],
+                                     block['after']['filename']))
+
+            # Changed saves
+            for memoryCard, blockNumber in changes['saves']:
+                print('Changed save in \'%s\': block %d \'%s\'' %
+                      (memoryCard.path, blockNumber,
+                       memoryCard[blockNumber].title))
+
+    return differences
+
+
+def scan_saves(data, alignment=FRAME_SIZE):
+    '''Sweeps the passed data - a memory card's data or a raw dump of any
+    size - for save headers starting at multiples of alignment, scoring how
+    plausible each one's icon and title frames are. Returns a list of
+    dictionaries with each candidate's 'offset', 'length' (in blocks, as
+    recorded in the header), 'title', 'checks' passed and failed, and
+    'confidence' (the fraction of checks passed)'''
+
+    import unicodedata
+
+    data = memoryview(data)
+
+    # Finding the offsets starting with the magic
+    numpy = import_numpy()
+    if numpy is not None:
+
+        # Testing the first and second bytes at every aligned offset at once
+        array = numpy.frombuffer(data, dtype=numpy.uint8)
+        firstBytes = array[:-1:alignment]
+        secondBytes = array[1::alignment]
+        offsets = (numpy.flatnonzero(
+            (firstBytes == BLOCK_NORMAL_MAGIC[0]) &
+            (secondBytes == BLOCK_NORMAL_MAGIC[1])) * alignment).tolist()
+
+    else:
+
+        # Pure Python fallback - searching for the magic, keeping aligned
+        # finds
+        raw = bytes(data)
+        offsets = []
+        offset = raw.find(BLOCK_NORMAL_MAGIC)
+        while offset != -1:
+            if not offset % alignment:
+                offsets.append(offset)
+            offset = raw.find(BLOCK_NORMAL_MAGIC, offset + 1)
+
+    candidates = []
+    for offset in offsets:
+
+        # The header frame and icon frames must be present
+        if offset + SAVE_HEADER_SIZE > len(data):
+            continue
+        header = data[offset:offset + FRAME_SIZE]
+        iconFlag, length = header[2], header[3]
+
+        # Titles are Shift-JIS, padded with nulls - full-width spaces are
+        # common, so only control and unassigned characters count against
+        # them
+        titleBytes = bytes(header[4:68]).split(b'\x00')[0]
+        try:
+            title = titleBytes.decode('shift-jis')
+            cleanTitle = bool(title) and not any(
+                unicodedata.category(character)[0] == 'C'
+                for character in title)
+        except UnicodeDecodeError:
+            title = titleBytes.decode('shift-jis', 'replace')
+            cleanTitle = False
+
+        # Icon frames are blank when filled with one byte value
+        iconFrames = iconFlag & 0x03 if iconFlag in SAVE_ICON_FLAGS else 1
+        icons = [data[offset + frameNumber * FRAME_SIZE:
+                      offset + (frameNumber + 1) * FRAME_SIZE]
+                 for frameNumber in range(1, iconFrames + 1)]
+
+        checks = {'iconFlag': iconFlag in SAVE_ICON_FLAGS,
+                  'length': (1 <= length <= 15 and
+                             offset + length * BLOCK_SIZE <= len(data)),
+                  'title': cleanTitle,
+                  'reserved': not any(header[68:80]),
+                  'icon': all(icon.tobytes().strip(icon[:1].tobytes())
+                              for icon in icons)}
+        candidates.append({'offset': offset, 'length': length,
+                           'title': title, 'checks': checks,
+                           'confidence': (sum(checks.values()) /
+                                          len(checks))})
+
+    return candidates
+
+
+def follow_chain(blockStatus, nextBlock, blockNumber, invalidFrames=()):
+    '''Follows the next block links from the passed block, returning the
+    blocks making up the save and a description of why the chain is broken
+    (or None). blockStatus and nextBlock are functions returning the status
+    byte and linked block (None if there isn't one) of a block. Links to
+    blocks that can't be part of the save end the chain - only middle and
+    last blocks of saves follow the first block of a save, and only deleted
+    middle and last blocks that of a deleted save. Unless the link is in one
+    of the passed invalid frames (failing its checksum), in which case it is
+    ignored and the save is assumed to continue in the following block, if
+    that can be part of the save'''
+
+    continuingStatuses = ((0xA2, 0xA3) if blockStatus(blockNumber) == 0xA1
+                          else (0x52, 0x53))
+    chain = [blockNumber]
+    linkedBlock = nextBlock(blockNumber)
+    while linkedBlock is not None:
+
+        # Dangling links and cycles
+        problem = None
+        if not 1 <= linkedBlock <= 15:
+            problem = ('block %d links to block %d, which doesn\'t exist' %
+                       (chain[-1], linkedBlock))
+        elif linkedBlock in chain:
+            problem = ('block %d links back to block %d' %
+                       (chain[-1], linkedBlock))
+        elif blockStatus(linkedBlock) not in continuingStatuses:
+            problem = ('block %d links to block %d, which can\'t be part of '
+                       'the save (%s)' % (chain[-1], linkedBlock,
+                                          BLOCK_STATUS.get(
+                                              blockStatus(linkedBlock),
+                                              'Unknown status 0x%02X' %
+                                              blockStatus(linkedBlock))))
+        if problem is not None:
+            followingBlock = chain[-1] + 1
+            if (chain[-1] not in invalidFrames or followingBlock > 15 or
+                    followingBlock in chain or
+                    blockStatus(followingBlock) not in continuingStatuses):
+                return chain, problem
+            linkedBlock = followingBlock
+        chain.append(linkedBlock)
+
+        # The last block of a save ends it regardless of its link
+        if blockStatus(linkedBlock) in (0x53, 0xA3):
+            break
+        linkedBlock = nextBlock(linkedBlock)
+    return chain, None
+
+
+def icon_key(header):
+    '''Returns the hash identifying the icon of the passed save header (the
+    first frames of a save) - only the display flag, palette and icon frames
+    are hashed, so that saves differing only in title share an icon'''
+
+    import hashlib
+
+    header = memoryview(header)
+    return hashlib.sha1(header[2:3].tobytes() +
+                        header[ICON_PALETTE_OFFSET:FRAME_SIZE].tobytes() +
+                        header[FRAME_SIZE:SAVE_HEADER_SIZE].tobytes()
+                        ).hexdigest()
+
+
+def decode_icons(headers):
+    '''Decodes the icons of the passed save headers (the first frames of
+    saves) in one go. Returns a list holding, per header, a list of its icon
+    frames as 16x16 RGBA pixel data (bytes, row by row). Palette colour 0
+    (black without the semi-transparency bit) is transparent, as on the
+    console'''
+
+    headers = [memoryview(header)[:SAVE_HEADER_SIZE] for header in headers]
+    frameCounts = [header[2] & 0x03 if header[2] in SAVE_ICON_FLAGS else 1
+                   for header in headers]
+    if not headers:
+        return []
+
+    numpy = import_numpy()
+    if numpy is not None:
+
+        # Expanding all palettes at once - 5 bit channels are scaled to 8
+        # bits by repeating their top bits
+        table = numpy.frombuffer(b''.join(headers), dtype=numpy.uint8).reshape(
+            len(headers), SAVE_HEADER_SIZE)
+        colours = table[:, ICON_PALETTE_OFFSET:FRAME_SIZE].copy().view('<u2')
+        channels = ((colours[..., None] >> numpy.array([0, 5, 10])) &
+                    0x1F).astype(numpy.uint8)
+        palettes = numpy.empty(colours.shape + (4,), dtype=numpy.uint8)
+        palettes[..., :3] = (channels << 3) | (channels >> 2)
+        palettes[..., 3] = numpy.where(colours == 0, 0, 255)
+
+        # Unpacking the nibbles of all icon frames - the low nibble is the
+        # left pixel - and looking them up in their save's palette
+        pixels = table[:, FRAME_SIZE:].reshape(len(headers), 3, FRAME_SIZE)
+        indices = numpy.stack((pixels & 0x0F, pixels >> 4), axis=-1).reshape(
+            len(headers), 3, ICON_SIZE * ICON_SIZE)
+        rgba = palettes[numpy.arange(len(headers))[:, None, None], indices]
+
+        return [[rgba[headerNumber, frameNumber].tobytes()
+                 for frameNumber in range(frameCount)]
+                for headerNumber, frameCount in enumerate(frameCounts)]
+
+    # Pure Python fallback - a save at a time
+    icons = []
+    for header, frameCount in zip(headers, frameCounts):
+        palette = []
+        for offset in range(ICON_PALETTE_OFFSET, FRAME_SIZE, 2):
+            colour = int.from_bytes(header[offset:offset + 2], 'little')
+            channels = [(colour >> shift) & 0x1F for shift in (0, 5, 10)]
+            palette.append(bytes([(channel << 3) | (channel >> 2)
+                                  for channel in channels] +
+                                 [255 if colour else 0]))
+        icons.append([b''.join(palette[pixels & 0x0F] + palette[pixels >> 4]
+                               for pixels in header[
+                                   (frameNumber + 1) * FRAME_SIZE:
+                                   (frameNumber + 2) * FRAME_SIZE])
+                      for frameNumber in range(frameCount)])
+    return icons
+
+
+def write_png(outputPath, frames, width=ICON_SIZE, height=ICON_SIZE,
+              delay=(1, 1)):
+    '''Writes the passed RGBA frames as a PNG - several frames make an
+    animated PNG (APNG, viewers without support show the first frame), each
+    shown for the delay in seconds (numerator, denominator). The file is
+    written under a temporary name and renamed into place, so that parallel
+    writers of the same path never leave a partial file'''
+
+    import struct
+    import tempfile
+    import zlib
+
+    def chunk(chunkType, data):
+        return (struct.pack('>I', len(data)) + chunkType + data +
+                struct.pack('>I', zlib.crc32(chunkType + data)))
+
+    # Rows are prefixed with their filter type (none)
+    def compress(frame):
+        rowSize = width * 4
+        return zlib.compress(b''.join(
+            b'\x00' + frame[offset:offset + rowSize]
+            for offset in range(0, height * rowSize, rowSize)), 9)
+
+    chunks = [PNG_SIGNATURE, chunk(b'IHDR', struct.pack('>IIBBBBB', width,
+                                                        height, 8, 6, 0, 0,
+                                                        0))]
+    if len(frames) > 1:
+
+        # Animation control, looping forever - frames carry a sequence number
+        # shared by their control and data chunks
+        chunks.append(chunk(b'acTL', struct.pack('>II', len(frames), 0)))
+        sequenceNumber = 0
+        for frameNumber, frame in enumerate(frames):
+            chunks.append(chunk(b'fcTL', struct.pack(
+                '>IIIIIHHBB', sequenceNumber, width, height, 0, 0, delay[0],
+                delay[1], 1, 0)))
+            sequenceNumber += 1
+            if frameNumber == 0:
+                chunks.append(chunk(b'IDAT', compress(frame)))
+            else:
+                chunks.append(chunk(b'fdAT', struct.pack('>I', sequenceNumber)
+                                    + compress(frame)))
+                sequenceNumber += 1
+    else:
+        chunks.append(chunk(b'IDAT', compress(frames[0])))
+    chunks.append(chunk(b'IEND', b''))
+
+    outputDirectory = os.path.dirname(outputPath) or '.'
+    descriptor, temporaryPath = tempfile.mkstemp(dir=outputDirectory,
+                                                 suffix='.tmp')
+    try:
+        with io.open(descriptor, 'wb') as outputFile:
+            outputFile.write(b''.join(chunks))
+        os.replace(temporaryPath, outputPath)
+    except BaseException:
+        os.unlink(temporaryPath)
+        raise
+
 
 class PS1Card(object):
     '''Representation of memory card, also maintaining the original data'''
 
-    def __init__(self, cardPath):
+    def __init__(self, cardPath, memoryMap=False, lazy=False, verbose=False,
+                 writable=False):
 
         # Initialising variables
         self.format = 'unknown'
         self.path = cardPath
+        self.verbose = verbose
         self.image = None
+        self._mmap = None  # Only used when the image is memory mapped
+        self._dataOffset = None  # Set when the format is determined
+        self._imageSize = None
+        self.writable = writable  # Edits are only allowed when writable
+        self._dirtyFrames = set()  # Frames edited since the last save
+        self._chainIndex = None  # Built on demand - see chain_index
+        self._chainProblems = None
+        self._archiveBuffer = None  # Reused buffer holding an archive member
         self._blocks = [None for i in range(16)]  # Store for instantiated
                                                   # memory card blocks - 0 is
                                                   # 'padding'
 
-        # Validating passed card path
-        if not os.path.isfile(cardPath):
+        # Validating passed card path - cards inside archives are checked
+        # for when the archive is opened
+        memberName = split_archive_path(cardPath)[1]
+        if memberName is None and not os.path.isfile(cardPath):
             raise Exception('The passed memory card \'%s\' does not exist' %
                             cardPath)
 
-        # Verbose output
-        if options.verbose:
-            print('Loading memory card image...')
+        # Edits are made to a mutable copy of the image
+        if writable and memoryMap:
+            raise Exception('Memory cards can\'t be memory mapped when '
+                            'opened for writing')
+        if writable and memberName is not None:
+            raise Exception('The memory card \'%s\' is inside an archive '
+                            'and therefore can\'t be edited' % cardPath)
+
+        # Completing any interrupted edit before loading
+        if writable and replay_journal(cardPath):
+            print('Warning: An interrupted write to the memory card \'%s\' '
+                  'has been completed' % cardPath, file=sys.stderr)
+
+        # Archive members are streamed from the archive as they are
+        # decompressed
+        if memberName is not None:
+            cardImage, fileSize = open_archive_member(cardPath)
+        else:
+            cardImage = io.open(cardPath, "rb")
+            fileSize = os.fstat(cardImage.fileno()).st_size
+
+        with cardImage:
 
-        # Loading memory card image
-        with io.open(cardPath, "rb") as cardImage:
-            self.image = cardImage.read()
+            # Determining format of image (and therefore validating it) from
+            # its start and size, so that other files are rejected without
+            # reading them
+            with PhaseTimer('detect', FORMAT_PROBE_SIZE):
+                header = cardImage.read(FORMAT_PROBE_SIZE)
+                self.determine_format_and_validate(header, fileSize)
+
+            # Verbose output
+            if self.verbose:
+                print('Loading memory card image...')
+
+            # Loading memory card image - when memory mapped, the image is a
+            # read-only memoryview over the file so that blocks, frames and
+            # extracted data are views rather than copies
+            with PhaseTimer('load', self._imageSize):
+
+                # Archive members can't be seeked back in cheaply, so the rest
+                # of the member is read in after its start. When views are
+                # wanted, a buffer left by a closed card is reused rather
+                # than allocating one per card
+                if memberName is not None:
+                    if memoryMap and _archiveBuffers:
+                        buffer = _archiveBuffers.pop()
+                    else:
+                        buffer = bytearray(self._imageSize)
+                    if len(buffer) < self._imageSize:
+                        buffer = bytearray(self._imageSize)
+                    view = memoryview(buffer)[:self._imageSize]
+                    view[:len(header)] = header
+                    loaded = len(header) + read_archive_member(
+                        cardImage, view[len(header):])
+                    if memoryMap:
+                        self._archiveBuffer = buffer
+                        self.image = view[:loaded]
+                    else:
+                        view.release()
+                        del buffer[loaded:]
+                        self.image = buffer
+                elif memoryMap:
+                    self._mmap = mmap.mmap(cardImage.fileno(), 0,
+                                           access=mmap.ACCESS_READ)
+                    self.image = memoryview(self._mmap)
+                else:
+                    cardImage.seek(0)
+                    self.image = cardImage.read()
+                    if writable:
+                        self.image = bytearray(self.image)
 
         # Verbose output
-        if options.verbose:
+        if self.verbose:
             print('Memory card image loaded')
 
-        # Determining format of image (and therefore validating it)
-        self.determine_format_and_validate()
+        # Making sure the image didn't change size while loading
+        if len(self.image) != self._imageSize:
+            raise Exception('The passed memory card \'%s\' changed while it '
+                            'was being loaded' % self.path)
 
         # Parsing card
-        self.parse()
+        self.parse(lazy=lazy)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
 
     def __getitem__(self, blockNumber):
         '''Intercepting indexing operations to allow blocks to be
@@ -178,41 +1421,522 @@ class PS1Card(object):
         # Saving block in local store
         self._blocks[blockNumber] = block
 
-    def determine_format_and_validate(self):
-        '''Determines format of the loaded binary data and does basic
-        validation'''
-
-        # Determining format and correct image size
-        if self.image[:11] == GME_MAGIC:
-            self.format = 'gme'
-            correctSize = IMAGE_SIZE + GME_HEADER_SIZE
-        elif self.image[:2] == MCD_MAGIC:
-            self.format = 'mcd'
-            correctSize = IMAGE_SIZE
-        else:
+    def block_data(self, blockNumber):
+        '''Returns a view of the passed block's data in the image'''
+
+        offset = self.format_offset() + blockNumber * BLOCK_SIZE
+        return memoryview(self.image)[offset:offset + BLOCK_SIZE]
+
+    def directory_frame(self, blockNumber):
+        '''Returns a view of the control block frame describing the block'''
+
+        offset = self.format_offset() + blockNumber * FRAME_SIZE
+        return memoryview(self.image)[offset:offset + FRAME_SIZE]
+
+    def close(self):
+        '''Release the image data - required to unmap memory mapped images
+        promptly'''
+
+        # Dropping block views into the image
+        for block in self._blocks[1:]:
+            if block is not None:
+                block.data = None
+
+        # Releasing the image view
+        if isinstance(self.image, memoryview):
+            self.image.release()
+        self.image = None
+
+        # Unmapping - if something outside of the card still holds a view,
+        # the mapping is left to be freed by garbage collection
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
+
+        # Returning the archive member buffer for reuse - growing it fails
+        # if something outside of the card still holds a view, in which case
+        # it is left to garbage collection
+        if self._archiveBuffer is not None:
+            try:
+                self._archiveBuffer.append(0)
+                del self._archiveBuffer[-1]
+                _archiveBuffers.append(self._archiveBuffer)
+            except BufferError:
+                pass
+            self._archiveBuffer = None
+
+    def _build_chain_index(self):
+        '''Builds the chain index and the problems found with it - see
+        chain_index'''
+
+        self._chainIndex = {}
+        self._chainProblems = {}
+        invalidFrames = set(self.invalid_frames())
+        for block in self._blocks[1:]:
+            if block._blockStatus not in (0x51, 0xA1):
+                continue
+            chain, problem = self._follow_chain(block.blockNumber,
+                                                invalidFrames)
+
+            # Chains must also account for the whole save
+            saveLength = (int.from_bytes(block._saveLength, 'little') //
+                          BLOCK_SIZE)
+            if problem is None and len(chain) != saveLength:
+                problem = ('%d blocks are linked, but the save length is %d '
+                           'blocks' % (len(chain), saveLength))
+
+            self._chainIndex[block.blockNumber] = chain
+            if problem is not None:
+                self._chainProblems[block.blockNumber] = problem
+
+    def _check_writable(self):
+        '''Raises an error if the card wasn't opened for writing'''
+
+        if not self.writable:
+            raise Exception('The memory card \'%s\' was not opened for '
+                            'writing' % self.path)
+
+    def _follow_chain(self, blockNumber, invalidFrames=()):
+        '''Follows the next block links from the passed block - see
+        follow_chain'''
+
+        return follow_chain(lambda linkedBlock: self[linkedBlock]._blockStatus,
+                            lambda linkedBlock: self[linkedBlock].nextBlock,
+                            blockNumber, invalidFrames)
+
+    def _refresh_block(self, blockNumber):
+        '''Reparses the block after an edit'''
+
+        block = PS1CardBlock(blockNumber,
+                             *self.parse_directory_frame(blockNumber),
+                             verbose=self.verbose)
+        block.data = self.block_data(blockNumber)
+        block.title = self.parse_block_title(blockNumber)
+        self[blockNumber] = block
+
+        # Links may have changed
+        self._chainIndex = None
+
+    def block_hashes(self):
+        '''Returns the hashes (8 byte digests) of all blocks, indexed by block
+        number - each data block is hashed with the control block frame
+        describing it, so that directory changes are seen too'''
+
+        import hashlib
+
+        hashes = [hashlib.blake2b(self.block_data(0),
+                                  digest_size=8).digest()]
+        for blockNumber in range(1, len(self._blocks)):
+            blockHash = hashlib.blake2b(self.directory_frame(blockNumber),
+                                        digest_size=8)
+            blockHash.update(self.block_data(blockNumber))
+            hashes.append(blockHash.digest())
+        return hashes
+
+    def card_data(self):
+        '''Returns a view of the memory card data, i.e. the image without any
+        format header'''
+
+        offset = self.format_offset()
+        return memoryview(self.image)[offset:offset + IMAGE_SIZE]
+
+    def chain_index(self):
+        '''Returns the chain index - a dictionary mapping the first block of
+        every save (including deleted saves) to the blocks making up the save
+        in order, found by following the next block links. It is built once,
+        and again after edits'''
+
+        if self._chainIndex is None:
+            self._build_chain_index()
+        return self._chainIndex
+
+    def chain_problems(self):
+        '''Returns a dictionary mapping the first blocks of saves whose chain
+        is broken (dangling links, cycles, or disagreeing with the save
+        length) to a description of the problem'''
+
+        if self._chainIndex is None:
+            self._build_chain_index()
+        return self._chainProblems
+
+    def checksums(self):
+        '''Returns the (calculated, recorded) checksums of all checksummed
+        control block frames, including the broken sector list frames'''
+
+        controlBlock = self.block_data(0)
+        calculated = calculate_frame_checksums(controlBlock)
+        recorded = controlBlock[FRAME_SIZE - 1:CHECKSUMMED_FRAMES * FRAME_SIZE:
+                                FRAME_SIZE]
+        return calculated, recorded
+
+    def convert(self, outputFormat, outputPath):
+        '''Writes the memory card to the given path as an image in the passed
+        format (see CONVERT_FORMATS), returning the number of bytes written.
+        Only the header is generated - the memory card data is copied from
+        the image file in the kernel where possible. Comments are kept when
+        converting from GME to GME. The image is written to a temporary file
+        that is linked into place, so an existing file is never replaced'''
+
+        import tempfile
+
+        if outputFormat not in CONVERT_FORMATS:
+            raise Exception('Memory cards can\'t be converted to \'%s\' '
+                            'format' % outputFormat)
+
+        # Generating the header
+        header = b''
+        if outputFormat == 'gme':
+            comments = b''
+            if self.format == 'gme':
+                comments = memoryview(self.image)[GME_COMMENT_OFFSET:
+                                                  GME_HEADER_SIZE]
+            header = gme_header(self.block_data(0), comments)
+
+        # Creating output directory if it doesn't exist - other workers may
+        # be creating it too
+        outputDirectory = os.path.dirname(outputPath) or '.'
+        if not os.path.isdir(outputDirectory):
+            os.makedirs(outputDirectory, exist_ok=True)
+
+        # Writing the image with the permissions of the original
+        descriptor, temporaryPath = tempfile.mkstemp(dir=outputDirectory,
+                                                     suffix='.tmp')
+        os.close(descriptor)
+        try:
+            os.chmod(temporaryPath, card_file_stat(self.path).st_mode & 0o777)
+            self.write_ranges([(self.format_offset(), IMAGE_SIZE)],
+                              temporaryPath, header)
+
+            # Linking fails rather than replacing a file created meanwhile
+            try:
+                os.link(temporaryPath, outputPath)
+            except FileExistsError:
+                raise Exception('Unable to convert the memory card \'%s\' - '
+                                '\'%s\' already exists' % (self.path,
+                                                          outputPath))
+        finally:
+            os.unlink(temporaryPath)
+        return len(header) + IMAGE_SIZE
+
+    def import_save(self, savePath):
+        '''Imports a single save (MCS format - its control block frame
+        followed by its blocks) into free blocks of the card, returning the
+        first block'''
+
+        self._check_writable()
+
+        # Loading and validating the save
+        with io.open(savePath, 'rb') as saveFile:
+            save = saveFile.read()
+        if not _mcs_probe(save[:FORMAT_PROBE_SIZE], len(save)):
+            raise Exception('The passed save \'%s\' is not a single save in '
+                            'MCS format' % savePath)
+        length = (len(save) - FRAME_SIZE) // BLOCK_SIZE
+        saveFrame = save[:FRAME_SIZE]
+        fileName = saveFrame[10:31].rstrip(b'\x00')
+
+        # Saves are identified by their file name, so it must be unique
+        for block in self._blocks[1:]:
+            if (block._blockStatus == 0x51 and
+                    block.filename.encode('utf8').rstrip(b'\x00') == fileName):
+                raise Exception('The memory card \'%s\' already contains the '
+                                'save \'%s\' (block %d)' %
+                                (self.path, fileName.decode('utf8', 'replace'),
+                                 block.blockNumber))
+
+        # Finding enough free blocks - as on the console, deleted blocks are
+        # free, however unused blocks (and deleted blocks no deleted save
+        # uses) are preferred so that deleted saves remain recoverable for as
+        # long as possible
+        deletedChains = [chain for firstBlock, chain in
+                         sorted(self.chain_index().items())
+                         if all(self[chainBlockNumber]._blockStatus in
+                                (0xA1, 0xA2, 0xA3) for chainBlockNumber
+                                in chain)]
+        deletedBlocks = set(chainBlockNumber for deletedChain in deletedChains
+                            for chainBlockNumber in deletedChain)
+        freeBlocks = [block.blockNumber for block in self._blocks[1:]
+                      if block._blockStatus in (0xA0, 0xA1, 0xA2, 0xA3) and
+                      block.blockNumber not in deletedBlocks]
+        if len(freeBlocks) + len(deletedBlocks) < length:
+            raise Exception('The memory card \'%s\' has %d free blocks, but '
+                            'the save \'%s\' needs %d' %
+                            (self.path, len(freeBlocks) + len(deletedBlocks),
+                             savePath, length))
+
+        # Then whole deleted saves, as few as possible - the shortest that
+        # holds the rest of the save, otherwise the longest
+        discardedBlocks = []
+        while len(freeBlocks) < length:
+            needed = length - len(freeBlocks)
+            deletedChain = min((deletedChain for deletedChain in deletedChains
+                                if len(deletedChain) >= needed), key=len,
+                               default=None) or max(deletedChains, key=len)
+            deletedChains.remove(deletedChain)
+            deletedChain = [chainBlockNumber for chainBlockNumber
+                            in deletedChain if chainBlockNumber
+                            not in freeBlocks]
+            freeBlocks += deletedChain[:needed]
+            discardedBlocks += deletedChain[needed:]
+        chain = freeBlocks[:length]
+
+        # Writing the data blocks, then the directory frames linking them
+        for position, chainBlockNumber in enumerate(chain):
+            self.write_data(chainBlockNumber * BLOCK_SIZE,
+                            save[FRAME_SIZE + position * BLOCK_SIZE:
+                                 FRAME_SIZE + (position + 1) * BLOCK_SIZE])
+        for position, chainBlockNumber in enumerate(chain):
+            if position == 0:
+                frame = bytearray(saveFrame)
+                frame[0] = 0x51
+                frame[4:8] = (length * BLOCK_SIZE).to_bytes(4, 'little')
+            else:
+                frame = bytearray(FRAME_SIZE)
+                frame[0] = 0x53 if position == length - 1 else 0x52
+            link = (chain[position + 1] - 1 if position < length - 1
+                    else LINK_NONE)
+            frame[8:10] = link.to_bytes(2, 'little')
+            self.write_directory_frame(chainBlockNumber, frame)
+
+        # The rest of a deleted save only partly overwritten can't be
+        # recovered, and would link into the imported save - marking it as
+        # unused blocks
+        for blockNumber in set(discardedBlocks).difference(chain):
+            frame = bytearray(FRAME_SIZE)
+            frame[0] = 0xA0
+            frame[8:10] = LINK_NONE.to_bytes(2, 'little')
+            self._write_changed_directory_frame(blockNumber, frame)
+
+        return chain[0]
+
+    def invalid_frames(self):
+        '''Returns the numbers of control block frames whose recorded
+        checksum doesn't match the calculated one'''
+
+        calculated, recorded = self.checksums()
+        return [frameNumber for frameNumber in range(CHECKSUMMED_FRAMES)
+                if calculated[frameNumber] != recorded[frameNumber]]
+
+    def defragment(self):
+        '''Makes all saves contiguous by moving the blocks of fragmented saves
+        into free runs of blocks, rewriting the directory frames with the new
+        links. Returns the plan applied (see defragment_plan)'''
+
+        self._check_writable()
+        plan = self.defragment_plan()
+
+        # Copying what is moved before anything is overwritten, as moves
+        # can swap blocks
+        moved = dict((source, bytes(self.block_data(source)))
+                     for source, target in plan['moves'])
+        frames = dict((source, bytes(self.directory_frame(source)))
+                      for chain in plan['saves'] for source in chain)
+
+        # Moving the data blocks
+        for source, target in plan['moves']:
+            self.write_data(target * BLOCK_SIZE, moved[source])
+
+        # Linking the saves in their new blocks
+        targets = dict((source, target) for target, source in
+                       enumerate(plan['layout']) if source is not None)
+        for chain in plan['saves']:
+            for position, source in enumerate(chain):
+                frame = bytearray(frames[source])
+                if position == 0:
+                    frame[0] = 0x51
+                else:
+                    frame[0] = 0x53 if position == len(chain) - 1 else 0x52
+                link = (LINK_NONE if position == len(chain) - 1 else
+                        targets[chain[position + 1]] - 1)
+                frame[8:10] = link.to_bytes(2, 'little')
+                self._write_changed_directory_frame(targets[source], frame)
+
+        # Blocks left over are marked as unused, clearing the headers of the
+        # saves moved out of them - the saves live on in their new blocks
+        for blockNumber in plan['freed']:
+            self.write_data(blockNumber * BLOCK_SIZE, bytes(FRAME_SIZE))
+            frame = bytearray(FRAME_SIZE)
+            frame[0] = 0xA0
+            frame[8:10] = LINK_NONE.to_bytes(2, 'little')
+            self._write_changed_directory_frame(blockNumber, frame)
+
+        # Blocks that only had their data changed need reparsing too
+        for source, target in plan['moves']:
+            self._refresh_block(target)
+        for blockNumber in plan['freed']:
+            self._refresh_block(blockNumber)
+
+        return plan
+
+    def defragment_plan(self):
+        '''Plans moving the saves' blocks so that each save is contiguous,
+        moving as few blocks as possible - contiguous saves stay where they
+        are, and fragmented saves move into the run of blocks that overwrites
+        the fewest deleted save blocks, then needs the fewest moves. Only when
+        no such run exists are all saves packed from the start of the card.
+        Returns a dictionary with the 'saves' (chains of current block
+        numbers), the 'layout' (current block number now at each block, or
+        None), the 'moves' ((source, target) block pairs), the blocks
+        'freed', the deleted saves 'discarded' and the 'bytesMoved' '''
+
+        # Saves are made up of the chains starting at their first blocks
+        saves = [self.save_chain(block.blockNumber)
+                 for block in self._blocks[1:] if block._blockStatus == 0x51]
+
+        # Moving blocks of a broken save would lose the rest of it, so the
+        # chains must be intact and account for every block in use
+        problems = self.chain_problems()
+        for chain in saves:
+            if chain[0] in problems:
+                raise Exception('The save starting at block %d of the memory '
+                                'card \'%s\' is broken (%s) - the card must be '
+                                'repaired before it can be defragmented' %
+                                (chain[0], self.path, problems[chain[0]]))
+        sources = [source for chain in saves for source in chain]
+        for block in self._blocks[1:]:
+            if (block._blockStatus in (0x52, 0x53) and
+                    block.blockNumber not in sources):
+                raise Exception('Block %d of the memory card \'%s\' is not '
+                                'linked to any save - the card must be '
+                                'repaired before it can be defragmented' %
+                                (block.blockNumber, self.path))
+
+        # Saves that are already contiguous stay where they are - unusable
+        # blocks are skipped over, so runs are of consecutive usable blocks
+        usableBlocks = [block.blockNumber for block in self._blocks[1:]
+                        if block._blockStatus != 0xFF]
+        runs = [usableBlocks[start:start + length]
+                for length in range(1, len(usableBlocks) + 1)
+                for start in range(len(usableBlocks) - length + 1)]
+        layout = [None] * len(self._blocks)
+        fragmented = []
+        for chain in saves:
+            if chain in runs:
+                for source in chain:
+                    layout[source] = source
+            else:
+                fragmented.append(chain)
+
+        # Fragmented saves move into the runs of blocks not taken by other
+        # saves - the blocks of fragmented saves are available too, as moved
+        # data is copied before anything is overwritten. Truly free blocks
+        # are preferred to those holding deleted saves, then runs needing the
+        # fewest moves. The longest saves are the hardest to fit, so go first
+        deletedBlocks = set(block.blockNumber for block in self._blocks[1:]
+                            if block._blockStatus in (0xA1, 0xA2, 0xA3))
+        fragmented.sort(key=lambda chain: (-len(chain), chain[0]))
+        for chain in fragmented:
+            candidates = [(len(deletedBlocks.intersection(run)),
+                           sum(source != target for source, target
+                               in zip(chain, run)), run) for run in runs
+                          if len(run) == len(chain) and
+                          all(layout[target] is None for target in run)]
+            if not candidates:
+
+                # No free run is long enough - packing all saves into the
+                # usable blocks in order of their first block instead
+                layout = [None] * len(self._blocks)
+                for target, source in zip(usableBlocks, sources):
+                    layout[target] = source
+                break
+            for target, source in zip(min(candidates)[2], chain):
+                layout[target] = source
+        moves = [(source, target) for target, source in enumerate(layout)
+                 if source is not None and source != target]
+
+        # Deleted saves survive as long as none of their blocks are
+        # overwritten. Blocks that were moved away from or held discarded
+        # deleted saves, and aren't reused, become unused blocks
+        targets = set(target for source, target in moves)
+        discarded = []
+        freedBlocks = set(source for source, target in moves)
+        for block in self._blocks[1:]:
+            if block._blockStatus == 0xA1:
+                chain = self.save_chain(block.blockNumber)
+                if targets.intersection(chain):
+                    discarded.append(block.blockNumber)
+                    freedBlocks.update(chain)
+        freed = [blockNumber for blockNumber in usableBlocks
+                 if blockNumber in freedBlocks and layout[blockNumber] is None]
+
+        return {'saves': saves, 'layout': layout, 'moves': moves,
+                'freed': freed, 'discarded': discarded,
+                'bytesMoved': len(moves) * BLOCK_SIZE}
+
+    def delete_save(self, blockNumber):
+        '''Marks the save starting at the passed block as deleted'''
+
+        # Making sure this is the first block of a save
+        if self[blockNumber]._blockStatus != 0x51:
+            raise Exception('Block %d of the memory card \'%s\' is not the '
+                            'first block of a save - status: \'%s\'' %
+                            (blockNumber, self.path,
+                             self[blockNumber].blockStatus))
+
+        # Working out the chain before any statuses change
+        for chainBlockNumber in self.save_chain(blockNumber):
+            self.set_block_status(chainBlockNumber, DELETED_STATUS[
+                self[chainBlockNumber]._blockStatus])
+
+    def determine_format_and_validate(self, header=None, imageSize=None):
+        '''Determines format of the image from its start and size (by default
+        those of the loaded image) and does basic validation'''
+
+        # Defaulting to the loaded image
+        if header is None:
+            header = self.image[:FORMAT_PROBE_SIZE]
+        if imageSize is None:
+            imageSize = len(self.image)
+        self._imageSize = imageSize
+
+        # Determining format via the registered probes
+        cardFormat = detect_format(header, imageSize)
+        if cardFormat is None:
 
             # Format unknown - raising error
             self.format = 'unknown'
             raise Exception('The passed memory card \'%s\' is not a known '
                             'format' % self.path)
+        self.format = cardFormat['name']
+
+        # Single saves can't be treated as a memory card
+        if cardFormat['singleSave']:
+            raise Exception('The passed file \'%s\' is a single save (%s '
+                            'format) rather than a memory card image' %
+                            (self.path, self.format))
 
         # Basic validation
-        if len(self.image) != correctSize:
+        correctSize = cardFormat['imageSize']
+        if correctSize is not None and imageSize != correctSize:
             raise Exception('The passed memory card \'%s\' is a %s format '
                             'image, however it is %dB rather than %dB and '
                             'therefore corrupt' %
-                            (self.path, self.format, len(self.image),
-                             correctSize))
+                            (self.path, self.format, imageSize, correctSize))
+
+        # Determining where the memory card data starts
+        if callable(cardFormat['dataOffset']):
+            self._dataOffset = cardFormat['dataOffset'](header)
+        else:
+            self._dataOffset = cardFormat['dataOffset']
+        if self._dataOffset + IMAGE_SIZE > imageSize:
+            raise Exception('The passed memory card \'%s\' is a %s format '
+                            'image, however it is too small (%dB) to contain '
+                            'a memory card and therefore corrupt' %
+                            (self.path, self.format, imageSize))
 
         # Verbose output
-        if options.verbose:
+        if self.verbose:
             print('Image is %s format' % self.format)
 
     def extract(self, blockNumber, outputPath):
-        '''Extract save data (minus headers) from block to given path'''
+        '''Extract save data (minus headers) from block to given path - the
+        further blocks of a multiblock save are found via the chain index'''
 
         # Verbose output
-        if options.verbose:
+        if self.verbose:
             print('Extracting data from block %d to \'%s\'...' % (blockNumber,
                   outputPath))
 
@@ -220,87 +1944,236 @@ class PS1Card(object):
         if not os.path.isdir(os.path.dirname(outputPath)):
             os.makedirs(os.path.dirname(outputPath))
 
-        # Setting offset at beginning of relevant block and determining the
-        # next block
-        offset = self.format_offset() + blockNumber * BLOCK_SIZE
-        nextBlockOffset = offset + BLOCK_SIZE
-
-        # This is the first block of a save, so skipping irrelevant headers
-        # which are 4 frames long (title, icon etc)
-        offset += 4 * FRAME_SIZE
+        # Determining the ranges of the image holding the save - the headers
+        # of the first block (title, icon etc) are skipped
+        ranges = self.save_ranges(blockNumber)
 
         # Verbose output
-        if options.verbose:
-            print('Writing save data from memory card image byte %d to %d to '
-                  '\'%s\'...' % (offset, nextBlockOffset - 1, outputPath))
+        if self.verbose:
+            print('Writing save data from memory card image bytes %s to '
+                  '\'%s\'...' % (', '.join('%d to %d' % (offset,
+                                                          offset + length - 1)
+                                            for offset, length in ranges),
+                                  outputPath))
 
         # Outputting save data to file
-        with io.open(outputPath, 'wb') as outputFile:
-            outputFile.write(self.image[offset:nextBlockOffset])
+        self.write_ranges(ranges, outputPath)
+
+        # Verbose output
+        if self.verbose:
+            print('Data written')
 
-            # Looping for further blocks of a multiblock save
-            i = 1
-            while (self[blockNumber + i].blockStatus == 'Middle block' or
-                    self[blockNumber + i].blockStatus == 'Last block' or
-                    self[blockNumber + i].blockStatus == 'Deleted block'):
+    def extract_all(self, outputDirectory, includeDeleted=False):
+        '''Extract the save data (minus headers) of all saves on the card
+        into the given directory in one pass, optionally including deleted
+        saves. Returns the paths written'''
 
-                # Calculating the next offsets - after the first block,
-                # further blocks do not have headers
-                offset = nextBlockOffset
-                nextBlockOffset += BLOCK_SIZE
+        # Creating output directory if it doesn't exist
+        if not os.path.isdir(outputDirectory):
+            os.makedirs(outputDirectory)
+
+        # Looping for all saves
+        outputPaths = []
+        for block in self._blocks[1:]:
+            if not (block._blockStatus == 0x51 or
+                    (includeDeleted and block._blockStatus == 0xA1)):
+                continue
+
+            # Output files are named after the block and the save's 'file
+            # name', made safe for the filesystem
+            saveName = ''.join((character if character.isalnum() or
+                                character in '-_' else '_') for character in
+                               block.filename.rstrip('\x00'))
+            outputPath = os.path.join(outputDirectory, '%02d_%s%s.bin' %
+                                      (block.blockNumber, saveName,
+                                       ('_deleted' if block._blockStatus == 0xA1
+                                        else '')))
+
+            # Verbose output
+            if self.verbose:
+                print('Extracting data from block %d to \'%s\'...' %
+                      (block.blockNumber, outputPath))
+
+            self.write_ranges(self.save_ranges(block.blockNumber), outputPath)
+            outputPaths.append(outputPath)
 
-                # Writing data
-                outputFile.write(self.image[offset:nextBlockOffset])
+        return outputPaths
 
-                # Looping for the next block
-                i += 1
+    def extract_icons(self, outputDirectory, includeDeleted=False):
+        '''Renders the icons of all saves on the card (optionally including
+        deleted saves) as PNGs in the given directory, named after the hash
+        of the icon (see icon_key) - icons already there aren't rendered
+        again, so the directory acts as a cache shared between cards.
+        Returns a list of (block number, path, rendered) tuples'''
+
+        # Creating output directory if it doesn't exist
+        if not os.path.isdir(outputDirectory):
+            os.makedirs(outputDirectory)
+
+        # Finding the saves whose icons still need rendering
+        icons = []
+        pending = {}
+        for block in self._blocks[1:]:
+            if not (block._blockStatus == 0x51 or
+                    (includeDeleted and block._blockStatus == 0xA1)):
+                continue
+            header = self.block_data(block.blockNumber)[:SAVE_HEADER_SIZE]
+            if header[:len(BLOCK_NORMAL_MAGIC)] != BLOCK_NORMAL_MAGIC:
+                continue
+            outputPath = os.path.join(outputDirectory,
+                                      icon_key(header) + '.png')
+            rendered = not (os.path.exists(outputPath) or
+                            outputPath in pending)
+            if rendered:
+                pending[outputPath] = header
+            icons.append((block.blockNumber, outputPath, rendered))
 
         # Verbose output
-        if options.verbose:
-            print('Data written')
+        if self.verbose:
+            print('Rendering %d of %d icons into \'%s\'...' %
+                  (len(pending), len(icons), outputDirectory))
+
+        # Rendering all missing icons in one batch
+        for outputPath, frames in zip(pending,
+                                      decode_icons(pending.values())):
+            write_png(outputPath, frames,
+                      delay=(ICON_FRAME_VBLANKS.get(len(frames), 1), 60))
+
+        return icons
 
     def format_offset(self):
         '''Returning the starting point of the memory card data based on the
         format'''
 
-        if self.format == 'gme':
-            return GME_HEADER_SIZE
-        elif self.format == 'mcd':
-            return MCD_HEADER_SIZE
+        return self._dataOffset
 
     def list(self):
         '''List the contents of the memory card image'''
 
         # Looping for all blocks, skipping control block
         for block in self._blocks[1:]:
-            print('\nBlock %(blockNumber)d:\nStatus: %(status)s\nTitle: \''
-            '%(title)s\'\nSave length: %(saveLength)s\n'
-            'Country code: %(countryCode)s\nProduct code: %(productCode)s\n'
-            'Game playthrough identifier: %(gamePlayThroughIdentifier)s\n'
-            '\'File name\': %(filename)s'
-                  % {'blockNumber': block.blockNumber,
-                     'status': block.blockStatus,
-                     'title': block.title,
-                     'saveLength': block.saveLength,
-                     'countryCode': block.countryCode,
-                     'productCode': block.productCode,
-                     'gamePlayThroughIdentifier': block.gamePlayThroughIdentifier,
-                     'filename': block.filename})
-
-    def parse(self):
-        '''Parse the card image - create object representation'''
+            print(BLOCK_LISTING % block.summary())
+
+        # Warning about broken saves
+        for blockNumber, problem in sorted(self.chain_problems().items()):
+            print('Warning: The save starting at block %d of the memory card '
+                  '\'%s\' is broken - %s' % (blockNumber, self.path, problem),
+                  file=sys.stderr)
+
+    def records(self, perSave=False):
+        '''Generator of machine readable records (see LISTING_FIELDS) of all
+        blocks, or only of the first blocks of saves (including deleted
+        ones)'''
+
+        for block in self._blocks[1:]:
+
+            # Skipping blocks that don't start a save if desired
+            valid = BLOCK_VALID_INFORMATION[block._blockStatus]
+            if perSave and not valid:
+                continue
+
+            record = block.record()
+            record['path'] = self.path
+            record['status'] = block.blockStatus
+            record['chain'] = (self.save_chain(block.blockNumber) if valid
+                               else None)
+            record['region'] = (COUNTRY_CODE.get(record['countryCode']) if valid
+                                else None)
+            yield record
+
+    def recover_saves(self):
+        '''Sweeps the data blocks for save headers, returning those that
+        aren't intact saves - deleted saves, saves whose directory frames were
+        wiped and saves with broken chains - as dictionaries adding the
+        'blockNumber', 'state', rebuilt 'chain' (None if only the header can be
+        recovered), how the chain was rebuilt ('chainSource') and the
+        'confidence' taking it into account to the scan_saves candidates'''
+
+        data = self.card_data()
+        headerBlocks = set()
+        candidates = []
+        for candidate in scan_saves(data[BLOCK_SIZE:], BLOCK_SIZE):
+            candidate['blockNumber'] = candidate['offset'] // BLOCK_SIZE + 1
+            headerBlocks.add(candidate['blockNumber'])
+            candidates.append(candidate)
+
+        # Blocks used by intact saves can't belong to recovered ones
+        claimedBlocks = set()
+        problems = self.chain_problems()
+        for blockNumber, chain in self.chain_index().items():
+            if (self[blockNumber]._blockStatus == 0x51 and
+                    blockNumber not in problems):
+                claimedBlocks.update(chain)
+
+        recovered = []
+        for candidate in candidates:
+            blockNumber = candidate['blockNumber']
+            length = candidate['length']
+            blockStatus = self[blockNumber]._blockStatus
+
+            # Intact saves are already visible
+            if blockNumber in claimedBlocks:
+                continue
+            if blockStatus == 0xA1:
+                candidate['state'] = 'deleted'
+            elif blockStatus == 0x51:
+                candidate['state'] = 'broken'
+            else:
+                candidate['state'] = 'orphaned'
+
+            # Rebuilding the chain - preferably from the directory links,
+            # otherwise from the blocks following the header that aren't
+            # other saves' headers, or failing that from the next blocks that
+            # no save uses
+            chain = None
+            chainSource = None
+            otherBlocks = [otherBlock for otherBlock in
+                           range(blockNumber + 1, len(self._blocks))
+                           if otherBlock not in headerBlocks]
+            if not 1 <= length <= 15:
+                pass
+            elif (blockStatus in (0x51, 0xA1) and
+                    len(self.save_chain(blockNumber)) == length):
+                chain = self.save_chain(blockNumber)
+                chainSource = 'directory'
+            elif otherBlocks[:length - 1] == list(range(blockNumber + 1,
+                                                        blockNumber + length)):
+                chain = list(range(blockNumber, blockNumber + length))
+                chainSource = 'contiguous'
+            else:
+                otherBlocks = [otherBlock for otherBlock in otherBlocks
+                               if otherBlock not in claimedBlocks]
+                if len(otherBlocks) >= length - 1:
+                    chain = [blockNumber] + otherBlocks[:length - 1]
+                    chainSource = 'unclaimed'
+
+            candidate['chain'] = chain
+            candidate['chainSource'] = chainSource
+            candidate['confidence'] *= CHAIN_CONFIDENCE[chainSource]
+            recovered.append(candidate)
+
+        return recovered
+
+    def parse(self, lazy=False):
+        '''Parse the card image - create object representation. When lazy,
+        only the control block is validated here - each block decodes its
+        directory frame, title and data the first time they are accessed'''
 
         # Verbose output
-        if options.verbose:
+        if self.verbose:
             print('Parsing memory card image...')
 
         # Fetching the offset to the first valid data
         offset = self.format_offset()
 
+        # Working with a view of the image so that blocks and frames aren't
+        # copied (the image itself is already a view when memory mapped)
+        image = memoryview(self.image)
+
         # Fetching the header/metadata block, block 0
-        if options.verbose:
+        if self.verbose:
             print('Parsing control block (block 0)...')
-        controlBlock = self.image[offset:offset + BLOCK_SIZE]
+        controlBlock = image[offset:offset + BLOCK_SIZE]
 
         # Debug code
         #print(controlBlock[:len(BLOCK_0_MAGIC)])
@@ -313,190 +2186,417 @@ class PS1Card(object):
                             'invalid control block (block 0), and is '
                             'therefore corrupt' % self.path)
 
+        # Lazy parsing - blocks parse themselves on demand
+        if lazy:
+            for blockNumber in range(1, 16):
+                self[blockNumber] = PS1CardLazyBlock(self, blockNumber)
+            return
+
+        # Calculating all control block checksums in one pass
+        with PhaseTimer('checksum', CHECKSUMMED_FRAMES * FRAME_SIZE):
+            checksums = calculate_frame_checksums(controlBlock)
+
         # Looping for all block-describing frames in the control block,
         # ignoring its own frame... (remember that the end of the range
         # given is the desired end + 1)
-        for blockNumber in range(1, 16):
+        with PhaseTimer('directory', 15 * FRAME_SIZE):
+            for blockNumber in range(1, 16):
+
+                # Instantiating memory card block object and saving - note
+                # that this is missing the save title, which is contained in
+                # the actual block itself
+                self[blockNumber] = PS1CardBlock(blockNumber,
+                                        *self.parse_directory_frame(
+                                            blockNumber,
+                                            checksums[blockNumber]),
+                                        verbose=self.verbose)
 
-            # Verbose output
-            if options.verbose:
-                print('\nParsing block %d metadata...' % blockNumber)
-
-            # Determining current offset (the metadata is maintained in one
-            # frame per block described)
-            offset = blockNumber * FRAME_SIZE
-
-            # Making sure the frame is valid - XORing all but last byte and
-            # comparing later to stored XOR (last byte) - this is a warning
-            # rather than an error, since my Tomb Raider - The Last Revelation
-            # save's first block in the multiblock save has calculated XOR 124
-            # stored XOR 123 and works fine on PS2 - Gran Turismo and Gran
-            # Turismo 2 are other examples. Testing GT1 specifically, copying
-            # the save to a different card and reimaging results in exactly
-            # the same XOR failure - yet the save loads fine on the PS2. It
-            # flat out doesnt on the Pandora, but there'll be another reason
-            # for that. Because it works on the console, I think this isn't a
-            # real example of corruption
-            accumulator = 0
-            for byteAddress in range(offset, offset + FRAME_SIZE - 1):
-                accumulator ^= controlBlock[byteAddress]
-            if accumulator != controlBlock[offset + FRAME_SIZE - 1]:
-                print('Warning: The passed memory card \'%s\' contains an'
-                ' invalid frame in the control block (frame %d of block 0'
-                ' which describes block %d), and is therefore in theory '
-                'corrupt. However, I have examples of multiblock saves '
-                'where they appear to work fine - so just raising a '
-                'warning\n\n'
-                'Calculated XOR value: %s\nRecorded value: %s\n' %
-                (self.path, blockNumber, blockNumber, accumulator,
-                 controlBlock[offset + FRAME_SIZE - 1]), file=sys.stderr)
-
-            # Debug code
-            #print('accumulator: %d\nActual XOR: %d' % (accumulator,
-            #                          controlBlock[offset + FRAME_SIZE - 1]))
-
-            # Is block in use, a normal block, a link block (and where the
-            # link is relatively in a multi-block save) or unusable
-            blockStatus = controlBlock[offset]
-
-            # Checking block status
-            if (blockStatus == 0x51 or blockStatus == 0xA1):
-
-                # First block on its own or the first block in a multiblock
-                # save, or the block is deleted (still reporting as it may
-                # contain a recoverable save)
-                # How many blocks the save consists of. This is only valid if
-                # the block is the first block in the save - otherwise its
-                # always 1 block long
-                saveLength = controlBlock[offset + 4:offset + 7]
-
-                # Location of next block of multi-block save - not sure how
-                # useful this is?
-                saveNextBlock = controlBlock[offset + 8:offset + 10]
-
-                # Country (region rather) code, decoded to UTF-8 string
-                countryCode = controlBlock[offset + 10:offset + 12].decode('utf8')
-
-                # The game code - printed on the spine of game case insert,
-                # decoded to UTF-8 string
-                productCode = controlBlock[offset + 12:offset + 22].decode('utf8')
-
-                # Identifier unique to the game and playthrough/session in
-                # progress (new game = new playthrough), decoded to UTF-8
-                # string
-                gamePlayThroughIdentifier = controlBlock[offset + 22:offset + 31].decode('utf8')
-
-            elif (blockStatus == 0x52 or blockStatus == 0x53 or
-                  blockStatus == 0xA0):
-
-                # Block is in the middle or at the end of a multiblock save,
-                # or is unused
-                # Setting variables to None
-                # It seems in linked saves, middle blocks onwards have old
-                # (past save?) data saved in these metadata frames, and are
-                # therefore invalid
-                gamePlayThroughIdentifier = productCode = countryCode = saveNextBlock = saveLength = None
-
-            # Delete (0xA1) is already handled in single block case
-
-            elif blockStatus == 0xFF:
-
-                # Block is unusable - no XOR check needed - warning user
-                print('Warning: The passed memory card \'%s\' contains block '
-                      '%d which is flagged as unusable' % (self.path,
-                                                blockNumber), file=sys.stderr)
-
-                # Setting variables to None
-                gamePlayThroughIdentifier = productCode = countryCode = saveNextBlock = saveLength = None
+        # Control block has been parsed - looping for all other blocks
+        if self.verbose:
+            print('Control block parsing complete. Parsing actual blocks...')
+        with PhaseTimer('title', 15 * 64):
+            for blockNumber in range(1, 16):
 
-            else:
+                # Fetching current block (a view) and saving (skips block 0)
+                self[blockNumber].data = self.block_data(blockNumber)
 
-                # Invalid block status detected - erroring
-                raise Exception('The passed memory card \'%s\' contains '
-                                'block %d that has an invalid (unknown) '
-                                'status (\'%s\') - described in block 0 frame'
-                                '%d' % (self.path, blockNumber, blockStatus,
-                                        blockNumber))
-
-            # Instantiating memory card block object and saving - note that
-            # this is missing the save title, which is contained in the
-            # actual block itself
-            self[blockNumber] = PS1CardBlock(blockNumber, blockStatus,
-                                            saveLength, saveNextBlock,
-                                            countryCode, productCode,
-                                            gamePlayThroughIdentifier)
-
-        # Resetting offset
-        offset = self.format_offset()
+                # Obtaining save title if this is the first block of a save
+                self[blockNumber].title = self.parse_block_title(blockNumber)
 
-        # Control block has been parsed - looping for all other blocks
-        if options.verbose:
-            print('Control block parsing complete. Parsing actual blocks...')
-        for blockNumber in range(1, 16):
+    def parse_block_title(self, blockNumber):
+        '''Returns the save title of the passed block, or None if it isn't
+        the first block of a save'''
+
+        # Fetching block
+        block = self.block_data(blockNumber)
+
+        # Verbose output
+        if self.verbose:
+            offset = self.format_offset() + blockNumber * BLOCK_SIZE
+            print('\nParsing block %d, bytes %d to %d...'
+                  % (blockNumber, offset, offset + BLOCK_SIZE - 1))
+
+        # Checking for a normal one-block save or the first block in a
+        # multiblock save
+        if (block[:len(BLOCK_NORMAL_MAGIC)] == BLOCK_NORMAL_MAGIC):
+
+            # Block is normal/first of a multiblock save - obtaining
+            # save title - Shift-JIS encoded. This looks like the
+            # characters are double-spaced, but according to the bits
+            # they aren't... all 3 shift-jis encodings look like arse
+            title = self.shift_jis_decoder(block[4:68])
+
+            # Verbose output
+            if self.verbose:
+                print('Block %d save title: \'%s\'' % (blockNumber, title))
 
-            # Fetching current block and saving (skips block 0)
-            offset += BLOCK_SIZE
-            block = self.image[offset:offset + BLOCK_SIZE]
-            self[blockNumber].data = block
+            return title
 
+        else:
+
+            # Block is linked as part of a multiblock save - pure data
             # Verbose output
-            if options.verbose:
-                print('\nParsing block %d, bytes %d to %d...'
-                      % (blockNumber, offset, offset + BLOCK_SIZE - 1))
+            if self.verbose:
+                print('Block %d is a linked block' % blockNumber)
+
+            return None
+
+    def parse_directory_frame(self, blockNumber, checksum=None):
+        '''Parses the control block frame describing the passed block,
+        returning the (blockStatus, saveLength, saveNextBlock, countryCode,
+        productCode, gamePlayThroughIdentifier) arguments for PS1CardBlock.
+        The frame's checksum is calculated unless already known'''
+
+        # Verbose output
+        if self.verbose:
+            print('\nParsing block %d metadata...' % blockNumber)
+
+        # Determining current offset (the metadata is maintained in one
+        # frame per block described) and fetching the frame
+        offset = self.format_offset() + blockNumber * FRAME_SIZE
+        frame = memoryview(self.image)[offset:offset + FRAME_SIZE]
+
+        # Making sure the frame is valid - XORing all but last byte and
+        # comparing later to stored XOR (last byte) - this is a warning
+        # rather than an error, since my Tomb Raider - The Last Revelation
+        # save's first block in the multiblock save has calculated XOR 124
+        # stored XOR 123 and works fine on PS2 - Gran Turismo and Gran
+        # Turismo 2 are other examples. Testing GT1 specifically, copying
+        # the save to a different card and reimaging results in exactly
+        # the same XOR failure - yet the save loads fine on the PS2. It
+        # flat out doesnt on the Pandora, but there'll be another reason
+        # for that. Because it works on the console, I think this isn't a
+        # real example of corruption
+        if checksum is None:
+            checksum = calculate_frame_checksums(frame, 1)[0]
+        accumulator = int(checksum)
+        if accumulator != frame[FRAME_SIZE - 1]:
+            print('Warning: The passed memory card \'%s\' contains an'
+            ' invalid frame in the control block (frame %d of block 0'
+            ' which describes block %d), and is therefore in theory '
+            'corrupt. However, I have examples of multiblock saves '
+            'where they appear to work fine - so just raising a '
+            'warning\n\n'
+            'Calculated XOR value: %s\nRecorded value: %s\n' %
+            (self.path, blockNumber, blockNumber, accumulator,
+             frame[FRAME_SIZE - 1]), file=sys.stderr)
+
+        # Debug code
+        #print('accumulator: %d\nActual XOR: %d' % (accumulator,
+        #                          frame[FRAME_SIZE - 1]))
+
+        # Is block in use, a normal block, a link block (and where the
+        # link is relatively in a multi-block save) or unusable
+        blockStatus = frame[0]
+
+        # Checking block status
+        if (blockStatus == 0x51 or blockStatus == 0xA1):
+
+            # First block on its own or the first block in a multiblock
+            # save, or the block is deleted (still reporting as it may
+            # contain a recoverable save)
+            # How many blocks the save consists of. This is only valid if
+            # the block is the first block in the save - otherwise its
+            # always 1 block long
+            # These small fields are copied out of the image so that the
+            # block doesn't hold views into it
+            saveLength = bytes(frame[4:7])
 
-            # Checking for a normal one-block save or the first block in a
-            # multiblock save
-            if (block[:len(BLOCK_NORMAL_MAGIC)] == BLOCK_NORMAL_MAGIC):
+            # Location of next block of multi-block save - not sure how
+            # useful this is?
+            saveNextBlock = bytes(frame[8:10])
 
-                # Block is normal/first of a multiblock save - obtaining
-                # save title - Shift-JIS encoded. This looks like the
-                # characters are double-spaced, but according to the bits
-                # they aren't... all 3 shift-jis encodings look like arse
-                self[blockNumber].title = self.shift_jis_decoder(block[4:68])
+            # Country (region rather) code, decoded to UTF-8 string
+            countryCode = str(frame[10:12], 'utf8')
 
-                # Verbose output
-                if options.verbose:
-                    print('Block %d save title: \'%s\'' % (blockNumber,
-                                                    self[blockNumber].title))
+            # The game code - printed on the spine of game case insert,
+            # decoded to UTF-8 string
+            productCode = str(frame[12:22], 'utf8')
 
+            # Identifier unique to the game and playthrough/session in
+            # progress (new game = new playthrough), decoded to UTF-8
+            # string
+            gamePlayThroughIdentifier = str(frame[22:31], 'utf8')
+
+        elif (blockStatus == 0x52 or blockStatus == 0x53 or
+              blockStatus == 0xA2 or blockStatus == 0xA3):
+
+            # Block is in the middle or at the end of a multiblock save
+            # (which may be deleted)
+            # Setting variables to None
+            # It seems in linked saves, middle blocks onwards have old
+            # (past save?) data saved in these metadata frames, and are
+            # therefore invalid - apart from the link to the next block in
+            # the save
+            gamePlayThroughIdentifier = productCode = countryCode = saveLength = None
+            saveNextBlock = bytes(frame[8:10])
+
+        elif blockStatus == 0xA0:
+
+            # Block is unused - setting variables to None
+            gamePlayThroughIdentifier = productCode = countryCode = saveNextBlock = saveLength = None
+
+        # Delete (0xA1) is already handled in single block case
+
+        elif blockStatus == 0xFF:
+
+            # Block is unusable - no XOR check needed - warning user
+            print('Warning: The passed memory card \'%s\' contains block '
+                  '%d which is flagged as unusable' % (self.path,
+                                            blockNumber), file=sys.stderr)
+
+            # Setting variables to None
+            gamePlayThroughIdentifier = productCode = countryCode = saveNextBlock = saveLength = None
+
+        else:
+
+            # Invalid block status detected - erroring
+            raise Exception('The passed memory card \'%s\' contains '
+                            'block %d that has an invalid (unknown) '
+                            'status (\'%s\') - described in block 0 frame'
+                            '%d' % (self.path, blockNumber, blockStatus,
+                                    blockNumber))
+
+        return (blockStatus, saveLength, saveNextBlock, countryCode,
+                productCode, gamePlayThroughIdentifier)
+
+    def repair_checksums(self):
+        '''Recalculates the checksums of the control block frames whose
+        recorded checksum is wrong, returning the frames repaired. Only the
+        frames fsck can safely repair are (see check_card_image) - making a
+        frame with stale links or other problems look valid would break the
+        saves relying on it'''
+
+        self._check_writable()
+        invalidFrames = self.invalid_frames()
+        offset = self.format_offset()
+        repaired = []
+        for writeOffset, frame in check_card_image(self.image)[2]:
+            frameNumber = (writeOffset - offset) // FRAME_SIZE
+            if frameNumber in invalidFrames:
+                self.write_data(frameNumber * FRAME_SIZE, frame)
+                if 1 <= frameNumber <= 15:
+                    self._refresh_block(frameNumber)
+                repaired.append(frameNumber)
+        return repaired
+
+    def save(self):
+        '''Persists the edited (dirty) frames to the memory card image in
+        place and crash-safely, returning the number of bytes written'''
+
+        self._check_writable()
+        if not self._dirtyFrames:
+            return 0
+
+        # Coalescing adjacent dirty frames into single writes - edited
+        # directory frames of GME images need their header slot bytes written
+        # too
+        writes = []
+        if self.format == 'gme' and not self._dirtyFrames.isdisjoint(
+                range(1, 16)):
+            writes.append([GME_STATUS_OFFSET,
+                           GME_LINK_OFFSET + 15 - GME_STATUS_OFFSET])
+        offset = self.format_offset()
+        for frameNumber in sorted(self._dirtyFrames):
+            frameOffset = offset + frameNumber * FRAME_SIZE
+            if writes and writes[-1][0] + writes[-1][1] == frameOffset:
+                writes[-1][1] += FRAME_SIZE
+            else:
+                writes.append([frameOffset, FRAME_SIZE])
+        writes = [(frameOffset, bytes(self.image[frameOffset:
+                                                 frameOffset + length]))
+                  for frameOffset, length in writes]
+
+        # Verbose output
+        if self.verbose:
+            print('Writing %d edited frames to \'%s\'...' %
+                  (len(self._dirtyFrames), self.path))
+
+        write_journaled(self.path, writes)
+        self._dirtyFrames.clear()
+        return sum(len(data) for offset, data in writes)
+
+    def save_chain(self, blockNumber):
+        '''Returns the block numbers making up the save starting at the
+        passed block, following the next block links - from the chain index
+        for the first blocks of saves'''
+
+        chain = self.chain_index().get(blockNumber)
+        if chain is None:
+            chain = self._follow_chain(blockNumber)[0]
+        return list(chain)
+
+    def save_ranges(self, blockNumber):
+        '''Returns the (offset, length) ranges of the image holding the save
+        data (minus headers) of the save starting at the passed block -
+        adjacent blocks are merged into one range'''
+
+        ranges = []
+        for chainBlockNumber in self.save_chain(blockNumber):
+
+            # The first block of the save starts with headers
+            offset = self.format_offset() + chainBlockNumber * BLOCK_SIZE
+            length = BLOCK_SIZE
+            if chainBlockNumber == blockNumber:
+                offset += SAVE_HEADER_SIZE
+                length -= SAVE_HEADER_SIZE
+
+            # Merging with the previous range when contiguous
+            if ranges and sum(ranges[-1]) == offset:
+                ranges[-1] = (ranges[-1][0], ranges[-1][1] + length)
             else:
+                ranges.append((offset, length))
+
+        return ranges
 
-                # Block is linked as part of a multiblock save - pure data
-                # Verbose output
-                if options.verbose:
-                    print('Block %d is a linked block' % blockNumber)
+    def set_block_status(self, blockNumber, blockStatus):
+        '''Changes the status of the block in the control block'''
+
+        if blockStatus not in BLOCK_STATUS:
+            raise Exception('Invalid block status: %s' % blockStatus)
+        frame = bytearray(self.directory_frame(blockNumber))
+        frame[0] = blockStatus
+        self.write_directory_frame(blockNumber, frame)
 
     def shift_jis_decoder(self, titleBytes):
         '''Attempt to decode passed bytes via shift-jis encoding, discarding
         any invalid/non-printable bytes at the end'''
 
         # Most save titles use valid shift-jis, but some leave crap data
-        # straight after the title
-
-        # Permissive encoding to get the basic valid string
-        title = titleBytes.decode('shift-jis', 'replace')
-
-        # Searching for the first control character - this appears to end the
-        # user-valid data
-        for i in range(len(title)):
-            if unicodedata.category(title[i]) == 'Cc':
-
-                # Control character found - breaking after setting valid title
-                title = title[:i]
-                break
-
-        # Returning valid title
-        return title
+        # straight after the title - see decode_title
+        return decode_title(titleBytes)
+
+    def undelete_save(self, blockNumber):
+        '''Restores the deleted save starting at the passed block'''
+
+        # Making sure this is the first block of a deleted save
+        if self[blockNumber]._blockStatus != 0xA1:
+            raise Exception('Block %d of the memory card \'%s\' is not the '
+                            'first block of a deleted save - status: \'%s\''
+                            % (blockNumber, self.path,
+                               self[blockNumber].blockStatus))
+
+        # Broken deleted saves can't be restored - their links lead nowhere,
+        # or into blocks other saves now use
+        chain = self.save_chain(blockNumber)
+        problem = self.chain_problems().get(blockNumber)
+        for chainBlockNumber in chain[1:]:
+            if (problem is None and self[chainBlockNumber]._blockStatus not in
+                    (0xA2, 0xA3)):
+                problem = ('block %d has status 0x%02X' % (
+                    chainBlockNumber, self[chainBlockNumber]._blockStatus))
+        if problem is not None:
+            raise Exception('The deleted save starting at block %d of the '
+                            'memory card \'%s\' is broken (%s) and therefore '
+                            'can\'t be undeleted' %
+                            (blockNumber, self.path, problem))
+
+        undeletedStatus = {deleted: status for status, deleted in
+                           DELETED_STATUS.items()}
+        for chainBlockNumber in chain:
+            self.set_block_status(chainBlockNumber, undeletedStatus[
+                self[chainBlockNumber]._blockStatus])
+
+    def write_data(self, offset, data):
+        '''Writes the data to the image at the offset (from the start of the
+        memory card data), marking the frames touched as dirty'''
+
+        self._check_writable()
+        if not data:
+            return
+        start = self.format_offset() + offset
+        self.image[start:start + len(data)] = data
+        self._dirtyFrames.update(range(offset // FRAME_SIZE,
+                                       (offset + len(data) - 1) //
+                                       FRAME_SIZE + 1))
+
+        # DexDrive headers repeat the status and link bytes of the directory
+        # frames, and must follow them
+        if (self.format == 'gme' and offset < 16 * FRAME_SIZE and
+                offset + len(data) > FRAME_SIZE):
+            statuses, links = gme_slot_bytes(self.block_data(0))
+            self.image[GME_STATUS_OFFSET:GME_STATUS_OFFSET + 15] = statuses
+            self.image[GME_LINK_OFFSET:GME_LINK_OFFSET + 15] = links
+
+    def _write_changed_directory_frame(self, blockNumber, frame):
+        '''Replaces the control block frame describing the block only if it
+        differs, so that unchanged frames aren't written'''
+
+        frame = bytearray(frame)
+        frame[FRAME_SIZE - 1] = calculate_frame_checksums(frame, 1)[0]
+        if frame != self.directory_frame(blockNumber):
+            self.write_directory_frame(blockNumber, frame)
+
+    def write_directory_frame(self, blockNumber, frame):
+        '''Replaces the control block frame describing the block, calculating
+        its checksum'''
+
+        frame = bytearray(frame)
+        frame[FRAME_SIZE - 1] = calculate_frame_checksums(frame, 1)[0]
+        self.write_data(blockNumber * FRAME_SIZE, frame)
+        self._refresh_block(blockNumber)
+
+    def write_ranges(self, ranges, outputPath, prefix=b''):
+        '''Write the passed (offset, length) ranges of the image to the
+        given path, after the prefix if passed - copied file to file in the
+        kernel where possible, otherwise written from views of the image in
+        one vectored write. The file is out of date while there are unsaved
+        edits, so they are always written from the image'''
+
+        with PhaseTimer('extract', sum(length for offset, length in ranges)), \
+                io.open(outputPath, 'wb') as outputFile:
+
+            # The prefix goes first, so that copies follow it
+            write_views(outputFile.fileno(), [memoryview(prefix)])
+
+            # Copying directly from the card image file when possible
+            if not self._dirtyFrames and os.path.isfile(self.path):
+                with io.open(self.path, 'rb') as sourceFile:
+                    if copy_file_ranges(sourceFile.fileno(),
+                                        outputFile.fileno(), ranges):
+                        return
+
+            # Falling back to writing views of the loaded image
+            image = memoryview(self.image)
+            write_views(outputFile.fileno(), [image[offset:offset + length]
+                                              for offset, length in ranges])
 
     # Debug code
     # Note the leading 'b and trailing '
-    #print('Control block:\n\n%s' % controlBlock.translate(translationTable))
+    #print('Control block:\n\n%s' % controlBlock.translate(translation_table()))
 
 
 class PS1CardBlock(object):
 
+    # Slots rather than a per-instance dictionary, as directories of many
+    # cards can be held in memory
+    __slots__ = ('blockNumber', '_blockStatus', '_saveLength',
+                 '_saveNextBlock', '_countryCode', '_productCode',
+                 '_gamePlayThroughIdentifier', '_title', 'data')
+
     def __init__(self, blockNumber, blockStatus, saveLength, saveNextBlock,
-                 countryCode, productCode, gamePlayThroughIdentifier):
+                 countryCode, productCode, gamePlayThroughIdentifier,
+                 verbose=False):
 
         # Initialising variables
         self.blockNumber = blockNumber
@@ -507,9 +2607,10 @@ class PS1CardBlock(object):
         self._productCode = productCode
         self._gamePlayThroughIdentifier = gamePlayThroughIdentifier
         self._title = None  # This is set when blocks themselves are parsed
+        self.data = None  # This too
 
         # Verbose output
-        if options.verbose:
+        if verbose:
             print('Initialising memory card block %(blockNumber)d:\n'
                   'blockStatus: %(blockStatus)s\n'
                   'saveLength: %(saveLength)s\n'
@@ -585,6 +2686,22 @@ class PS1CardBlock(object):
 
     gamePlayThroughIdentifier = property(_get_gamePlayThroughIdentifier)
 
+    # nextBlock property, not allowed to set
+    def _get_nextBlock(self):
+
+        # Checking if the block links to another
+        if self._saveNextBlock is None:
+            return None
+        link = int.from_bytes(self._saveNextBlock, 'little')
+        if link == LINK_NONE:
+            return None
+
+        # Links are to the data blocks counting from 0, i.e. skipping the
+        # control block
+        return link + 1
+
+    nextBlock = property(_get_nextBlock)
+
     # productCode property, not allowed to set
     def _get_productCode(self):
 
@@ -633,86 +2750,2378 @@ class PS1CardBlock(object):
 
     title = property(_get_title, _set_title)
 
+    def record(self):
+        '''Returns the block's directory information as raw values rather
+        than for display - fields that aren't valid for the block are None'''
 
-# Configuring and parsing passed options
-parser = OptionParser(version=('%%prog %s%s' % (VERSION, GPL_NOTICE)))
-parser.add_option('-l', '--list', dest='list', help='list contents of memory '
-'card image', metavar='list', action='store_true', default=False)
-parser.add_option('-o', '--output', dest='output', help='path to output file',
-metavar='output', default=None)
-parser.add_option('-v', '--verbose', dest='verbose', help='output useful '
-'information about what the program is doing', action='store_true',
-default=False)
-parser.add_option('-x', '--extract', dest='extract', type='int',
-help='extract the data region of a save (without the header) beginning from '
-'the desired block further blocks included if it is a multiblock save) to the'
-' file specified in --output, or \'<memory card image path>.block_<block '
-'number>.bin\' by default', metavar='extract', default=None)
-(options, args) = parser.parse_args()
-
-if args:
-
-    # Making sure only one mode is used at once
-    if (options.list + bool(options.extract)) > 1:
-        print(parser.get_usage() + '\nOnly one mode can be enabled at once\n',
-              file=sys.stderr)
-        sys.exit(1)
+        # Save lengths are recorded in bytes
+        valid = BLOCK_VALID_INFORMATION[self._blockStatus]
+        if valid:
+            saveLength = (int.from_bytes(self._saveLength, 'little') //
+                          BLOCK_SIZE)
+        else:
+            saveLength = None
+
+        return {'blockNumber': self.blockNumber,
+                'statusByte': self._blockStatus,
+                'saveLength': saveLength,
+                'nextBlock': self.nextBlock,
+                'countryCode': self._countryCode if valid else None,
+                'productCode': (self._productCode.rstrip('\x00') if valid
+                                else None),
+                'gamePlayThroughIdentifier': (
+                    self._gamePlayThroughIdentifier.rstrip('\x00') if valid
+                    else None),
+                'title': self.title if valid else None}
+
+    def summary(self):
+        '''Returns the reportable information of the block as a dictionary -
+        this is what is listed, and is cheap to pass between processes'''
+
+        return {'blockNumber': self.blockNumber,
+                'status': self.blockStatus,
+                'title': self.title,
+                'saveLength': self.saveLength,
+                'countryCode': self.countryCode,
+                'productCode': self.productCode,
+                'gamePlayThroughIdentifier': self.gamePlayThroughIdentifier,
+                'filename': self.filename}
+
+
+class PS1CardLazyBlock(PS1CardBlock):
+    '''Memory card block that parses its control block frame, title and data
+    from the card image the first time they are accessed, caching the
+    results'''
+
+    __slots__ = ('_card',)
+
+    # Attributes set from the block's control block frame, in the order
+    # returned by PS1Card.parse_directory_frame
+    _DIRECTORY_ATTRIBUTES = ('_blockStatus', '_saveLength', '_saveNextBlock',
+                             '_countryCode', '_productCode',
+                             '_gamePlayThroughIdentifier')
+
+    def __init__(self, card, blockNumber):
+
+        # Initialising variables - PS1CardBlock's initialiser is deliberately
+        # not called, the parsed attributes are missing until first accessed
+        self.blockNumber = blockNumber
+        self._card = card
 
-    # Verbose output
-    if options.verbose:
-        print('Memory card to analyse: \'%s\'' % args[0])
+    def __getattr__(self, name):
+        '''Only called when an attribute hasn't been set yet - parsing the
+        relevant part of the card and caching it on the block'''
+
+        if name in self._DIRECTORY_ATTRIBUTES:
+
+            # Parsing the block's control block frame
+            for attribute, value in zip(self._DIRECTORY_ATTRIBUTES,
+                    self._card.parse_directory_frame(self.blockNumber)):
+                setattr(self, attribute, value)
+
+        elif name == '_title':
+
+            # Decoding the save title from the block itself
+            self._title = self._card.parse_block_title(self.blockNumber)
+
+        elif name == 'data':
+
+            # Fetching a view of the block data
+            self.data = self._card.block_data(self.blockNumber)
+
+        else:
+            raise AttributeError(name)
+
+        return getattr(self, name)
+
+
+class PS1DirectoryTable(object):
+    '''Columnar store of the directories of many memory cards - each column
+    is a packed array with one row per block (15 per card), and blocks are
+    accessed through thin PS1DirectoryTableBlock views over a row'''
+
+    def __init__(self):
+
+        import array
+
+        # Initialising variables - the code columns hold the raw fixed width
+        # bytes from the control block frames
+        self.paths = []
+        self.statusBytes = bytearray()
+        self.saveLengths = array.array('I')  # In bytes, as recorded
+        self.saveNextBlocks = array.array('H')  # Raw links
+        self.countryCodes = bytearray()  # 2 bytes per row
+        self.productCodes = bytearray()  # 10 bytes per row
+        self.gamePlayThroughIdentifiers = bytearray()  # 9 bytes per row
+        self.titles = []
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add_card(self, memoryCard):
+        '''Adds the directory of the passed (parsed) PS1Card to the table,
+        returning its card index'''
+
+        controlBlock = memoryCard.block_data(0)
+        for block in memoryCard._blocks[1:]:
+
+            # Copying fields straight from the block's control block frame
+            offset = block.blockNumber * FRAME_SIZE
+            frame = controlBlock[offset:offset + FRAME_SIZE]
+            self.statusBytes.append(frame[0])
+            self.saveLengths.append(int.from_bytes(frame[4:7], 'little'))
+            self.saveNextBlocks.append(LINK_NONE if block._saveNextBlock is None
+                                       else int.from_bytes(frame[8:10],
+                                                           'little'))
+            self.countryCodes += frame[10:12]
+            self.productCodes += frame[12:22]
+            self.gamePlayThroughIdentifiers += frame[22:31]
+
+            # Titles are only decoded for blocks that report them
+            self.titles.append(block.title if
+                               BLOCK_VALID_INFORMATION[block._blockStatus]
+                               else None)
+
+        self.paths.append(memoryCard.path)
+        return len(self.paths) - 1
+
+    def block(self, cardIndex, blockNumber):
+        '''Returns a view of the passed card's block'''
+
+        # Making sure the indexes are in an appropriate range
+        if not 0 <= cardIndex < len(self.paths):
+            raise Exception('Invalid directory table card index requested: %s'
+                            % cardIndex)
+        if not (blockNumber >= 1 and blockNumber <= 15):
+            raise Exception('Invalid memory card block number requested: %s'
+                            % blockNumber)
 
-    # Instantiating memory card
-    memoryCard = PS1Card(args[0])
+        return PS1DirectoryTableBlock(self, cardIndex * 15 + blockNumber - 1,
+                                      blockNumber)
 
-    if options.extract:
+    def blocks(self, cardIndex):
+        '''Returns views of all blocks of the passed card'''
+
+        return [self.block(cardIndex, blockNumber)
+                for blockNumber in range(1, 16)]
+
+
+class PS1DirectoryTableBlock(PS1CardBlock):
+    '''Memory card block that is a view of a PS1DirectoryTable row - the raw
+    attributes PS1CardBlock reports from are read from the table columns'''
+
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row, blockNumber):
+
+        # Initialising variables - PS1CardBlock's initialiser is deliberately
+        # not called, the attributes are in the table
+        self.blockNumber = blockNumber
+        self._table = table
+        self._row = row
+
+    @property
+    def _blockStatus(self):
+        return self._table.statusBytes[self._row]
+
+    @property
+    def _countryCode(self):
+        return str(self._table.countryCodes[self._row * 2:self._row * 2 + 2],
+                   'utf8')
+
+    @property
+    def _gamePlayThroughIdentifier(self):
+        return str(self._table.gamePlayThroughIdentifiers[self._row * 9:
+                                                          self._row * 9 + 9],
+                   'utf8')
+
+    @property
+    def _productCode(self):
+        return str(self._table.productCodes[self._row * 10:
+                                            self._row * 10 + 10], 'utf8')
+
+    @property
+    def _saveLength(self):
+        return self._table.saveLengths[self._row].to_bytes(3, 'little')
+
+    @property
+    def _saveNextBlock(self):
+        return self._table.saveNextBlocks[self._row].to_bytes(2, 'little')
+
+    @property
+    def _title(self):
+        return self._table.titles[self._row]
+
+
+class RecordWriter(object):
+    '''Streams machine readable records to an output file as JSON Lines, CSV
+    or TSV, with the fields in LISTING_FIELDS'''
+
+    def __init__(self, outputFile, outputFormat):
+
+        import csv
+
+        # Initialising variables
+        self.outputFile = outputFile
+        self.outputFormat = outputFormat
+        self._csvWriter = None
+
+        # Validating the format
+        if outputFormat not in LISTING_FORMATS[1:]:
+            raise Exception('Unknown machine readable listing format \'%s\''
+                            % outputFormat)
+
+        # Delimited formats start with a header row
+        if outputFormat in ('csv', 'tsv'):
+            self._csvWriter = csv.writer(outputFile, delimiter=(
+                ',' if outputFormat == 'csv' else '\t'), lineterminator='\n')
+            self._csvWriter.writerow(LISTING_FIELDS)
+
+    def write(self, record):
+        '''Writes one record'''
+
+        if self._csvWriter is None:
+
+            import json
+
+            # JSON Lines - one object per line, fields in a stable order
+            self.outputFile.write(json.dumps({field: record.get(field)
+                                              for field in LISTING_FIELDS},
+                                             ensure_ascii=False) + '\n')
+
+        else:
+
+            # Delimited - missing values are empty and chains are comma
+            # separated
+            row = []
+            for field in LISTING_FIELDS:
+                value = record.get(field)
+                if value is None:
+                    value = ''
+                elif field == 'chain':
+                    value = ','.join(str(blockNumber) for blockNumber in value)
+                row.append(value)
+            self._csvWriter.writerow(row)
+
+
+def iterate_card_paths(paths):
+    '''Generator expanding the passed paths into memory card image paths -
+    directories are walked for files with a known card extension, archives
+    are listed for card members, globs are expanded and '-' reads a list of
+    paths from stdin, one per line'''
+
+    import glob
+
+    def archive_cards(archivePath):
+        '''Card members of the archive - an unreadable archive is warned
+        about rather than ending the run'''
 
-        # Extracting block(s) from memory card image
-        # Validating block requested (tests such as '<block number> in
-        # memoryCard' seem to fail as this works on identities rather than just
-        # the number?)
         try:
-            block = memoryCard[options.extract]
+            yield from archive_card_paths(archivePath)
+        except Exception as e:
+            print('Warning: The archive \'%s\' couldn\'t be read: %s' %
+                  (archivePath, e), file=sys.stderr)
+
+    for path in paths:
+
+        # Reading a list of paths from stdin
+        if path == '-':
+            for line in sys.stdin:
+                line = line.rstrip('\n')
+                if line:
+                    yield line
+            continue
+
+        # Expanding globs - when the pattern doesn't match anything, it is
+        # passed on so that a per-card error is reported
+        if glob.has_magic(path):
+            matches = sorted(glob.iglob(path, recursive=True))
+            if not matches:
+                yield path
+            for match in matches:
+                if os.path.isdir(match):
+                    yield from iterate_card_paths([match])
+                elif match.lower().endswith(ARCHIVE_EXTENSIONS):
+                    yield from archive_cards(match)
+                else:
+                    yield match
+            continue
+
+        # Walking directories - sorted so that output order is stable
+        if os.path.isdir(path):
+            for directory, directoryNames, fileNames in os.walk(path):
+                directoryNames.sort()
+                for fileName in sorted(fileNames):
+                    if fileName.lower().endswith(CARD_EXTENSIONS):
+                        yield os.path.join(directory, fileName)
+                    elif fileName.lower().endswith(ARCHIVE_EXTENSIONS):
+                        yield from archive_cards(os.path.join(directory,
+                                                              fileName))
+            continue
+
+        # Archives
+        if (path.lower().endswith(ARCHIVE_EXTENSIONS) and
+                os.path.isfile(path)):
+            yield from archive_cards(path)
+            continue
+
+        # Normal file (or something that doesn't exist, which is reported
+        # later)
+        yield path
+
+
+def analyse_card(cardPath, verbose=False, records=False, perSave=False):
+    '''Batch worker - loads and parses the memory card image, returning a
+    (cardPath, format, block summaries, error) tuple, or machine readable
+    records rather than summaries if desired. Failures are returned rather
+    than raised so that one corrupt card doesn't abort a batch run'''
+
+    # Cards are memory mapped and closed straight after summarising so that
+    # workers don't accumulate image data
+    try:
+        with PS1Card(cardPath, memoryMap=True, verbose=verbose) as memoryCard:
+            if records:
+                blocks = list(memoryCard.records(perSave))
+            else:
+                blocks = [block.summary() for block in memoryCard._blocks[1:]]
+            return (cardPath, memoryCard.format, blocks, None)
+
+    except Exception as e:
+        return (cardPath, None, None, str(e))
+
+
+def batch_process(cardPaths, worker, jobs=None):
+    '''Generator running the worker over all passed card paths in a process
+    pool, yielding results as they finish. Only a bounded number of cards are
+    queued at once so that the path iterable can be consumed lazily. The
+    worker must be picklable - e.g. a module-level function or a partial of
+    one'''
+
+    import concurrent.futures
+
+    # Determining the number of worker processes and queue length
+    jobs = jobs or os.cpu_count() or 1
+    maxQueued = jobs * BATCH_QUEUE_PER_WORKER
+    cardPaths = iter(cardPaths)
+
+    # A single job is run in this process - this also lets the profiler see
+    # the work
+    if jobs == 1:
+        for cardPath in cardPaths:
+            yield worker(cardPath)
+        return
+
+    # Phase timings recorded in the workers are passed back when enabled
+    collectStats = PhaseTimer.stats is not None
+    if collectStats:
+        worker = functools.partial(run_with_stats, worker)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = set()
+        exhausted = False
+        while True:
+
+            # Topping up the queue of submitted cards
+            while not exhausted and len(pending) < maxQueued:
+                try:
+                    cardPath = next(cardPaths)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.add(executor.submit(worker, cardPath))
+
+            # Finished when nothing is left to do
+            if not pending:
+                break
+
+            # Yielding results as they complete
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if collectStats:
+                    result, stats = future.result()
+                    merge_stats(stats)
+                    yield result
+                else:
+                    yield future.result()
+
+
+def batch(paths, listCards, jobs=None, verbose=False, outputFormat='text',
+          perSave=False):
+    '''Analyse all memory card images found in the passed paths in parallel,
+    reporting on each card as it finishes - machine readable listings are
+    streamed as records in the desired format. Returns the number of cards
+    that failed'''
+
+    # Machine readable listings
+    recordWriter = None
+    if outputFormat != 'text':
+        recordWriter = RecordWriter(sys.stdout, outputFormat)
+
+    failures = 0
+    for cardPath, cardFormat, blocks, error in batch_process(
+            iterate_card_paths(paths),
+            functools.partial(analyse_card, verbose=verbose,
+                              records=recordWriter is not None,
+                              perSave=perSave), jobs):
+
+        # Reporting failures without stopping the run
+        if error is not None:
+            print('%s: %s' % (cardPath, error), file=sys.stderr)
+            failures += 1
+            continue
+
+        # Reporting card
+        if recordWriter is not None:
+            for record in blocks:
+                recordWriter.write(record)
+        elif listCards:
+            print('\nMemory card: \'%s\' (%s format)' % (cardPath, cardFormat))
+            for block in blocks:
+                print(BLOCK_LISTING % block)
+        else:
+            print('%s: OK (%s format)' % (cardPath, cardFormat))
 
-        except Exception:
+    return failures
 
-            print('\nThe requested block to extract (\'%s\') is not valid\n'
-                  % options.extract, file=sys.stderr)
-            sys.exit(1)
 
-        # Making sure the passed block is the first block of a save, or at
-        # least a deleted block
+def extract_card(cardPath, outputDirectory=None, includeDeleted=False,
+                 verbose=False):
+    '''Extract all worker - extracts all saves from the card into the output
+    directory (by default '<card path>.saves') and returns a (cardPath, paths
+    written, error) tuple'''
+
+    # Determining the output directory - in batch mode, a directory is made
+    # per card
+    if outputDirectory is None:
+        outputDirectory = cardPath + '.saves'
+    else:
+        outputDirectory = os.path.join(outputDirectory,
+                                       os.path.basename(cardPath) + '.saves')
+
+    try:
+        with PS1Card(cardPath, memoryMap=True, verbose=verbose) as memoryCard:
+            return (cardPath, memoryCard.extract_all(outputDirectory,
+                                                     includeDeleted), None)
+
+    except Exception as e:
+        return (cardPath, None, str(e))
+
+
+def batch_extract_all(paths, outputDirectory=None, includeDeleted=False,
+                      jobs=None, verbose=False):
+    '''Extract all saves from all memory card images found in the passed
+    paths in parallel. Returns the number of cards that failed'''
+
+    failures = 0
+    for cardPath, outputPaths, error in batch_process(
+            iterate_card_paths(paths),
+            functools.partial(extract_card, outputDirectory=outputDirectory,
+                              includeDeleted=includeDeleted, verbose=verbose),
+            jobs):
+
+        # Reporting failures without stopping the run
+        if error is not None:
+            print('%s: %s' % (cardPath, error), file=sys.stderr)
+            failures += 1
+            continue
+
+        print('%s: %d saves extracted' % (cardPath, len(outputPaths)))
+
+    return failures
+
+
+def defragment_card(cardPath, dryRun=False, verbose=False):
+    '''Defragment worker - plans (and unless dryRun, applies) making the
+    saves on the card contiguous. Returns a (cardPath, plan, bytes written,
+    error) tuple'''
+
+    try:
+        if dryRun:
+            with PS1Card(cardPath, memoryMap=True,
+                         verbose=verbose) as memoryCard:
+                return (cardPath, memoryCard.defragment_plan(), 0, None)
+
+        with PS1Card(cardPath, verbose=verbose,
+                     writable=True) as memoryCard:
+            plan = memoryCard.defragment()
+            return (cardPath, plan, memoryCard.save(), None)
+
+    except Exception as e:
+        return (cardPath, None, 0, str(e))
+
+
+def defragment(paths, dryRun=False, jobs=None, verbose=False):
+    '''Defragment all memory card images found in the passed paths in
+    parallel, reporting each card's plan - with dryRun, nothing is written.
+    Returns the number of cards that failed'''
+
+    failures = 0
+    cards = movedBlocks = totalBytesMoved = totalBytesWritten = 0
+    for cardPath, plan, bytesWritten, error in batch_process(
+            iterate_card_paths(paths),
+            functools.partial(defragment_card, dryRun=dryRun,
+                              verbose=verbose), jobs):
+
+        # Reporting failures without stopping the run
+        if error is not None:
+            print('%s: %s' % (cardPath, error), file=sys.stderr)
+            failures += 1
+            continue
+
+        # Reporting the plan
+        cards += 1
+        movedBlocks += len(plan['moves'])
+        totalBytesMoved += plan['bytesMoved']
+        totalBytesWritten += bytesWritten
+        print('%s: %d blocks %s (%d bytes)%s' %
+              (cardPath, len(plan['moves']),
+               'to move' if dryRun else 'moved', plan['bytesMoved'],
+               '' if dryRun else ', %d bytes written' % bytesWritten))
+        for source, target in plan['moves']:
+            print('  Block %d -> %d' % (source, target))
+        if plan['discarded']:
+            print('  Deleted saves %s overwritten' %
+                  ('would be' if dryRun else 'were') + ' (blocks %s)' %
+                  format_numbers(plan['discarded']))
+
+    # Summary
+    print('\n%d cards, %d blocks %s (%d bytes)%s, %d failed' %
+          (cards, movedBlocks, 'to move' if dryRun else 'moved',
+           totalBytesMoved,
+           '' if dryRun else ', %d bytes written' % totalBytesWritten,
+           failures))
+
+    return failures
+
+
+def extract_icons_card(cardPath, outputDirectory, includeDeleted=False,
+                       verbose=False):
+    '''Icon worker - renders the icons of the card's saves into the output
+    directory, returning a (cardPath, icons, error) tuple (see
+    PS1Card.extract_icons)'''
+
+    try:
+        with PS1Card(cardPath, memoryMap=True, verbose=verbose) as memoryCard:
+            return (cardPath, memoryCard.extract_icons(outputDirectory,
+                                                       includeDeleted), None)
+
+    except Exception as e:
+        return (cardPath, None, str(e))
+
+
+def batch_extract_icons(paths, outputDirectory, includeDeleted=False,
+                        jobs=None, verbose=False):
+    '''Render the icons of all saves on all memory card images found in the
+    passed paths in parallel into the output directory, which doubles as a
+    cache of icons already rendered. Returns the number of cards that
+    failed'''
+
+    failures = icons = rendered = 0
+    for cardPath, cardIcons, error in batch_process(
+            iterate_card_paths(paths),
+            functools.partial(extract_icons_card,
+                              outputDirectory=outputDirectory,
+                              includeDeleted=includeDeleted, verbose=verbose),
+            jobs):
+
+        # Reporting failures without stopping the run
+        if error is not None:
+            print('%s: %s' % (cardPath, error), file=sys.stderr)
+            failures += 1
+            continue
+
+        for blockNumber, outputPath, iconRendered in cardIcons:
+            print('%s: block %d icon \'%s\'' % (cardPath, blockNumber,
+                                                outputPath))
+        icons += len(cardIcons)
+        rendered += sum(iconRendered for blockNumber, outputPath, iconRendered
+                        in cardIcons)
+
+    # Summary
+    print('\n%d icons, %d rendered (%d cached), %d cards failed' %
+          (icons, rendered, icons - rendered, failures))
+
+    return failures
+
+
+def convert_card(cardPath, outputFormat, outputDirectory=None,
+                 verbose=False):
+    '''Conversion worker - writes the card as an image in the output format
+    into the output directory (by default alongside the card, or the archive
+    it is in), named after the card with the format's extension. Existing
+    files aren't overwritten. Returns a (cardPath, output path, error) tuple,
+    the output path being None if the card is already that image'''
+
+    archivePath, memberName = split_archive_path(cardPath)
+    if outputDirectory is None:
+        outputDirectory = os.path.dirname(archivePath)
+    outputPath = os.path.join(outputDirectory, os.path.splitext(
+        os.path.basename(memberName or cardPath))[0] +
+        CONVERT_FORMATS[outputFormat])
+
+    try:
+
+        # Cards aren't converted onto themselves or other files
+        if os.path.exists(outputPath):
+            if memberName is None and os.path.samefile(cardPath, outputPath):
+                return (cardPath, None, None)
+            raise Exception('Unable to convert the memory card \'%s\' - '
+                            '\'%s\' already exists' % (cardPath, outputPath))
+
+        with PS1Card(cardPath, memoryMap=True, verbose=verbose) as memoryCard:
+            memoryCard.convert(outputFormat, outputPath)
+        return (cardPath, outputPath, None)
+
+    except Exception as e:
+        return (cardPath, None, str(e))
+
+
+def convert(paths, outputFormat, outputDirectory=None, jobs=None,
+            verbose=False):
+    '''Convert all memory card images found in the passed paths to the output
+    format in parallel (see convert_card). Returns the number of cards that
+    failed'''
+
+    failures = converted = unchanged = 0
+    for cardPath, outputPath, error in batch_process(
+            iterate_card_paths(paths),
+            functools.partial(convert_card, outputFormat=outputFormat,
+                              outputDirectory=outputDirectory,
+                              verbose=verbose), jobs):
+
+        # Reporting failures without stopping the run
+        if error is not None:
+            print('%s: %s' % (cardPath, error), file=sys.stderr)
+            failures += 1
+            continue
+
+        if outputPath is None:
+            print('%s: already %s' % (cardPath, outputFormat))
+            unchanged += 1
+        else:
+            print('%s: converted to \'%s\'' % (cardPath, outputPath))
+            converted += 1
+
+    # Summary
+    print('\n%d cards converted to %s, %d already %s, %d failed' %
+          (converted, outputFormat, unchanged, outputFormat, failures))
+
+    return failures
+
+
+def recover_card(cardPath, verbose=False):
+    '''Recovery worker - sweeps the card for recoverable saves. Files that
+    can't be parsed as memory cards are swept at every byte as raw dumps,
+    keeping headers with a valid icon display flag and assuming saves are
+    stored contiguously. Returns a (cardPath, description, candidates, error)
+    tuple'''
+
+    try:
+        with PS1Card(cardPath, memoryMap=True, verbose=verbose) as memoryCard:
+            return (cardPath, '%s format' % memoryCard.format,
+                    memoryCard.recover_saves(), None)
+
+    except Exception as e:
+        reason = str(e)
+
+    try:
+        with open_card_image(cardPath) as dump:
+            candidates = [candidate for candidate in scan_saves(dump, 1)
+                          if candidate['checks']['iconFlag']]
+            for candidate in candidates:
+                if candidate['checks']['length']:
+                    candidate['chain'] = [
+                        candidate['offset'] + position * BLOCK_SIZE
+                        for position in range(candidate['length'])]
+                    candidate['chainSource'] = 'contiguous'
+                else:
+                    candidate['chain'] = candidate['chainSource'] = None
+                candidate['confidence'] *= CHAIN_CONFIDENCE[
+                    candidate['chainSource']]
+
+        # Verbose output
+        if verbose:
+            print('\'%s\' swept as a raw dump: %s' % (cardPath, reason))
+
+        return (cardPath, 'raw dump', candidates, None)
+
+    except Exception as e:
+        return (cardPath, None, None, str(e))
+
+
+def recover(paths, jobs=None, verbose=False):
+    '''Sweep all memory card images and raw dumps found in the passed paths
+    in parallel for recoverable saves, reporting them most likely first.
+    Returns the number of files that failed'''
+
+    failures = 0
+    for cardPath, description, candidates, error in batch_process(
+            iterate_card_paths(paths),
+            functools.partial(recover_card, verbose=verbose), jobs):
+
+        # Reporting failures without stopping the run
+        if error is not None:
+            print('%s: %s' % (cardPath, error), file=sys.stderr)
+            failures += 1
+            continue
+
+        print('\n%s (%s): %d recoverable saves' %
+              (cardPath, description, len(candidates)))
+        for candidate in sorted(candidates, key=lambda candidate:
+                                -candidate['confidence']):
+
+            # Saves on cards are located by block, in raw dumps by offset
+            if 'blockNumber' in candidate:
+                location = 'Block %d' % candidate['blockNumber']
+                state = candidate['state'] + ', '
+                chain = candidate['chain'] and format_numbers(
+                    candidate['chain'])
+            else:
+                location = 'Offset %d' % candidate['offset']
+                state = ''
+                chain = candidate['chain'] and '%d-%d' % (
+                    candidate['offset'],
+                    candidate['offset'] + candidate['length'] * BLOCK_SIZE - 1)
+            print('  %s: \'%s\' (%s%d blocks, %s) - %d%% confidence%s' %
+                  (location, candidate['title'], state, candidate['length'],
+                   ('%s chain %s' % (candidate['chainSource'], chain) if chain
+                    else 'chain lost'),
+                   candidate['confidence'] * 100,
+                   ''.join(', failed %s check' % check for check, passed in
+                           sorted(candidate['checks'].items())
+                           if not passed)))
+
+    return failures
+
+
+def check_card_image(image):
+    '''Checks the passed memory card image (the whole file) for corruption.
+    The raw image is checked rather than a parsed PS1Card, so that cards that
+    can't be loaded are classified too. Returns the format name (None if it
+    is unknown), a list of problems found as dictionaries with the 'problem'
+    class (see FSCK_PROBLEMS), 'blockNumber' concerned (None for the whole
+    image), 'description' and whether it is 'repairable', and the (offset,
+    data) writes to the image that repair the repairable problems'''
+
+    problems = []
+
+    def report(problem, blockNumber, description):
+        problems.append({'problem': problem, 'blockNumber': blockNumber,
+                         'description': description, 'repairable': False})
+
+    image = memoryview(image)
+
+    # Determining the format - anything else can't be checked
+    header = image[:FORMAT_PROBE_SIZE].tobytes()
+    cardFormat = detect_format(header, len(image))
+    if cardFormat is None:
+        report('bad-magic', None, 'not a known memory card image format')
+        return (None, problems, [])
+    if cardFormat['singleSave']:
+        report('bad-magic', None, 'a single save (%s format) rather than a '
+               'memory card image' % cardFormat['name'])
+        return (cardFormat['name'], problems, [])
+
+    # Images too small to hold a memory card can't be checked further
+    dataOffset = cardFormat['dataOffset']
+    if callable(dataOffset):
+        dataOffset = dataOffset(header)
+    correctSize = cardFormat['imageSize']
+    if correctSize is not None and len(image) != correctSize:
+        report('wrong-size', None, '%dB rather than %dB' %
+               (len(image), correctSize))
+    elif dataOffset + IMAGE_SIZE > len(image):
+        report('wrong-size', None, 'too small (%dB) to contain a memory card'
+               % len(image))
+    if dataOffset + IMAGE_SIZE > len(image):
+        return (cardFormat['name'], problems, [])
+
+    # Validating block 0 - without its header, nothing else can be trusted
+    data = image[dataOffset:dataOffset + IMAGE_SIZE]
+    controlBlock = data[:BLOCK_SIZE]
+    if controlBlock[:len(BLOCK_0_MAGIC)] != BLOCK_0_MAGIC:
+        report('bad-magic', 0, 'the control block (block 0) header is '
+               'invalid')
+        return (cardFormat['name'], problems, [])
+    frames = [controlBlock[frameNumber * FRAME_SIZE:
+                           (frameNumber + 1) * FRAME_SIZE]
+              for frameNumber in range(CHECKSUMMED_FRAMES)]
+
+    # Status bytes - unknown statuses are treated as unusable blocks
+    blockStatuses = [None]
+    invalidBlocks = set()
+    for blockNumber in range(1, 16):
+        blockStatus = frames[blockNumber][0]
+        if blockStatus not in BLOCK_STATUS:
+            report('invalid-status', blockNumber, 'status 0x%02X is unknown'
+                   % blockStatus)
+            invalidBlocks.add(blockNumber)
+            blockStatus = 0xFF
+        blockStatuses.append(blockStatus)
+
+    # Links, as block numbers
+    links = [None]
+    for blockNumber in range(1, 16):
+        link = int.from_bytes(frames[blockNumber][8:10], 'little')
+        if (blockStatuses[blockNumber] in (0xA0, 0xFF) or
+                link == LINK_NONE):
+            links.append(None)
+        else:
+            links.append(link + 1)
+
+    # Control block frames failing their checksum
+    checksums = calculate_frame_checksums(controlBlock)
+    invalidFrames = [frameNumber for frameNumber in range(CHECKSUMMED_FRAMES)
+                     if checksums[frameNumber] !=
+                     frames[frameNumber][FRAME_SIZE - 1]]
+
+    # Regions of saves, including deleted ones
+    for blockNumber in range(1, 16):
+        if blockStatuses[blockNumber] in (0x51, 0xA1):
+            countryCode = frames[blockNumber][10:12].tobytes().decode(
+                'ascii', 'replace')
+            if countryCode not in COUNTRY_CODE:
+                report('invalid-region', blockNumber, 'country code \'%s\' is '
+                       'unknown' % countryCode)
+
+    # Following the chains of saves. Checksums of frames that saves only
+    # hold together without aren't safe to repair, as that makes the links
+    # in them count
+    chains = {}
+    claimedBlocks = set()
+    unsafeFrames = set()
+    for blockNumber in range(1, 16):
+        if blockStatuses[blockNumber] != 0x51:
+            continue
+        chain, problem = follow_chain(blockStatuses.__getitem__,
+                                      links.__getitem__, blockNumber,
+                                      invalidFrames)
+        claimedBlocks.update(chain)
+        if problem is not None:
+            report('broken-chain', blockNumber, problem)
+            unsafeFrames.update(chain)
+        else:
+            chains[blockNumber] = chain
+            if chain != follow_chain(blockStatuses.__getitem__,
+                                     links.__getitem__, blockNumber)[0]:
+                unsafeFrames.update(chain)
+
+    # Middle and last blocks no save uses, and save headers in blocks the
+    # directory describes as used, but not as the start of a save. Headers
+    # left in free blocks are normal - deleting, importing and defragmenting
+    # leave them behind, and recover finds them
+    orphanBlocks = [blockNumber for blockNumber in range(1, 16)
+                    if blockStatuses[blockNumber] in (0x52, 0x53) and
+                    blockNumber not in claimedBlocks]
+    for blockNumber in orphanBlocks:
+        report('orphan-block', blockNumber, 'marked as %s, but no save uses '
+               'it' % BLOCK_STATUS[blockStatuses[blockNumber]].lower())
+    for candidate in scan_saves(data[BLOCK_SIZE:], BLOCK_SIZE):
+        blockNumber = candidate['offset'] // BLOCK_SIZE + 1
+        if (candidate['checks']['iconFlag'] and
+                blockStatuses[blockNumber] in (0x52, 0x53, 0xFF) and
+                blockNumber not in claimedBlocks | invalidBlocks):
+            report('orphan-block', blockNumber, 'holds the header of the save '
+                   '\'%s\', but is marked as %s' % (
+                       candidate['title'],
+                       BLOCK_STATUS[blockStatuses[blockNumber]].lower()))
+
+    # Save lengths disagreeing with complete chains are rewritten, unless
+    # blocks are orphaned - they may be the rest of the save. Frames failing
+    # their checksum are only rewritten if that makes the checksum valid,
+    # i.e. the length was what was corrupted
+    repairs = {}
+    for blockNumber, chain in chains.items():
+        saveLength = int.from_bytes(frames[blockNumber][4:8], 'little')
+        if saveLength == len(chain) * BLOCK_SIZE:
+            continue
+        report('length-mismatch', blockNumber, 'the save length is %dB, but '
+               '%d blocks are linked' % (saveLength, len(chain)))
+        complete = (blockStatuses[chain[-1]] == 0x53 if len(chain) > 1 else
+                    links[blockNumber] is None)
+        if complete and not orphanBlocks and blockNumber not in unsafeFrames:
+            frame = bytearray(frames[blockNumber])
+            frame[4:8] = (len(chain) * BLOCK_SIZE).to_bytes(4, 'little')
+            if (blockNumber not in invalidFrames or
+                    calculate_frame_checksums(frame, 1)[0] ==
+                    frame[FRAME_SIZE - 1]):
+                repairs[blockNumber] = frame
+                problems[-1]['repairable'] = True
+
+    # Checksums of frames are recalculated, unless the frames have other
+    # problems - that would only make them look valid
+    for problem in problems:
+        unsafeFrames.add(problem['blockNumber'])
+    for frameNumber in invalidFrames:
+        if frameNumber == 0:
+            description = 'the control block header frame'
+        elif frameNumber <= 15:
+            description = 'the directory frame'
+        else:
+            description = 'broken sector list frame %d' % frameNumber
+        report('checksum-mismatch', frameNumber if frameNumber <= 15 else 0,
+               '%s has checksum %d, but %d is calculated' %
+               (description, frames[frameNumber][FRAME_SIZE - 1],
+                checksums[frameNumber]))
+        if (frameNumber > 15 or frameNumber not in unsafeFrames or
+                frameNumber in repairs):
+            repairs.setdefault(frameNumber, bytearray(frames[frameNumber]))
+            problems[-1]['repairable'] = True
+
+    # Repaired frames have their checksums recalculated
+    writes = []
+    for frameNumber, frame in sorted(repairs.items()):
+        frame[FRAME_SIZE - 1] = calculate_frame_checksums(frame, 1)[0]
+        writes.append((dataOffset + frameNumber * FRAME_SIZE, bytes(frame)))
+
+    problems.sort(key=lambda problem: (FSCK_PROBLEMS.index(
+        problem['problem']), problem['blockNumber'] or 0))
+    return (cardFormat['name'], problems, writes)
+
+
+def fsck_card(cardPath, repair=False, verbose=False):
+    '''fsck worker - checks the card for corruption, and if desired repairs
+    the safely repairable problems found. Returns a (cardPath, format,
+    problems, error) tuple, problems noting whether they were 'repaired'.
+    Cards in archives aren't repaired'''
+
+    try:
+        archived = split_archive_path(cardPath)[1] is not None
+
+        # Completing any interrupted edit before checking
+        if repair and not archived and replay_journal(cardPath):
+            print('Warning: An interrupted write to the memory card \'%s\' '
+                  'has been completed' % cardPath, file=sys.stderr)
+
+        with open_card_image(cardPath) as image:
+            cardFormat, problems, writes = check_card_image(image)
+
+        # Repairing
+        repaired = repair and not archived and bool(writes)
+        if repaired:
+            if verbose:
+                print('Repairing %d control block frames of \'%s\'...' %
+                      (len(writes), cardPath))
+            write_journaled(cardPath, writes)
+        for problem in problems:
+            problem['repaired'] = repaired and problem['repairable']
+        return (cardPath, cardFormat, problems, None)
+
+    except Exception as e:
+        return (cardPath, None, None, str(e))
+
+
+def fsck(paths, repair=False, jobs=None, verbose=False, outputFormat='text'):
+    '''Checks all memory card images found in the passed paths for corruption
+    in parallel, reporting the problems of each card (all cards when verbose)
+    as text or JSON Lines, followed by a summary. Returns the exit code - see
+    FSCK_EXIT_REPAIRED etc'''
+
+    import json
+
+    summary = {'cards': 0, 'clean': 0, 'problems': 0, 'repaired': 0,
+               'failed': 0, 'classes': {problem: {'found': 0, 'repaired': 0}
+                                        for problem in FSCK_PROBLEMS}}
+    for cardPath, cardFormat, problems, error in batch_process(
+            iterate_card_paths(paths),
+            functools.partial(fsck_card, repair=repair, verbose=verbose),
+            jobs):
+        summary['cards'] += 1
+
+        # Reporting failures to even read the card without stopping the run
+        if error is not None:
+            summary['failed'] += 1
+            if outputFormat == 'jsonl':
+                print(json.dumps({'path': cardPath, 'error': error},
+                                 ensure_ascii=False))
+            else:
+                print('%s: %s' % (cardPath, error), file=sys.stderr)
+            continue
+
+        # Counting problems
+        unrepaired = 0
+        for problem in problems:
+            problemCounts = summary['classes'][problem['problem']]
+            problemCounts['found'] += 1
+            problemCounts['repaired'] += problem['repaired']
+            unrepaired += not problem['repaired']
+        if not problems:
+            summary['clean'] += 1
+        elif unrepaired:
+            summary['problems'] += 1
+        else:
+            summary['repaired'] += 1
+
+        # Reporting card
+        if outputFormat == 'jsonl':
+            print(json.dumps({'path': cardPath, 'format': cardFormat,
+                              'problems': problems}, ensure_ascii=False))
+        elif problems or verbose:
+            print('%s: %s (%s format)' % (
+                cardPath, '%d problems' % len(problems) if problems else
+                'clean', cardFormat or 'unknown'))
+            for problem in problems:
+                print('  %s%s: %s%s' % (
+                    problem['problem'],
+                    '' if problem['blockNumber'] is None else
+                    ', block %d' % problem['blockNumber'],
+                    problem['description'],
+                    ' - repaired' if problem['repaired'] else
+                    ' - repairable' if problem['repairable'] else ''))
+
+    # Reporting the summary
+    if outputFormat == 'jsonl':
+        print(json.dumps({'summary': summary}))
+    else:
+        print('\n%(cards)d cards checked: %(clean)d clean, %(problems)d with '
+              'problems, %(repaired)d repaired, %(failed)d failed' % summary)
+        for problem in FSCK_PROBLEMS:
+            problemCounts = summary['classes'][problem]
+            if problemCounts['found']:
+                print('  %-18s %d found, %d repaired' %
+                      (problem, problemCounts['found'],
+                       problemCounts['repaired']))
+
+    # Exit code as fsck(8), treating unreadable cards as operational errors
+    return ((summary['failed'] and FSCK_EXIT_ERROR) |
+            (summary['problems'] and FSCK_EXIT_UNREPAIRED) |
+            (summary['repaired'] and FSCK_EXIT_REPAIRED))
+
+
+class CardCache(object):
+    '''Least recently used cache of parsed memory cards, keyed by path,
+    modification time and size and bounded by the total size of the cached
+    images. Concurrent requests for a card that is being parsed share the one
+    parse'''
+
+    def __init__(self, budget, verbose=False):
+
+        import collections
+
+        # Initialising variables
+        self.budget = budget  # In bytes
+        self.verbose = verbose
+        self.size = 0
+        self._cards = collections.OrderedDict()
+        self._parsing = {}  # Futures of cards being parsed
+
+    async def get(self, cardPath):
+        '''Returns the parsed PS1Card for the path, parsing it in a worker
+        thread if it isn't cached or has changed'''
+
+        import asyncio
+
+        # Keying on the current state of the file
+        cardPath = os.path.abspath(cardPath)
+        try:
+            cardStat = card_file_stat(cardPath)
+        except OSError:
+            raise Exception('The passed memory card \'%s\' does not exist' %
+                            cardPath)
+        key = (cardPath, cardStat.st_mtime_ns, cardStat.st_size)
+
+        # Cached - marking as most recently used
+        if key in self._cards:
+            self._cards.move_to_end(key)
+            return self._cards[key]
+
+        # Already being parsed - waiting for that parse
+        if key in self._parsing:
+            return await asyncio.shield(self._parsing[key])
+
+        # Parsing in a worker thread so that other requests are served
+        future = asyncio.get_running_loop().run_in_executor(None,
+            lambda: PS1Card(cardPath, verbose=self.verbose))
+        self._parsing[key] = future
+        try:
+            memoryCard = await future
+        finally:
+            del self._parsing[key]
+
+        self.add(key, memoryCard)
+        return memoryCard
+
+    def add(self, key, memoryCard):
+        '''Caches the card, dropping outdated versions of it and evicting
+        the least recently used cards to stay within the budget'''
+
+        # Dropping outdated versions of the card
+        for cachedKey in [cachedKey for cachedKey in self._cards
+                          if cachedKey[0] == key[0]]:
+            self.remove(cachedKey)
+
+        self._cards[key] = memoryCard
+        self.size += len(memoryCard.image)
+
+        # Evicting - the card just added is always kept
+        while self.size > self.budget and len(self._cards) > 1:
+            self.remove(next(iter(self._cards)))
+
+    def remove(self, key):
+        '''Drops the card from the cache. It isn't closed, as requests being
+        answered in worker threads may still be using it - cards aren't
+        memory mapped, so the image is freed once the last of them is done'''
+
+        memoryCard = self._cards.pop(key)
+        self.size -= len(memoryCard.image)
+
+
+async def handle_request(cardCache, request):
+    '''Answers one analysis daemon request - a dictionary with a 'command'
+    of list, extract or validate and the card's 'path'. list takes an
+    optional 'perSave', and extract an 'output' path plus an optional 'block'
+    (extracting all saves, optionally 'deleted' ones, when missing)'''
+
+    import asyncio
+
+    command = request.get('command')
+    if command not in ('list', 'extract', 'validate'):
+        raise Exception('Unknown command \'%s\'' % command)
+    if not request.get('path'):
+        raise Exception('No memory card path passed')
+    memoryCard = await cardCache.get(request['path'])
+
+    if command == 'list':
+        return {'records': list(memoryCard.records(
+            bool(request.get('perSave'))))}
+
+    elif command == 'validate':
+        return {'format': memoryCard.format,
+                'invalidFrames': memoryCard.invalid_frames(),
+                'brokenSaves': [{'blockNumber': blockNumber,
+                                 'chain': memoryCard.save_chain(blockNumber),
+                                 'problem': problem}
+                                for blockNumber, problem in sorted(
+                                    memoryCard.chain_problems().items())]}
+
+    # Extracting - output is required, as the daemon's working directory is
+    # no use to the client
+    if not request.get('output'):
+        raise Exception('No output path passed')
+    outputPath = os.path.abspath(request['output'])
+    blockNumber = request.get('block')
+    loop = asyncio.get_running_loop()
+    if blockNumber is None:
+        outputPaths = await loop.run_in_executor(None, memoryCard.extract_all,
+                                    outputPath, bool(request.get('deleted')))
+    else:
+        block = memoryCard[blockNumber]
         if (block.blockStatus != 'First block' and
             block.blockStatus != 'Deleted block'):
-            print('\nThe requested block to extract (\'%s\') is neither the '
-                  'first block of a save or a deleted block - status: \'%s\'n'
-                  % (options.extract, block.blockStatus), file=sys.stderr)
-            sys.exit(1)
+            raise Exception('The requested block to extract (\'%s\') is '
+                            'neither the first block of a save or a deleted '
+                            'block - status: \'%s\'' %
+                            (blockNumber, block.blockStatus))
+        await loop.run_in_executor(None, memoryCard.extract, blockNumber,
+                                   outputPath)
+        outputPaths = [outputPath]
+    return {'paths': outputPaths}
+
+
+def serve(address, cacheSize=DEFAULT_CACHE_SIZE, verbose=False):
+    '''Runs the analysis daemon on a Unix socket, or on TCP when the address
+    is 'host:port'. Requests and responses are JSON objects, one per line -
+    responses have 'ok' set and either the result or an 'error'. Parsed cards
+    are kept in a cache of cacheSize MiB'''
+
+    import asyncio
+    import json
+    import stat
+
+    cardCache = CardCache(cacheSize * 1024 * 1024, verbose)
+
+    async def handle_connection(reader, writer):
+        '''Answers requests from a client until it disconnects'''
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                # Errors are reported to the client rather than ending the
+                # connection
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise Exception('Requests must be JSON objects')
+                    response = await handle_request(cardCache, request)
+                    response['ok'] = True
+                except Exception as e:
+                    response = {'ok': False, 'error': str(e)}
+
+                writer.write(json.dumps(response, ensure_ascii=False).encode(
+                    'utf8') + b'\n')
+                await writer.drain()
+
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def run():
+        '''Starts the server and serves forever'''
+
+        # Determining whether to listen on TCP or a Unix socket
+        host, separator, port = address.rpartition(':')
+        if separator and port.isdigit() and os.sep not in address:
+            server = await asyncio.start_server(handle_connection,
+                                                host or 'localhost', int(port))
+        else:
+
+            # Replacing the socket left by a previous run - anything else
+            # there is not the daemon's to delete
+            try:
+                addressMode = os.lstat(address).st_mode
+            except FileNotFoundError:
+                addressMode = None
+            if addressMode is not None:
+                if not stat.S_ISSOCK(addressMode):
+                    raise Exception('Unable to serve on \'%s\' - it already '
+                                    'exists and is not a socket' % address)
+                os.unlink(address)
+            server = await asyncio.start_unix_server(handle_connection, address)
+
+        # Verbose output
+        if verbose:
+            print('Serving on \'%s\'...' % address)
+
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+def open_index(databasePath):
+    '''Opens the card index database, creating it if needed'''
+
+    import sqlite3
+
+    connection = sqlite3.connect(databasePath)
+
+    # The index is a cache, so durability is traded for speed
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('PRAGMA synchronous = NORMAL')
+
+    # Making sure the schema is current
+    schemaVersion = connection.execute('PRAGMA user_version').fetchone()[0]
+    if schemaVersion not in (0, INDEX_SCHEMA_VERSION):
+        connection.close()
+        raise Exception('The card index \'%s\' was created by a different '
+                        'version of this program (schema %d rather than %d) - '
+                        'please delete it and reindex' %
+                        (databasePath, schemaVersion, INDEX_SCHEMA_VERSION))
+    connection.executescript(INDEX_SCHEMA)
+    connection.execute('PRAGMA user_version = %d' % INDEX_SCHEMA_VERSION)
+    return connection
+
+
+def index_card(cardPath, verbose=False):
+    '''Index worker - returns a (cardPath, size, mtime, hash, format, block
+    records, error) tuple for the card. Block records include the chain of
+    blocks of each save that starts in the block'''
+
+    import hashlib
+
+    # Recording the file's details before reading it, so that a change
+    # while indexing is picked up next time - cards in archives are recorded
+    # with the archive's
+    try:
+        cardStat = card_file_stat(cardPath)
+    except OSError as e:
+        return (cardPath, None, None, None, None, None, str(e))
+
+    try:
+        with PS1Card(cardPath, memoryMap=True, verbose=verbose) as memoryCard:
+            cardHash = hashlib.sha1(memoryCard.image).hexdigest()
+            records = []
+            for record in memoryCard.records():
+                if record['chain'] is not None:
+                    record['chain'] = ','.join(str(blockNumber) for blockNumber
+                                               in record['chain'])
+
+                # Titles are also indexed with full-width characters as ASCII
+                # so that they can be searched for as typed
+                record['normalisedTitle'] = (record['title'] and decode_title(
+                    memoryCard.block_data(record['blockNumber'])[4:68],
+                    normalise=True))
+                records.append(record)
+            return (cardPath, cardStat.st_size, cardStat.st_mtime_ns, cardHash,
+                    memoryCard.format, records, None)
+
+    except Exception as e:
+
+        # Invalid cards are still recorded so that they aren't reparsed until
+        # they change
+        return (cardPath, cardStat.st_size, cardStat.st_mtime_ns, None, None,
+                None, str(e))
+
+
+def index(paths, databasePath, jobs=None, verbose=False):
+    '''Records the directories of all memory card images found in the passed
+    paths in the card index database. Only new or modified cards are parsed,
+    and cards that no longer exist are removed. Returns the number of cards
+    that failed'''
+
+    connection = open_index(databasePath)
+
+    # Fetching what is already indexed to determine what has changed
+    indexed = {path: (size, mtime) for path, size, mtime in
+               connection.execute('SELECT path, size, mtime FROM cards')}
+
+    def changed_cards():
+        '''Generator of card paths that are new or modified since indexing'''
+
+        for cardPath in iterate_card_paths(paths):
+            cardPath = os.path.abspath(cardPath)
+            try:
+                cardStat = card_file_stat(cardPath)
+            except OSError:
+                cardStat = None
+            if (cardStat is None or indexed.get(cardPath) !=
+                    (cardStat.st_size, cardStat.st_mtime_ns)):
+                yield cardPath
+            else:
+                counts['unchanged'] += 1
+
+    # Indexing changed cards
+    counts = {'indexed': 0, 'unchanged': 0, 'failed': 0, 'removed': 0}
+    for (cardPath, size, mtime, cardHash, cardFormat, records,
+         error) in batch_process(changed_cards(),
+                    functools.partial(index_card, verbose=verbose), jobs):
+
+        # Files that can't even be read aren't recorded
+        if error is not None:
+            print('%s: %s' % (cardPath, error), file=sys.stderr)
+            counts['failed'] += 1
+            if size is None:
+                continue
+
+        # Replacing the card's previous record
+        row = connection.execute('SELECT cardId FROM cards WHERE path = ?',
+                                 (cardPath,)).fetchone()
+        if row:
+            cardId = row[0]
+            connection.execute('UPDATE cards SET size = ?, mtime = ?, hash = ?,'
+                               ' format = ?, error = ? WHERE cardId = ?',
+                               (size, mtime, cardHash, cardFormat, error,
+                                cardId))
+            connection.execute('DELETE FROM blocks WHERE cardId = ?',
+                               (cardId,))
+        else:
+            cardId = connection.execute('INSERT INTO cards (path, size, mtime,'
+                                        ' hash, format, error) VALUES (?, ?, '
+                                        '?, ?, ?, ?)', (cardPath, size, mtime,
+                                        cardHash, cardFormat, error)).lastrowid
+        if records:
+            connection.executemany('INSERT INTO blocks VALUES (:cardId, '
+                ':blockNumber, :statusByte, :saveLength, :nextBlock, :chain, '
+                ':countryCode, :productCode, :gamePlayThroughIdentifier, '
+                ':title, :normalisedTitle)',
+                [dict(record, cardId=cardId) for record in records])
+
+        # Committing regularly so that an interrupted run keeps its progress
+        if error is None:
+            counts['indexed'] += 1
+        if (counts['indexed'] + counts['failed']) % INDEX_COMMIT_INTERVAL == 0:
+            connection.commit()
+
+    # Removing cards that no longer exist
+    for cardPath in indexed:
+        if not card_exists(cardPath):
+            connection.execute('DELETE FROM blocks WHERE cardId = (SELECT '
+                               'cardId FROM cards WHERE path = ?)',
+                               (cardPath,))
+            connection.execute('DELETE FROM cards WHERE path = ?', (cardPath,))
+            counts['removed'] += 1
+
+    connection.commit()
+    connection.close()
+
+    # Reporting
+    print('Indexed %(indexed)d new or modified cards, %(unchanged)d unchanged, '
+          '%(failed)d failed, %(removed)d removed' % counts)
+    return counts['failed']
+
+
+def report_stats(outputFormat):
+    '''Prints the phase timings recorded on stderr'''
+
+    print(format_stats(PhaseTimer.stats, outputFormat), file=sys.stderr)
+
+
+def report_profile(profiler, outputPath):
+    '''Stops the profiler, saving its statistics to the output path and
+    printing the most expensive calls on stderr'''
+
+    import pstats
+
+    profiler.disable()
+    profiler.dump_stats(outputPath)
+    pstats.Stats(profiler, stream=sys.stderr).sort_stats(
+        'cumulative').print_stats(20)
+
+
+def query_filters(productCode=None, countryCode=None, title=None,
+                  status=None, saveLength=None):
+    '''Returns the filters of a query, normalised for matching - the product
+    code is a glob pattern (product codes are upper case, so it is made upper
+    case too), the country code is a code or a
+    region name (see COUNTRY_CODE), the title is a substring matched against
+    titles with full-width characters as ASCII, ignoring case, and the status
+    is a status byte, a status name with or without ' block', or the start
+    of one ('deleted', 'unus')'''
+
+    import unicodedata
+
+    filters = {}
+    if productCode is not None:
+        filters['productCode'] = productCode.upper()
+    if countryCode is not None:
+        filters['countryCodes'] = sorted(
+            code for code, region in COUNTRY_CODE.items()
+            if countryCode.upper() in (code.upper(), region.upper())) or [
+                countryCode]
+    if title is not None:
+        filters['title'] = unicodedata.normalize('NFKC', title).casefold()
+    if status is not None:
+        try:
+            filters['statusByte'] = int(status, 0)
+        except ValueError:
+            statusBytes = [statusByte for statusByte, statusName in
+                           BLOCK_STATUS.items()
+                           if statusName.lower() in (status.lower(),
+                                                     status.lower() +
+                                                     ' block')]
+            statusBytes = statusBytes or [
+                statusByte for statusByte, statusName in BLOCK_STATUS.items()
+                if statusName.lower().startswith(status.lower())]
+            if len(statusBytes) != 1:
+                raise Exception('The status \'%s\' is not a known block '
+                                'status - expected one of: %s' %
+                                (status, ', '.join(
+                                    sorted(BLOCK_STATUS.values()))))
+            filters['statusByte'] = statusBytes[0]
+    if saveLength is not None:
+        filters['saveLength'] = saveLength
+    return filters
+
+
+def record_matches(record, filters):
+    '''Returns whether the passed block record (including its
+    normalisedTitle) matches all the query filters'''
+
+    import fnmatch
+
+    if ('productCode' in filters and not fnmatch.fnmatchcase(
+            record['productCode'] or '', filters['productCode'])):
+        return False
+    if ('countryCodes' in filters and
+            record['countryCode'] not in filters['countryCodes']):
+        return False
+    if ('title' in filters and filters['title'] not in
+            (record['normalisedTitle'] or '').casefold()):
+        return False
+    if ('statusByte' in filters and
+            record['statusByte'] != filters['statusByte']):
+        return False
+    if ('saveLength' in filters and
+            record['saveLength'] != filters['saveLength']):
+        return False
+    return True
+
+
+def indexed_card_paths(databasePath, cardPaths):
+    '''Returns the set of the passed (absolute) card paths that are in the
+    card index as they are now - unchanged since they were indexed'''
+
+    connection = open_index(databasePath)
+    try:
+        indexed = {path: (size, mtime) for path, size, mtime in
+                   connection.execute('SELECT path, size, mtime FROM cards')}
+    finally:
+        connection.close()
+
+    indexedPaths = set()
+    for cardPath in cardPaths:
+        if cardPath not in indexed:
+            continue
+        try:
+            cardStat = card_file_stat(cardPath)
+        except OSError:
+            continue
+        if indexed[cardPath] == (cardStat.st_size, cardStat.st_mtime_ns):
+            indexedPaths.add(cardPath)
+    return indexedPaths
+
+
+def query_index(databasePath, filters, cardPaths=None):
+    '''Generator of the block records in the card index matching the query
+    filters, restricted to the passed (absolute) card paths if any - the
+    secondary indexes on the blocks table make this fast however large the
+    index'''
+
+    connection = open_index(databasePath)
+
+    # Titles are matched as when scanning cards (see record_matches) rather
+    # than with LIKE, which only ignores the case of ASCII
+    connection.create_function('casefold', 1,
+                               lambda title: title.casefold(),
+                               deterministic=True)
+
+    # Building the where clause
+    conditions = ['1']
+    parameters = []
+    if cardPaths is not None:
+        connection.execute('CREATE TEMP TABLE queryPaths (path TEXT PRIMARY '
+                           'KEY)')
+        connection.executemany('INSERT OR IGNORE INTO queryPaths VALUES (?)',
+                               ((cardPath,) for cardPath in cardPaths))
+        conditions.append('path IN (SELECT path FROM queryPaths)')
+    if 'productCode' in filters:
+        conditions.append('productCode GLOB ?')
+        parameters.append(filters['productCode'])
+    if 'countryCodes' in filters:
+        conditions.append('countryCode IN (%s)' % ', '.join(
+            '?' * len(filters['countryCodes'])))
+        parameters.extend(filters['countryCodes'])
+    if 'title' in filters:
+        conditions.append('instr(casefold(coalesce(normalisedTitle, \'\')), '
+                          '?) > 0')
+        parameters.append(filters['title'])
+    if 'statusByte' in filters:
+        conditions.append('statusByte = ?')
+        parameters.append(filters['statusByte'])
+    if 'saveLength' in filters:
+        conditions.append('saveLength = ?')
+        parameters.append(filters['saveLength'])
+
+    try:
+        for (path, blockNumber, statusByte, saveLength, chain, countryCode,
+             productCode, gamePlayThroughIdentifier, title) in \
+                connection.execute('SELECT path, blockNumber, statusByte, '
+                                   'saveLength, chain, countryCode, '
+                                   'productCode, gamePlayThroughIdentifier, '
+                                   'title FROM blocks JOIN cards USING '
+                                   '(cardId) WHERE %s ORDER BY path, '
+                                   'blockNumber' % ' AND '.join(conditions),
+                                   parameters):
+            yield {'path': path, 'blockNumber': blockNumber,
+                   'statusByte': statusByte,
+                   'status': BLOCK_STATUS.get(statusByte),
+                   'saveLength': saveLength,
+                   'chain': (chain and [int(chainBlockNumber) for
+                                        chainBlockNumber in chain.split(',')]),
+                   'region': COUNTRY_CODE.get(countryCode),
+                   'countryCode': countryCode, 'productCode': productCode,
+                   'gamePlayThroughIdentifier': gamePlayThroughIdentifier,
+                   'title': title}
+    finally:
+        connection.close()
+
+
+def query_card(cardPath, filters, verbose=False):
+    '''Query worker - returns a (cardPath, matching block records, error)
+    tuple for the card'''
+
+    try:
+        with PS1Card(cardPath, memoryMap=True, verbose=verbose) as memoryCard:
+            records = []
+            for record in memoryCard.records():
+                record['normalisedTitle'] = (record['title'] and decode_title(
+                    memoryCard.block_data(record['blockNumber'])[4:68],
+                    normalise=True))
+                if record_matches(record, filters):
+                    del record['normalisedTitle']
+                    records.append(record)
+            return (cardPath, records, None)
+
+    except Exception as e:
+        return (cardPath, None, str(e))
+
+
+def query(paths, filters, databasePath=None, jobs=None, verbose=False,
+          outputFormat='text'):
+    '''Reports the blocks matching the query filters of all memory card
+    images found in the passed paths - from the card index database when it
+    exists (all indexed cards when no paths are passed), scanning the cards
+    that aren't indexed as they are now in parallel. Returns a (matches,
+    failures) tuple'''
+
+    # Machine readable output
+    recordWriter = None
+    if outputFormat != 'text':
+        recordWriter = RecordWriter(sys.stdout, outputFormat)
+
+    def report(record):
+        if recordWriter is not None:
+            recordWriter.write(record)
+        else:
+            print('%s: block %d \'%s\' %s%s (%s, %s blocks)' %
+                  (record['path'], record['blockNumber'], record['title'],
+                   record['countryCode'] or '', record['productCode'] or '',
+                   record['status'], record['saveLength']))
+
+    matches = failures = 0
+    cardPaths = iterate_card_paths(paths)
+    if databasePath and os.path.exists(databasePath):
+
+        # Verbose output
+        if verbose:
+            print('Querying the card index \'%s\'...' % databasePath)
+
+        # Only the passed cards are queried - those missing from the index or
+        # changed since are scanned instead
+        indexedPaths = None
+        if paths:
+            cardPaths = list(cardPaths)
+            indexedPaths = indexed_card_paths(
+                databasePath, [os.path.abspath(cardPath)
+                               for cardPath in cardPaths])
+            cardPaths = [cardPath for cardPath in cardPaths
+                         if os.path.abspath(cardPath) not in indexedPaths]
+        for record in query_index(databasePath, filters, indexedPaths):
+            report(record)
+            matches += 1
+        if not paths:
+            return matches, failures
+
+    # Scanning the cards
+    for cardPath, records, error in batch_process(
+            cardPaths,
+            functools.partial(query_card, filters=filters, verbose=verbose),
+            jobs):
+
+        # Reporting failures without stopping the run
+        if error is not None:
+            print('%s: %s' % (cardPath, error), file=sys.stderr)
+            failures += 1
+            continue
+
+        for record in records:
+            report(record)
+            matches += 1
+
+    return matches, failures
+
+
+class InotifyWatcher(object):
+    '''Minimal inotify binding (via ctypes, as inotify isn't in the standard
+    library) reporting the paths changed under a directory tree. Raises
+    OSError where inotify isn't available'''
+
+    def __init__(self, directory):
+
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or None,
+                                 use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'Unable to initialise inotify')
+        self._directories = {}  # Watch descriptor: directory
+        self.add_directory(directory)
+
+    def add_directory(self, directory):
+        '''Watches the directory and its subdirectories, returning the paths
+        of the files already in them'''
+
+        import ctypes
+
+        paths = []
+        for subdirectory, directoryNames, fileNames in os.walk(directory):
+            watch = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(subdirectory), INOTIFY_MASK)
+            if watch < 0:
+                raise OSError(ctypes.get_errno(), 'Unable to watch \'%s\'' %
+                              subdirectory)
+            self._directories[watch] = subdirectory
+            paths.extend(os.path.join(subdirectory, fileName)
+                         for fileName in fileNames)
+        return paths
+
+    def close(self):
+        os.close(self._fd)
+
+    def wait(self, timeout=None):
+        '''Waits up to timeout seconds (forever when None) for changes,
+        returning the set of paths changed - or None when events were lost
+        and everything must be rescanned'''
+
+        import select
+        import struct
+
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return set()
+        paths = set()
+        while True:
+            try:
+                events = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
 
-        # Determining outputPath
-        if options.output:
-            outputPath = options.output
+            # Events are a watch descriptor, mask, cookie and name length,
+            # followed by the null padded name
+            offset = 0
+            while offset < len(events):
+                watch, mask, cookie, nameLength = struct.unpack_from(
+                    'iIII', events, offset)
+                name = os.fsdecode(events[offset + 16:
+                                          offset + 16 + nameLength].rstrip(
+                                              b'\x00'))
+                offset += 16 + nameLength
+                if mask & INOTIFY_OVERFLOW:
+                    return None
+                if watch not in self._directories:
+                    continue
+                path = os.path.join(self._directories[watch], name)
+
+                # New directories are watched too - files may have been
+                # written to them before the watch was added
+                if mask & INOTIFY_ISDIR:
+                    if mask & 0x00000180 and os.path.isdir(path):
+                        paths.update(self.add_directory(path))
+                    continue
+                paths.add(path)
+        return paths
+
+
+class PollingWatcher(object):
+    '''Reports the paths changed under a directory tree by comparing the
+    size and modification time of its files at each poll'''
+
+    def __init__(self, directory, interval=WATCH_POLL_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self._stats = self._scan()
+
+    def _scan(self):
+        stats = {}
+        for directory, directoryNames, fileNames in os.walk(self.directory):
+            for fileName in fileNames:
+                path = os.path.join(directory, fileName)
+                try:
+                    fileStat = os.stat(path)
+                except OSError:
+                    continue
+                stats[path] = (fileStat.st_size, fileStat.st_mtime_ns)
+        return stats
+
+    def close(self):
+        pass
+
+    def wait(self, timeout=None):
+        '''Waits for the poll interval (or timeout, if shorter), returning the
+        set of paths created, modified or removed since the last poll'''
+
+        time.sleep(self.interval if timeout is None else
+                   min(timeout, self.interval))
+        stats = self._scan()
+        paths = set(path for path in set(stats) | set(self._stats)
+                    if stats.get(path) != self._stats.get(path))
+        self._stats = stats
+        return paths
+
+
+def card_state(cardPath, verbose=False):
+    '''Returns the state of the card watch mode compares - its file details,
+    format, block hashes and saves (first block: (file name, title, block
+    hashes))'''
+
+    cardStat = card_file_stat(cardPath)
+    with PS1Card(cardPath, memoryMap=True, verbose=verbose) as memoryCard:
+        blockHashes = memoryCard.block_hashes()
+        saves = dict((blockNumber, (memoryCard[blockNumber].filename,
+                                    memoryCard[blockNumber].title,
+                                    [blockHashes[chainBlockNumber]
+                                     for chainBlockNumber in chain]))
+                     for blockNumber, chain in
+                     memoryCard.chain_index().items()
+                     if memoryCard[blockNumber]._blockStatus == 0x51)
+        return {'stat': (cardStat.st_size, cardStat.st_mtime_ns),
+                'format': memoryCard.format, 'blockHashes': blockHashes,
+                'saves': saves}
+
+
+def diff_card_states(oldState, newState):
+    '''Returns the save changes between two card states as a list of
+    dictionaries with the save's 'blockNumber', 'filename', 'title' and
+    'change' (added, modified or removed)'''
+
+    oldSaves = oldState['saves'] if oldState else {}
+    newSaves = newState['saves'] if newState else {}
+    changes = []
+    for blockNumber in sorted(set(oldSaves) | set(newSaves)):
+        if blockNumber not in oldSaves:
+            change = 'added'
+        elif blockNumber not in newSaves:
+            change = 'removed'
+        elif oldSaves[blockNumber] != newSaves[blockNumber]:
+            change = 'modified'
         else:
-            outputPath = '%s.block_%d.bin' % (args[0], options.extract)
+            continue
+        fileName, title, hashes = newSaves.get(blockNumber,
+                                               oldSaves.get(blockNumber))
+        changes.append({'blockNumber': blockNumber,
+                        'filename': fileName.rstrip('\x00'), 'title': title,
+                        'change': change})
+    return changes
+
+
+def watch(directory, poll=False, verbose=False):
+    '''Watches the directory tree for new, modified and removed memory card
+    images, reporting the saves changed on each as JSON lines on stdout.
+    Changes are debounced so that a card being written is only parsed once
+    it is complete. Verbose output goes to stderr, so cards aren't parsed
+    verbosely'''
+
+    import json
+
+    def emit(event):
+        print(json.dumps(event, ensure_ascii=False), flush=True)
+
+    def file_details(cardPath):
+        '''The (size, mtime) of the file holding the card, or None'''
+
+        try:
+            cardStat = card_file_stat(cardPath)
+        except OSError:
+            return None
+        return (cardStat.st_size, cardStat.st_mtime_ns)
+
+    # Watching with inotify where possible
+    watcher = None
+    if not poll:
+        try:
+            watcher = InotifyWatcher(directory)
+        except OSError as e:
+            print('Warning: Unable to watch \'%s\' with inotify (%s) - '
+                  'polling instead' % (directory, e), file=sys.stderr)
+    if watcher is None:
+        watcher = PollingWatcher(directory)
+
+    # Recording the current state of all cards - the file details of cards
+    # that can't be parsed are kept, so that they are only reported on again
+    # once they change (cards in a changed archive are all checked)
+    states = {}
+    failedDetails = {}
+    for cardPath in iterate_card_paths([directory]):
+        try:
+            states[cardPath] = card_state(cardPath)
+        except Exception as e:
+            states[cardPath] = None
+            failedDetails[cardPath] = file_details(cardPath)
+            if verbose:
+                print('Unable to parse \'%s\': %s' % (cardPath, e),
+                      file=sys.stderr)
+
+    # Verbose output
+    if verbose:
+        print('Watching %d memory card images in \'%s\' (%s)...' %
+              (len(states), directory, type(watcher).__name__),
+              file=sys.stderr)
+
+    pending = {}  # Path: time of the last change seen
+    try:
+        while True:
+
+            # Waiting for changes - only until the next pending card is due
+            # when some are pending
+            now = time.monotonic()
+            timeout = (max(0, min(pending.values()) + WATCH_DEBOUNCE - now)
+                       if pending else None)
+            paths = watcher.wait(timeout)
+            now = time.monotonic()
+
+            # Events were lost - checking every card. Cards in archives are
+            # compared through their archive
+            if paths is None:
+                paths = set(split_archive_path(path)[0] for path in
+                            set(iterate_card_paths([directory])) |
+                            set(states))
+            for path in paths:
+                if path.lower().endswith(CARD_EXTENSIONS +
+                                         ARCHIVE_EXTENSIONS):
+                    pending[path] = now
+
+            # Processing cards left alone for the debounce period
+            for path in [path for path, changed in pending.items()
+                         if now - changed >= WATCH_DEBOUNCE]:
+                del pending[path]
+
+                # Archives - the cards they held and the cards they hold now.
+                # Archives still being written are retried on the next change
+                cardPaths = [path]
+                if path.lower().endswith(ARCHIVE_EXTENSIONS):
+                    cardPaths = set(cardPath for cardPath in states
+                                    if split_archive_path(cardPath)[0] == path)
+                    if os.path.isfile(path):
+                        try:
+                            cardPaths.update(archive_card_paths(path))
+                        except Exception as e:
+                            emit({'event': 'error', 'path': path,
+                                  'error': str(e)})
+                            continue
+                    cardPaths = sorted(cardPaths)
+
+                for cardPath in cardPaths:
+                    oldState = states.get(cardPath)
+
+                    # Removed cards
+                    if not card_exists(cardPath):
+                        failedDetails.pop(cardPath, None)
+                        if cardPath in states:
+                            del states[cardPath]
+                            emit({'event': 'removed', 'path': cardPath,
+                                  'saves': diff_card_states(oldState, None)})
+                        continue
+
+                    # Skipping files that haven't really changed
+                    cardDetails = file_details(cardPath)
+                    if (cardDetails is None or cardDetails ==
+                            (oldState['stat'] if oldState else
+                             failedDetails.get(cardPath))):
+                        continue
+
+                    try:
+                        newState = card_state(cardPath)
+                    except Exception as e:
+                        states[cardPath] = None
+                        failedDetails[cardPath] = cardDetails
+                        emit({'event': 'error', 'path': cardPath,
+                              'error': str(e)})
+                        continue
+                    states[cardPath] = newState
+                    failedDetails.pop(cardPath, None)
+
+                    # Reporting the saves changed - unchanged blocks mean
+                    # nothing to report
+                    if (oldState and oldState['blockHashes'] ==
+                            newState['blockHashes']):
+                        continue
+                    emit({'event': 'modified' if oldState else 'added',
+                          'path': cardPath,
+                          'format': newState['format'],
+                          'saves': diff_card_states(oldState, newState)})
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        watcher.close()
+
+
+def main(argv=None):
+    '''Command line entry point - argv defaults to the program's arguments'''
+
+    # Configuring and parsing passed options
+    parser = OptionParser(usage='%prog [options] <memory card image>\n'
+        '       %prog --batch [options] <image, archive, directory, glob or - '
+        'for stdin>...', version=('%%prog %s%s' % (VERSION, GPL_NOTICE)))
+    parser.add_option('-b', '--batch', dest='batch', help='analyse all passed '
+        'memory card images, zip and tar archives, directories, globs and '
+        'paths listed on stdin (\'-\') in parallel - corrupt cards are '
+        'reported without stopping the run. Combine with --list to list each '
+        'card', action='store_true', default=False)
+    parser.add_option('-C', '--cache-size', dest='cacheSize', type='int',
+        help='MiB of parsed memory cards the daemon keeps in memory '
+        '(default: %d)' % DEFAULT_CACHE_SIZE, metavar='size',
+        default=DEFAULT_CACHE_SIZE)
+    parser.add_option('-c', '--icons', dest='icons', help='render the icons of '
+        'all saves on the passed memory card images, archives, directories, '
+        'globs and paths listed on stdin (\'-\') as PNGs (animated where the '
+        'icon is) into the given directory, named by icon hash - icons '
+        'already there are reused. Combine with --deleted to include deleted '
+        'saves',
+        metavar='directory', default=None)
+    parser.add_option('-D', '--delete', dest='delete', type='int',
+        help='delete the save starting at the given block, writing only the '
+        'changed frames', metavar='block', default=None)
+    parser.add_option('-d', '--deleted', dest='deleted', help='include '
+        'deleted saves when extracting all saves', action='store_true',
+        default=False)
+    parser.add_option('-F', '--defragment', dest='defragment', help='make the '
+        'saves on all passed memory card images, directories, globs and paths '
+        'listed on stdin (\'-\') contiguous, moving as few blocks as '
+        'possible', action='store_true', default=False)
+    parser.add_option('-e', '--diff', dest='diff', help='compare the passed '
+        'memory card images pairwise (A B [A B]...), reporting changed blocks, '
+        'frames and saves', action='store_true', default=False)
+    parser.add_option('-f', '--format', dest='format', type='choice',
+        choices=LISTING_FORMATS, help='format used when listing - %s '
+        '(default: text). Machine readable formats imply --list' %
+        ', '.join(LISTING_FORMATS), metavar='format', default='text')
+    parser.add_option('-I', '--import', dest='importSave', help='import the '
+        'given single save (MCS format) into free blocks of the memory card '
+        'image', metavar='save', default=None)
+    parser.add_option('-i', '--index', dest='index', help='record the '
+        'directories of all passed memory card images, archives, directories, '
+        'globs and paths listed on stdin (\'-\') in the given SQLite '
+        'database - only new or modified cards are parsed',
+        metavar='database', default=None)
+    parser.add_option('-j', '--jobs', dest='jobs', type='int', help='number of '
+        'worker processes used in batch mode (default: number of CPUs)',
+        metavar='jobs', default=None)
+    parser.add_option('-K', '--fsck', dest='fsck', help='check all passed '
+        'memory card images, archives, directories, globs and paths listed on '
+        'stdin (\'-\') for corruption in parallel, reporting the problems '
+        'found by class and a summary (text or jsonl --format). Exits like '
+        'fsck - 0 when clean, adding 1 if problems were repaired, 4 if '
+        'problems remain and 8 if cards couldn\'t be read',
+        action='store_true', default=False)
+    parser.add_option('-k', '--status', dest='status', help='only query '
+        'blocks with the given status - a status byte (0x51) or the start of '
+        'a status name (\'deleted\')', metavar='status', default=None)
+    parser.add_option('-L', '--save-length', dest='saveLength', type='int',
+        help='only query saves of the given length in blocks',
+        metavar='blocks', default=None)
+    parser.add_option('-l', '--list', dest='list', help='list contents of '
+        'memory card image', metavar='list', action='store_true',
+        default=False)
+    parser.add_option('-m', '--mmap', dest='mmap', help='memory map the memory '
+        'card image rather than reading it into memory (batch mode always '
+        'does this)', action='store_true', default=False)
+    parser.add_option('-n', '--dry-run', dest='dryRun', help='only report '
+        'what --defragment would move', action='store_true', default=False)
+    parser.add_option('-J', '--stats-json', dest='stats', help='like --stats, '
+        'as a JSON object', action='store_const', const='json', default=None)
+    parser.add_option('-o', '--output', dest='output', help='path to output '
+        'file (or directory when extracting all saves or converting)',
+        metavar='output', default=None)
+    parser.add_option('-p', '--product-code', dest='productCode', help='only '
+        'query saves whose product code matches the given pattern '
+        '(\'SLUS-0089*\')', metavar='pattern', default=None)
+    parser.add_option('-P', '--profile', dest='profile', help='profile the '
+        'run with cProfile, saving the statistics to the given file and '
+        'summarising them on stderr - batch work is run in a single process',
+        metavar='file', default=None)
+    parser.add_option('-q', '--query', dest='query', help='report the blocks '
+        'of the passed memory card images, archives, directories, globs and '
+        'paths listed on stdin (\'-\') matching the --product-code, --country, '
+        '--title, --status and --save-length filters. When --index names an '
+        'existing card index, it is queried for the cards indexed as they '
+        'are now (all indexed cards when none are passed), and only the rest '
+        'are read. Exits with 1 when nothing matches, like grep',
+        action='store_true', default=False)
+    parser.add_option('-R', '--repair', dest='repair', help='repair control '
+        'block frames with wrong checksums that can be safely repaired - with '
+        '--fsck, repair all the problems found that can be safely repaired',
+        action='store_true', default=False)
+    parser.add_option('-r', '--recover', dest='recover', help='sweep all '
+        'passed memory card images and raw dumps, directories, globs and '
+        'paths listed on stdin (\'-\') for deleted, orphaned and broken saves, '
+        'reporting how confidently each can be recovered',
+        action='store_true', default=False)
+    parser.add_option('-S', '--serve', dest='serve', help='run a daemon '
+        'answering list, extract and validate requests (JSON objects, one per '
+        'line) on the given Unix socket, or TCP \'host:port\'',
+        metavar='address', default=None)
+    parser.add_option('-s', '--per-save', dest='perSave', help='only list '
+        'the first blocks of saves in machine readable listings',
+        action='store_true', default=False)
+    parser.add_option('-t', '--title', dest='title', help='only query saves '
+        'whose title contains the given text - full-width characters match '
+        'their ASCII equivalents and case is ignored', metavar='text',
+        default=None)
+    parser.add_option('-T', '--stats', dest='stats', help='report the wall '
+        'time and bytes processed by each phase (loading, format detection, '
+        'directory parsing, checksums, title decoding and extraction) on '
+        'stderr when finished, across all cards', action='store_const',
+        const='table', default=None)
+    parser.add_option('-X', '--convert-to', dest='convertTo', type='choice',
+        choices=sorted(CONVERT_FORMATS), help='convert all passed memory '
+        'card images, archives, directories, globs and paths listed on stdin '
+        '(\'-\') to the given format (%s) in parallel, writing the images '
+        'alongside them or into --output - only the new header is generated, '
+        'the card data is copied in the kernel' %
+        ', '.join(sorted(CONVERT_FORMATS)), metavar='format', default=None)
+    parser.add_option('-y', '--country', dest='country', help='only query '
+        'saves with the given country code or region (\'BA\', \'America\')',
+        metavar='country', default=None)
+    parser.add_option('-u', '--undelete', dest='undelete', type='int',
+        help='restore the deleted save starting at the given block',
+        metavar='block', default=None)
+    parser.add_option('-v', '--verbose', dest='verbose', help='output useful '
+        'information about what the program is doing', action='store_true',
+        default=False)
+    parser.add_option('-a', '--extract-all', dest='extractAll', help='extract '
+        'the data region of all saves into the directory specified in '
+        '--output, or \'<memory card image path>.saves\' by default (in batch '
+        'mode, a directory is made per card inside --output)',
+        action='store_true', default=False)
+    parser.add_option('-W', '--poll', dest='poll', help='poll for changes '
+        'in --watch mode rather than using inotify (e.g. for network shares, '
+        'where inotify misses changes made by other hosts)',
+        action='store_true', default=False)
+    parser.add_option('-w', '--watch', dest='watch', help='watch the given '
+        'directory for new, modified and removed memory card images, '
+        'reporting the saves changed as JSON lines', metavar='directory',
+        default=None)
+    parser.add_option('-x', '--extract', dest='extract', type='int',
+        help='extract the data region of a save (without the header) beginning '
+        'from the desired block further blocks included if it is a multiblock '
+        'save) to the file specified in --output, or \'<memory card image '
+        'path>.block_<block number>.bin\' by default', metavar='extract',
+        default=None)
+    (options, args) = parser.parse_args(argv)
+
+    # Machine readable formats are only used for listing, querying and
+    # checking
+    if options.format != 'text' and not (options.query or options.fsck):
+        options.list = True
+
+    # Recording phase timings and profiling until the program exits
+    if options.stats:
+        PhaseTimer.stats = {}
+        atexit.register(report_stats, options.stats)
+    if options.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        atexit.register(report_profile, profiler, options.profile)
+        options.jobs = 1
+        profiler.enable()
+
+    # Running the daemon - no memory card images are needed
+    if options.serve:
+        try:
+            serve(options.serve, options.cacheSize, options.verbose)
+        except Exception as e:
+            print('\n%s\n' % e, file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+
+    # Watching a directory - no memory card images are needed
+    if options.watch:
+        if not os.path.isdir(options.watch):
+            print(parser.get_usage() + '\nThe directory to watch (\'%s\') '
+                  'does not exist\n' % options.watch, file=sys.stderr)
+            sys.exit(2)
+        watch(options.watch, options.poll, options.verbose)
+        sys.exit(0)
+
+    # Querying - an existing card index can be queried as a whole, so cards
+    # needn't be passed. Exiting like grep
+    if options.query:
+        if not (args or options.index and os.path.exists(options.index)):
+            print(parser.get_usage() + '\nMemory card images or an existing '
+                  'card index (--index) must be passed to query\n',
+                  file=sys.stderr)
+            sys.exit(2)
+        try:
+            filters = query_filters(options.productCode, options.country,
+                                    options.title, options.status,
+                                    options.saveLength)
+            matches, failures = query(args, filters, options.index,
+                                      options.jobs, options.verbose,
+                                      options.format)
+        except Exception as e:
+            print('\n%s\n' % e, file=sys.stderr)
+            sys.exit(2)
+        sys.exit(2 if failures else 0 if matches else 1)
+
+    # Checking cards for corruption - exiting like fsck
+    if options.fsck:
+        if not args or options.format not in ('text', 'jsonl'):
+            print(parser.get_usage() + '\nMemory card images must be passed '
+                  'to check, and reports are text or jsonl\n',
+                  file=sys.stderr)
+            sys.exit(FSCK_EXIT_USAGE)
+        sys.exit(fsck(args, options.repair, options.jobs, options.verbose,
+                      options.format))
+
+    if args:
+
+        # Making sure only one mode is used at once
+        editing = (options.delete is not None or
+                   options.undelete is not None or
+                   bool(options.importSave) or options.repair)
+        if (options.list + bool(options.extract) + options.extractAll +
+                bool(options.index) + editing + options.diff +
+                options.defragment + options.recover +
+                bool(options.icons) + bool(options.convertTo)) > 1:
+            print(parser.get_usage() + '\nOnly one mode can be enabled at '
+                  'once\n', file=sys.stderr)
+            sys.exit(1)
+
+        if options.diff:
+
+            # Comparing cards pairwise - exiting with 1 if any differ, like
+            # diff
+            if len(args) % 2:
+                print(parser.get_usage() + '\nMemory card images must be '
+                      'compared in pairs\n', file=sys.stderr)
+                sys.exit(2)
+            sys.exit(1 if diff(args, options.verbose) else 0)
+
+        if options.defragment:
+
+            # Defragmenting all cards - exiting with an error if any failed
+            if defragment(args, options.dryRun, options.jobs, options.verbose):
+                sys.exit(1)
+            sys.exit(0)
 
-        # Turning into an absolute path
-        outputPath = os.path.abspath(outputPath)
+        if options.icons:
 
-        # Extracting
-        memoryCard.extract(options.extract, outputPath)
+            # Rendering icons of all cards - exiting with an error if any
+            # failed
+            if batch_extract_icons(args, options.icons, options.deleted,
+                                   options.jobs, options.verbose):
+                sys.exit(1)
+            sys.exit(0)
 
-    elif options.list:
+        if options.convertTo:
+
+            # Converting all cards - exiting with an error if any failed
+            if convert(args, options.convertTo, options.output, options.jobs,
+                       options.verbose):
+                sys.exit(1)
+            sys.exit(0)
+
+        if options.recover:
+
+            # Sweeping all cards - exiting with an error if any failed
+            if recover(args, options.jobs, options.verbose):
+                sys.exit(1)
+            sys.exit(0)
+
+        if options.index:
+
+            # Indexing all cards - exiting with an error if any failed
+            if index(args, options.index, options.jobs, options.verbose):
+                sys.exit(1)
+            sys.exit(0)
+
+        if options.batch:
+
+            # Extraction is per-card, so it can't be done in batch mode
+            if options.extract:
+                print(parser.get_usage() + '\nExtraction can\'t be done in '
+                      'batch mode\n', file=sys.stderr)
+                sys.exit(1)
+
+            # Extracting all saves from all cards - exiting with an error if
+            # any failed
+            if options.extractAll:
+                if batch_extract_all(args, options.output, options.deleted,
+                                     options.jobs, options.verbose):
+                    sys.exit(1)
+                sys.exit(0)
+
+            # Analysing all cards - exiting with an error if any failed
+            if batch(args, options.list, options.jobs, options.verbose,
+                     options.format, options.perSave):
+                sys.exit(1)
+            sys.exit(0)
+
+        # Verbose output
+        if options.verbose:
+            print('Memory card to analyse: \'%s\'' % args[0])
+
+        # Instantiating memory card
+        memoryCard = PS1Card(args[0], memoryMap=options.mmap and not editing,
+                             verbose=options.verbose, writable=editing)
+
+        if editing:
+
+            # Editing the memory card - several edits can be made at once
+            try:
+                if options.delete is not None:
+                    memoryCard.delete_save(options.delete)
+                if options.undelete is not None:
+                    memoryCard.undelete_save(options.undelete)
+                if options.importSave:
+                    print('Save imported to block %d' %
+                          memoryCard.import_save(options.importSave))
+                if options.repair:
+                    print('%d control block frames repaired' %
+                          len(memoryCard.repair_checksums()))
+                    if memoryCard.invalid_frames():
+                        print('Warning: The passed memory card \'%s\' '
+                              'contains control block frames that can\'t be '
+                              'safely repaired (frames %s) - see --fsck' %
+                              (args[0], format_numbers(
+                                  memoryCard.invalid_frames())),
+                              file=sys.stderr)
+
+            except Exception as e:
+                print('\n%s\n' % e, file=sys.stderr)
+                sys.exit(1)
+
+            # Writing only what changed
+            print('%d bytes written' % memoryCard.save())
+
+        elif options.extract:
+
+            # Extracting block(s) from memory card image
+            # Validating block requested (tests such as '<block number> in
+            # memoryCard' seem to fail as this works on identities rather than
+            # just the number?)
+            try:
+                block = memoryCard[options.extract]
+
+            except Exception:
+
+                print('\nThe requested block to extract (\'%s\') is not valid\n'
+                      % options.extract, file=sys.stderr)
+                sys.exit(1)
+
+            # Making sure the passed block is the first block of a save, or at
+            # least a deleted block
+            if (block.blockStatus != 'First block' and
+                block.blockStatus != 'Deleted block'):
+                print('\nThe requested block to extract (\'%s\') is neither '
+                      'the first block of a save or a deleted block - status: '
+                      '\'%s\'n'
+                      % (options.extract, block.blockStatus), file=sys.stderr)
+                sys.exit(1)
+
+            # Determining outputPath
+            if options.output:
+                outputPath = options.output
+            else:
+                outputPath = '%s.block_%d.bin' % (args[0], options.extract)
+
+            # Turning into an absolute path
+            outputPath = os.path.abspath(outputPath)
+
+            # Extracting
+            memoryCard.extract(options.extract, outputPath)
+
+        elif options.extractAll:
+
+            # Extracting all saves to the output directory
+            outputPaths = memoryCard.extract_all(os.path.abspath(
+                options.output or args[0] + '.saves'), options.deleted)
+            print('%d saves extracted' % len(outputPaths))
+
+        elif options.list:
+
+            # Listing contents
+            if options.format == 'text':
+                memoryCard.list()
+            else:
+                recordWriter = RecordWriter(sys.stdout, options.format)
+                for record in memoryCard.records(options.perSave):
+                    recordWriter.write(record)
+
+        else:
 
-        # Listing contents
-        memoryCard.list()
+            # Invalid options
+            parser.print_help()
 
     else:
 
-        # Invalid options
+        # Optparse does not properly deal with no arguments, so this needs to be
+        # manually handled
         parser.print_help()
 
-else:
 
-    # Optparse does not properly deal with no arguments, so this needs to be
-    # manually handled
-    parser.print_help()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,662 @@
+#!/usr/bin/env python3
+
+'''
+Copyright (c) 2013, OmegaPhil - OmegaPhil+memcard-analyser@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# Regression tests for memcardanalyser - run with 'python3 -m unittest'
+
+import contextlib
+import io
+import json
+import os.path
+import re
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+import memcardanalyser
+from memcardanalyser import (BLOCK_0_MAGIC, BLOCK_0_XOR, BLOCK_NORMAL_MAGIC,
+                             BLOCK_SIZE, FRAME_SIZE, LINK_NONE, PS1Card)
+
+
+def build_card(saves, deleted=(), titles=()):
+    '''Returns the bytes of a memory card image holding the passed saves and
+    deleted saves - lists of the blocks making up each save, in order. Saves
+    are given the passed (Shift-JIS encoded) titles in turn'''
+
+    image = bytearray(BLOCK_SIZE * 16)
+    image[:len(BLOCK_0_MAGIC)] = BLOCK_0_MAGIC
+    image[FRAME_SIZE - 1] = BLOCK_0_XOR
+
+    # Unused blocks
+    for blockNumber in range(1, 16):
+        frame = bytearray(FRAME_SIZE)
+        frame[0] = 0xA0
+        frame[8:10] = LINK_NONE.to_bytes(2, 'little')
+        image[blockNumber * FRAME_SIZE:(blockNumber + 1) * FRAME_SIZE] = frame
+
+    # Save chains - the data of each block records its save and position
+    for saveNumber, chain in enumerate(list(saves) + list(deleted)):
+        isDeleted = saveNumber >= len(saves)
+        for position, blockNumber in enumerate(chain):
+            frame = bytearray(FRAME_SIZE)
+            if position == 0:
+                frame[0] = 0x51
+                frame[4:8] = (len(chain) * BLOCK_SIZE).to_bytes(4, 'little')
+                frame[10:22] = b'BESLES-%05d' % saveNumber
+            else:
+                frame[0] = 0x53 if position == len(chain) - 1 else 0x52
+            if isDeleted:
+                frame[0] = memcardanalyser.DELETED_STATUS[frame[0]]
+            link = (chain[position + 1] - 1 if position < len(chain) - 1
+                    else LINK_NONE)
+            frame[8:10] = link.to_bytes(2, 'little')
+            image[blockNumber * FRAME_SIZE:
+                  (blockNumber + 1) * FRAME_SIZE] = frame
+            data = bytes((saveNumber, position)) * (BLOCK_SIZE // 2)
+            image[blockNumber * BLOCK_SIZE:
+                  (blockNumber + 1) * BLOCK_SIZE] = data
+            if position == 0:
+                image[blockNumber * BLOCK_SIZE:
+                      blockNumber * BLOCK_SIZE + 4] = (
+                    BLOCK_NORMAL_MAGIC + bytes((0x11, len(chain))))
+                title = (titles[saveNumber] if saveNumber < len(titles)
+                         else 'SAVE %d' % saveNumber).encode('shift-jis')
+                image[blockNumber * BLOCK_SIZE + 4:
+                      blockNumber * BLOCK_SIZE + 68] = title.ljust(64,
+                                                                   b'\x00')
+
+    # Directory frame checksums
+    for frameNumber in range(1, 16):
+        xor_frame(image, frameNumber)
+    return bytes(image)
+
+
+def xor_frame(image, frameNumber):
+    '''Sets the checksum of the control block frame of the passed image (a
+    bytearray)'''
+
+    checksum = 0
+    for byte in image[frameNumber * FRAME_SIZE:
+                      (frameNumber + 1) * FRAME_SIZE - 1]:
+        checksum ^= byte
+    image[(frameNumber + 1) * FRAME_SIZE - 1] = checksum
+
+
+def edit_frame(image, blockNumber, status=None, linkedBlock=None):
+    '''Changes the status and/or next block link (LINK_NONE for none) of the
+    passed block in the image (a bytearray), keeping its checksum valid'''
+
+    offset = blockNumber * FRAME_SIZE
+    if status is not None:
+        image[offset] = status
+    if linkedBlock is not None:
+        link = LINK_NONE if linkedBlock == LINK_NONE else linkedBlock - 1
+        image[offset + 8:offset + 10] = link.to_bytes(2, 'little')
+    xor_frame(image, blockNumber)
+
+
+def build_save(length, fileName=b'BESLES-99999IMPORT'):
+    '''Returns the bytes of a single save in MCS format of the passed length
+    in blocks'''
+
+    frame = bytearray(FRAME_SIZE)
+    frame[0] = 0x51
+    frame[4:8] = (length * BLOCK_SIZE).to_bytes(4, 'little')
+    frame[8:10] = LINK_NONE.to_bytes(2, 'little')
+    frame[10:10 + len(fileName)] = fileName
+    blocks = bytearray(b'\xee' * (length * BLOCK_SIZE))
+    blocks[:4] = BLOCK_NORMAL_MAGIC + bytes((0x11, length))
+    blocks[4:68] = b'IMPORTED'.ljust(64, b'\x00')
+    return bytes(frame + blocks)
+
+
+class CardTestCase(unittest.TestCase):
+    '''Provides a temporary directory to write card images to'''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_card(self, image, name='card.mcd'):
+        '''Writes the image to the temporary directory, returning its path'''
+
+        cardPath = os.path.join(self.directory, name)
+        with open(cardPath, 'wb') as cardFile:
+            cardFile.write(image)
+        return cardPath
+
+
+class LoadTest(CardTestCase):
+
+    def summaries(self, cardPath, **options):
+        '''Returns the summaries of the card's blocks'''
+
+        with PS1Card(cardPath, **options) as memoryCard:
+            return [block.summary() for block in memoryCard._blocks[1:]]
+
+    def test_memory_mapped_and_lazy_cards_match(self):
+        cardPath = self.write_card(build_card([[1, 4, 2], [3]],
+                                              deleted=[[5]]))
+        summaries = self.summaries(cardPath)
+        self.assertEqual(summaries[0]['title'], 'SAVE 0')
+        self.assertEqual(self.summaries(cardPath, memoryMap=True), summaries)
+        self.assertEqual(self.summaries(cardPath, memoryMap=True, lazy=True),
+                         summaries)
+        with self.assertRaisesRegex(Exception, 'memory mapped'):
+            PS1Card(cardPath, memoryMap=True, writable=True)
+
+
+class FormatTest(CardTestCase):
+
+    def test_formats_are_detected(self):
+        image = build_card([[1, 2]])
+        headers = {'mcd': b'',
+                   'gme': memcardanalyser.gme_header(image[:BLOCK_SIZE]),
+                   'vgs': memcardanalyser.VGS_MAGIC.ljust(
+                       memcardanalyser.VGS_HEADER_SIZE, b'\x00'),
+                   'vmp': memcardanalyser.VMP_MAGIC.ljust(
+                       memcardanalyser.VMP_HEADER_SIZE, b'\x00')}
+        with PS1Card(self.write_card(image)) as memoryCard:
+            summaries = [block.summary() for block in memoryCard._blocks[1:]]
+        for name, header in headers.items():
+            with self.subTest(format=name):
+                cardPath = self.write_card(header + image, 'card.' + name)
+                self.assertEqual(memcardanalyser.probe_card_file(
+                    cardPath)['name'], name)
+                with PS1Card(cardPath) as memoryCard:
+                    self.assertEqual(memoryCard.format, name)
+                    self.assertEqual([block.summary() for block in
+                                      memoryCard._blocks[1:]], summaries)
+
+        # Single saves are recognised, but aren't memory cards
+        savePath = self.write_card(build_save(2), 'save.mcs')
+        self.assertEqual(memcardanalyser.probe_card_file(savePath)['name'],
+                         'mcs')
+        self.assertIsNone(memcardanalyser.detect_format(b'\x00' * 16,
+                                                        len(image)))
+
+    def test_registered_format_is_loaded(self):
+        formats = dict(memcardanalyser.CARD_FORMATS)
+        extensions = memcardanalyser.CARD_EXTENSIONS
+        self.addCleanup(setattr, memcardanalyser, 'CARD_EXTENSIONS',
+                        extensions)
+        self.addCleanup(memcardanalyser.CARD_FORMATS.pop, 'test', None)
+        memcardanalyser.register_format(
+            'test', memcardanalyser.magic_probe(b'TEST'), 16,
+            memcardanalyser.IMAGE_SIZE + 16, ('.tst',))
+        self.assertEqual(list(memcardanalyser.CARD_FORMATS),
+                         list(formats) + ['test'])
+        cardPath = self.write_card(b'TEST'.ljust(16, b'\x00') +
+                                   build_card([[1]]), 'card.tst')
+        self.assertEqual(list(memcardanalyser.iterate_card_paths(
+            [self.directory])), [cardPath])
+        with PS1Card(cardPath) as memoryCard:
+            self.assertEqual(memoryCard.format, 'test')
+            self.assertEqual(memoryCard[1].title, 'SAVE 0')
+
+
+class TitleTest(unittest.TestCase):
+
+    def test_titles_end_at_control_characters(self):
+        self.assertEqual(memcardanalyser.decode_title(b'SAVE\x00OLD'), 'SAVE')
+        self.assertEqual(memcardanalyser.decode_title(b'SAVE\nOLD'), 'SAVE')
+        title = 'ＳＡＶＥ'.encode('shift-jis')
+        self.assertEqual(memcardanalyser.decode_title(title), 'ＳＡＶＥ')
+        self.assertEqual(memcardanalyser.decode_title(title, normalise=True),
+                         'SAVE')
+
+    def test_titles_are_cached(self):
+        title = bytearray('キャッシュ'.encode('shift-jis'))
+        memcardanalyser.decode_title(title)
+        hits = memcardanalyser._decode_title.cache_info().hits
+        self.assertEqual(memcardanalyser.decode_title(memoryview(title)),
+                         'キャッシュ')
+        self.assertEqual(memcardanalyser._decode_title.cache_info().hits,
+                         hits + 1)
+
+
+class ArchiveTest(CardTestCase):
+
+    def test_archive_members_are_cards(self):
+        image = build_card([[1], [2, 3]])
+        cardPath = self.write_card(image)
+        zipPath = os.path.join(self.directory, 'cards.zip')
+        with zipfile.ZipFile(zipPath, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.write(cardPath, 'cards/zipped.mcd')
+            archive.writestr('cards/readme.txt', 'Not a card')
+        tarPath = os.path.join(self.directory, 'cards.tar.gz')
+        with tarfile.open(tarPath, 'w:gz') as archive:
+            archive.add(cardPath, 'tarred.mcd')
+        os.remove(cardPath)
+
+        memberPaths = list(memcardanalyser.iterate_card_paths(
+            [self.directory]))
+        self.assertEqual(memberPaths, [tarPath + '::tarred.mcd',
+                                       zipPath + '::cards/zipped.mcd'])
+        for memberPath in memberPaths:
+            with PS1Card(memberPath) as memoryCard:
+                self.assertEqual(memoryCard[2].title, 'SAVE 1')
+                self.assertEqual(memoryCard.save_chain(2), [2, 3])
+            with PS1Card(memberPath, memoryMap=True) as memoryCard:
+                self.assertEqual(memoryCard.block_data(1).tobytes(),
+                                 image[BLOCK_SIZE:2 * BLOCK_SIZE])
+
+        # Cards in archives can't be edited, and missing members are errors
+        with self.assertRaisesRegex(Exception, 'inside an archive'):
+            PS1Card(memberPaths[0], writable=True)
+        self.assertFalse(memcardanalyser.card_exists(zipPath + '::missing.mcd'))
+        with self.assertRaises(Exception):
+            PS1Card(zipPath + '::missing.mcd')
+
+
+class DefragmentTest(CardTestCase):
+
+    def test_contiguous_card_has_empty_plan(self):
+
+        # Saves are contiguous, with a free hole at block 1
+        cardPath = self.write_card(build_card([[2, 3], [4], [5, 6, 7]]))
+        with PS1Card(cardPath) as memoryCard:
+            plan = memoryCard.defragment_plan()
+        self.assertEqual(plan['moves'], [])
+        self.assertEqual(plan['freed'], [])
+        self.assertEqual(plan['discarded'], [])
+        self.assertEqual(plan['bytesMoved'], 0)
+
+    def test_fragmented_save_prefers_free_blocks(self):
+
+        # The deleted save at block 1 must survive the move
+        cardPath = self.write_card(build_card([[2, 3], [4, 6]],
+                                              deleted=[[1]]))
+        with PS1Card(cardPath) as memoryCard:
+            plan = memoryCard.defragment_plan()
+        self.assertEqual(plan['moves'], [(6, 5)])
+        self.assertEqual(plan['freed'], [6])
+        self.assertEqual(plan['discarded'], [])
+
+    def test_defragment_links_moved_save(self):
+        cardPath = self.write_card(build_card([[1, 3], [2]]))
+        with PS1Card(cardPath, writable=True) as memoryCard:
+            plan = memoryCard.defragment()
+            memoryCard.save()
+        self.assertEqual(len(plan['moves']), 2)
+        with PS1Card(cardPath) as memoryCard:
+            self.assertEqual(memoryCard.chain_problems(), {})
+            chains = memoryCard.chain_index()
+            for firstBlock in chains:
+                chain = chains[firstBlock]
+                self.assertEqual(chain, list(range(chain[0],
+                                                   chain[0] + len(chain))))
+
+    def test_defragmented_card_is_clean(self):
+
+        # Block 1 holds the header of the save moved out of it
+        cardPath = self.write_card(build_card([[1, 3], [2]]))
+        with PS1Card(cardPath, writable=True) as memoryCard:
+            plan = memoryCard.defragment()
+            memoryCard.save()
+        self.assertEqual(plan['freed'], [1])
+        with open(cardPath, 'rb') as cardFile:
+            image = cardFile.read()
+        self.assertEqual(memcardanalyser.check_card_image(image)[1], [])
+        self.assertEqual(image[BLOCK_SIZE:BLOCK_SIZE + FRAME_SIZE],
+                         bytes(FRAME_SIZE))
+
+
+class RepairTest(CardTestCase):
+
+    def test_stale_directory_frame_is_not_repaired(self):
+
+        # Frame 13 of the sample card fails its checksum and has a stale next
+        # block link - making it valid would break the GT2 save at block 12
+        samplePath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'psx_memory_card_06 [9A5D0A15].mcd')
+        with open(samplePath, 'rb') as sampleFile:
+            cardPath = self.write_card(sampleFile.read())
+        with contextlib.redirect_stdout(io.StringIO()):
+            with PS1Card(cardPath, writable=True) as memoryCard:
+                self.assertEqual(memoryCard.repair_checksums(), [])
+                self.assertEqual(memoryCard.save(), 0)
+            with PS1Card(cardPath) as memoryCard:
+                self.assertEqual(memoryCard.chain_problems(), {})
+                self.assertEqual(memoryCard.chain_index()[12],
+                                 [12, 13, 14, 15])
+
+    def test_corrupted_checksum_is_repaired(self):
+        image = bytearray(build_card([[1, 2], [3]]))
+        image[2 * FRAME_SIZE + FRAME_SIZE - 1] ^= 0x01
+        cardPath = self.write_card(image)
+        with contextlib.redirect_stdout(io.StringIO()):
+            with PS1Card(cardPath, writable=True) as memoryCard:
+                self.assertEqual(memoryCard.repair_checksums(), [2])
+                memoryCard.save()
+        with open(cardPath, 'rb') as cardFile:
+            self.assertEqual(cardFile.read(), build_card([[1, 2], [3]]))
+
+
+class WriteRangesTest(CardTestCase):
+
+    def test_unsaved_edits_are_written(self):
+        cardPath = self.write_card(build_card([[1], [2]]))
+        outputPath = os.path.join(self.directory, 'edited.mcd')
+        with PS1Card(cardPath, writable=True) as memoryCard:
+            memoryCard.delete_save(2)
+            memoryCard.write_ranges([(0, memcardanalyser.IMAGE_SIZE)],
+                                    outputPath)
+        with PS1Card(outputPath) as memoryCard:
+            self.assertEqual(memoryCard[2]._blockStatus, 0xA1)
+
+
+class ChainTest(CardTestCase):
+
+    def chain(self, image, blockNumber):
+        '''Returns the (chain, problem) of the save starting at the block'''
+
+        with PS1Card(self.write_card(image)) as memoryCard:
+            return (memoryCard.chain_index()[blockNumber],
+                    memoryCard.chain_problems().get(blockNumber))
+
+    def test_intact_chains(self):
+        image = build_card([[1, 4, 2]], deleted=[[3, 6]])
+        self.assertEqual(self.chain(image, 1), ([1, 4, 2], None))
+        self.assertEqual(self.chain(image, 3), ([3, 6], None))
+
+    def test_cycle(self):
+        image = bytearray(build_card([[1, 2, 3]]))
+        edit_frame(image, 3, status=0x52, linkedBlock=2)
+        chain, problem = self.chain(image, 1)
+        self.assertEqual(chain, [1, 2, 3])
+        self.assertIn('links back to block 2', problem)
+
+    def test_dangling_link(self):
+        image = bytearray(build_card([[1, 2]]))
+        edit_frame(image, 2, status=0x52, linkedBlock=17)
+        chain, problem = self.chain(image, 1)
+        self.assertEqual(chain, [1, 2])
+        self.assertIn('doesn\'t exist', problem)
+
+    def test_live_chain_into_deleted_blocks(self):
+        image = bytearray(build_card([[1, 2]], deleted=[[3, 4]]))
+        edit_frame(image, 1, linkedBlock=4)
+        chain, problem = self.chain(image, 1)
+        self.assertEqual(chain, [1])
+        self.assertIn('Deleted last block', problem)
+
+    def test_deleted_chain_into_live_blocks(self):
+        image = bytearray(build_card([[1, 2]], deleted=[[3, 4]]))
+        edit_frame(image, 3, linkedBlock=2)
+        chain, problem = self.chain(image, 3)
+        self.assertEqual(chain, [3])
+        self.assertIn('Last block', problem)
+
+
+class ImportSaveTest(CardTestCase):
+
+    def test_import_discards_rest_of_deleted_save(self):
+
+        # Only block 6 is unused - the import needs a block of the deleted
+        # save 5 -> 4 too, and the rest of that save must not link into it
+        cardPath = self.write_card(build_card(
+            [[1], [2], [3]] + [[blockNumber] for blockNumber in range(7, 16)],
+            deleted=[[5, 4]]))
+        savePath = os.path.join(self.directory, 'save.mcs')
+        with open(savePath, 'wb') as saveFile:
+            saveFile.write(build_save(2))
+        with PS1Card(cardPath, writable=True) as memoryCard:
+            firstBlock = memoryCard.import_save(savePath)
+            memoryCard.save()
+        with PS1Card(cardPath) as memoryCard:
+            chain = memoryCard.chain_index()[firstBlock]
+            self.assertEqual(sorted(chain), [5, 6])
+            self.assertEqual(memoryCard.chain_problems(), {})
+            leftOver = ({4, 5, 6} - set(chain)).pop()
+            self.assertEqual(memoryCard[leftOver]._blockStatus, 0xA0)
+        with open(cardPath, 'rb') as cardFile:
+            self.assertEqual(memcardanalyser.check_card_image(
+                cardFile.read())[1], [])
+
+    def test_import_prefers_unused_blocks(self):
+        cardPath = self.write_card(build_card([[1]], deleted=[[2, 3]]))
+        savePath = os.path.join(self.directory, 'save.mcs')
+        with open(savePath, 'wb') as saveFile:
+            saveFile.write(build_save(2))
+        with PS1Card(cardPath, writable=True) as memoryCard:
+            firstBlock = memoryCard.import_save(savePath)
+            self.assertEqual(memoryCard.chain_index()[firstBlock], [4, 5])
+            self.assertEqual(memoryCard.chain_index()[2], [2, 3])
+
+    def test_undelete_broken_save_raises(self):
+
+        # The deleted save at block 5 links into the live save 3 -> 4
+        image = bytearray(build_card([[3, 4]], deleted=[[5, 6]]))
+        edit_frame(image, 5, linkedBlock=4)
+        cardPath = self.write_card(image)
+        with PS1Card(cardPath, writable=True) as memoryCard:
+            with self.assertRaisesRegex(Exception, 'broken'):
+                memoryCard.undelete_save(5)
+
+
+class ConvertTest(CardTestCase):
+
+    def test_round_trip(self):
+        image = build_card([[1, 4, 2], [3]], deleted=[[5]])
+        cardPath = self.write_card(image)
+        gmeDirectory = os.path.join(self.directory, 'gme')
+        mcdDirectory = os.path.join(self.directory, 'mcd')
+        gmePath = memcardanalyser.convert_card(cardPath, 'gme',
+                                               gmeDirectory)[1]
+        mcdPath = memcardanalyser.convert_card(gmePath, 'mcd',
+                                               mcdDirectory)[1]
+        with open(gmePath, 'rb') as cardFile:
+            self.assertEqual(cardFile.read(), memcardanalyser.gme_header(
+                image[:BLOCK_SIZE]) + image)
+        with open(mcdPath, 'rb') as cardFile:
+            self.assertEqual(cardFile.read(), image)
+
+    def test_existing_file_is_kept(self):
+        cardPath = self.write_card(build_card([[1]]))
+        outputPath = self.write_card(b'kept', 'card.gme')
+        with PS1Card(cardPath) as memoryCard:
+            with self.assertRaisesRegex(Exception, 'already exists'):
+                memoryCard.convert('gme', outputPath)
+        with open(outputPath, 'rb') as cardFile:
+            self.assertEqual(cardFile.read(), b'kept')
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['card.gme', 'card.mcd'])
+
+    def test_edits_update_gme_header(self):
+        image = build_card([[1, 2], [3]])
+        cardPath = self.write_card(memcardanalyser.gme_header(
+            image[:BLOCK_SIZE]) + image, 'card.gme')
+        with PS1Card(cardPath, writable=True) as memoryCard:
+            memoryCard.delete_save(1)
+            memoryCard.save()
+        with open(cardPath, 'rb') as cardFile:
+            edited = cardFile.read()
+        controlBlock = edited[memcardanalyser.GME_HEADER_SIZE:
+                              memcardanalyser.GME_HEADER_SIZE + BLOCK_SIZE]
+        self.assertEqual(edited[:memcardanalyser.GME_HEADER_SIZE],
+                         memcardanalyser.gme_header(controlBlock))
+        self.assertEqual(controlBlock[FRAME_SIZE], 0xA1)
+
+
+class ChecksumTest(unittest.TestCase):
+
+    def test_backends_match(self):
+        samplePath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'psx_memory_card_06 [9A5D0A15].mcd')
+        with open(samplePath, 'rb') as sampleFile:
+            controlBlock = sampleFile.read(BLOCK_SIZE)
+        checksums = memcardanalyser.calculate_frame_checksums(controlBlock)
+        self.assertIsInstance(checksums, bytes)
+        self.assertEqual(checksums[2], controlBlock[3 * FRAME_SIZE - 1])
+        self.assertNotEqual(checksums[13], controlBlock[14 * FRAME_SIZE - 1])
+        if memcardanalyser.import_numpy() is None:
+            self.skipTest('NumPy is not installed')
+        self.assertEqual(memcardanalyser.calculate_frame_checksums(
+            controlBlock, useNumpy=True), checksums)
+
+
+class DirectoryTableTest(CardTestCase):
+
+    def test_blocks_match_parsed_card(self):
+        samplePath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'psx_memory_card_02 [8AA91AF4].gme')
+        cardPaths = [self.write_card(build_card([[1, 4, 2]], deleted=[[3, 6]],
+                                                titles=['ΣΑΒΕ'])),
+                     samplePath]
+        table = memcardanalyser.PS1DirectoryTable()
+        for cardPath in cardPaths:
+            with PS1Card(cardPath) as memoryCard:
+                cardIndex = table.add_card(memoryCard)
+                for block, tableBlock in zip(memoryCard._blocks[1:],
+                                             table.blocks(cardIndex)):
+                    self.assertEqual(tableBlock.summary(), block.summary())
+                    self.assertEqual(tableBlock.record(), block.record())
+        self.assertEqual(len(table), 2)
+        with self.assertRaisesRegex(Exception, 'card index'):
+            table.block(2, 1)
+
+
+class FsckTest(CardTestCase):
+
+    def corrupt(self, problem):
+        '''Returns a card image with a single problem of the passed class'''
+
+        image = bytearray(build_card([[1, 2], [3]]))
+        if problem == 'wrong-size':
+            image.append(0)
+        elif problem == 'bad-magic':
+            image[:2] = b'XX'
+        elif problem == 'invalid-status':
+            edit_frame(image, 5, status=0x42)
+        elif problem == 'checksum-mismatch':
+            image[2 * FRAME_SIZE - 1] ^= 0x01
+        elif problem == 'broken-chain':
+            edit_frame(image, 2, status=0x52, linkedBlock=17)
+        elif problem == 'length-mismatch':
+            image[FRAME_SIZE + 4:FRAME_SIZE + 8] = (
+                3 * BLOCK_SIZE).to_bytes(4, 'little')
+            xor_frame(image, 1)
+        elif problem == 'orphan-block':
+            edit_frame(image, 5, status=0x52)
+        elif problem == 'invalid-region':
+            image[FRAME_SIZE + 10:FRAME_SIZE + 12] = b'XX'
+            xor_frame(image, 1)
+        return bytes(image)
+
+    def fsck(self, paths, repair=False):
+        '''Returns the exit code of checking the cards'''
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            with contextlib.redirect_stderr(io.StringIO()):
+                return memcardanalyser.fsck(paths, repair, jobs=1)
+
+    def test_problem_classes(self):
+        for problem in memcardanalyser.FSCK_PROBLEMS:
+            with self.subTest(problem=problem):
+                problems = memcardanalyser.check_card_image(
+                    self.corrupt(problem))[1]
+                self.assertEqual([found['problem'] for found in problems],
+                                 [problem])
+                self.assertEqual(problems[0]['repairable'],
+                                 problem in memcardanalyser.FSCK_REPAIRABLE)
+
+    def test_stale_header_in_unused_block_is_clean(self):
+        image = bytearray(build_card([[1]], deleted=[[3]]))
+        edit_frame(image, 3, status=0xA0)
+        self.assertEqual(memcardanalyser.check_card_image(image)[1], [])
+
+    def test_exit_codes(self):
+        cleanPath = self.write_card(build_card([[1, 2], [3]]), 'clean.mcd')
+        self.assertEqual(self.fsck([cleanPath]), 0)
+        brokenPath = self.write_card(self.corrupt('broken-chain'),
+                                     'broken.mcd')
+        self.assertEqual(self.fsck([brokenPath]),
+                         memcardanalyser.FSCK_EXIT_UNREPAIRED)
+        self.assertEqual(self.fsck([os.path.join(self.directory,
+                                                 'missing.mcd')]),
+                         memcardanalyser.FSCK_EXIT_ERROR)
+
+        # Repaired cards are clean afterwards
+        repairablePath = self.write_card(self.corrupt('checksum-mismatch'),
+                                         'repairable.mcd')
+        self.assertEqual(self.fsck([repairablePath], repair=True),
+                         memcardanalyser.FSCK_EXIT_REPAIRED)
+        self.assertEqual(self.fsck([repairablePath]), 0)
+        self.assertEqual(self.fsck([cleanPath, brokenPath, repairablePath]),
+                         memcardanalyser.FSCK_EXIT_UNREPAIRED)
+
+        # Unreadable cards are named, alongside the reason
+        errors = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()):
+            with contextlib.redirect_stderr(errors):
+                memcardanalyser.fsck([os.path.join(self.directory,
+                                                   'missing.mcd')], jobs=1)
+        self.assertRegex(errors.getvalue(), '^%s: ' % re.escape(
+            os.path.join(self.directory, 'missing.mcd')))
+
+        # Nothing to check
+        with contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit) as context:
+                memcardanalyser.main(['-K'])
+        self.assertEqual(context.exception.code,
+                         memcardanalyser.FSCK_EXIT_USAGE)
+
+
+class QueryTest(CardTestCase):
+
+    def query(self, paths, databasePath=None, **filters):
+        '''Returns the (card file name, block number) of the matching blocks'''
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            memcardanalyser.query(paths, memcardanalyser.query_filters(
+                **filters), databasePath, jobs=1, outputFormat='jsonl')
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        return sorted((os.path.basename(record['path']),
+                       record['blockNumber']) for record in records)
+
+    def test_index_query_is_restricted_to_passed_cards(self):
+        indexedPath = self.write_card(build_card([[1], [2]]), 'indexed.mcd')
+        otherPath = self.write_card(build_card([[3]]), 'other.mcd')
+        databasePath = os.path.join(self.directory, 'index.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            memcardanalyser.index([indexedPath], databasePath, jobs=1)
+
+        # Cards missing from the index are scanned instead
+        self.assertEqual(self.query([otherPath], databasePath, status='first'),
+                         [('other.mcd', 3)])
+        self.assertEqual(self.query([], databasePath, status='first'),
+                         [('indexed.mcd', 1), ('indexed.mcd', 2)])
+
+    def test_titles_match_alike_with_and_without_index(self):
+        cardPath = self.write_card(build_card([[1], [2]],
+                                              titles=['ΣΑΒΕ', 'Other']))
+        databasePath = os.path.join(self.directory, 'index.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            memcardanalyser.index([cardPath], databasePath, jobs=1)
+        self.assertEqual(self.query([cardPath], title='σαβε'),
+                         [('card.mcd', 1)])
+        self.assertEqual(self.query([], databasePath, title='σαβε'),
+                         [('card.mcd', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()